@@ -14,6 +14,10 @@ result_backend = CELERY_REDIS_URL
 # Enabling worker pool restart
 worker_pool_restarts = True
 
+# Reserve one task at a time, so that long fetching tasks
+#   (e.g., backfill chunks) spread over all workers of a queue
+worker_prefetch_multiplier = 1
+
 # Routing
 task_routes = {
     'celery_app.celery_tasks.bitfinex_fetch_ohlcvs_all_symbols': {
@@ -25,12 +29,18 @@ task_routes = {
     'celery_app.celery_tasks.bitfinex_resume_fetch': {
         'queue': 'bitfinex_rest'
     },
+    'celery_app.celery_tasks.bitfinex_resume_fetch_live': {
+        'queue': 'bitfinex_rest'
+    },
     'celery_app.celery_tasks.bitfinex_fetch_ohlcvs_mutual_basequote': {
         'queue': 'bitfinex_rest'
     },
     'celery_app.celery_tasks.bitfinex_fetch_ohlcvs_mutual_basequote_1min': {
         'queue': 'bitfinex_rest'
     },
+    'celery_app.celery_tasks.bitfinex_retry_errors': {
+        'queue': 'bitfinex_rest'
+    },
     'celery_app.celery_tasks.binance_fetch_ohlcvs_all_symbols': {
         'queue': 'binance_rest'
     },
@@ -40,12 +50,18 @@ task_routes = {
     'celery_app.celery_tasks.binance_resume_fetch': {
         'queue': 'binance_rest'
     },
+    'celery_app.celery_tasks.binance_resume_fetch_live': {
+        'queue': 'binance_rest'
+    },
     'celery_app.celery_tasks.binance_fetch_ohlcvs_mutual_basequote': {
         'queue': 'binance_rest'
     },
     'celery_app.celery_tasks.binance_fetch_ohlcvs_mutual_basequote_1min': {
         'queue': 'binance_rest'   
     },
+    'celery_app.celery_tasks.binance_retry_errors': {
+        'queue': 'binance_rest'
+    },
     'celery_app.celery_tasks.bittrex_fetch_ohlcvs_all_symbols': {
         'queue': 'bittrex_rest'
     },
@@ -55,13 +71,27 @@ task_routes = {
     'celery_app.celery_tasks.bittrex_resume_fetch': {
         'queue': 'bittrex_rest'
     },
+    'celery_app.celery_tasks.bittrex_resume_fetch_live': {
+        'queue': 'bittrex_rest'
+    },
     'celery_app.celery_tasks.bittrex_fetch_ohlcvs_mutual_basequote': {
         'queue': 'bittrex_rest'
     },
     'celery_app.celery_tasks.bittrex_fetch_ohlcvs_mutual_basequote_1min': {
         'queue': 'bittrex_rest'
     },
+    'celery_app.celery_tasks.bittrex_retry_errors': {
+        'queue': 'bittrex_rest'
+    },
     'celery_app.celery_tasks.all_fetch_symbol_data': {
         'queue': 'all_rest'
+    },
+    # Backfill chunks are sent to the backfill queue of their exchange
+    #   (`{exchange}_backfill`), apart from the live tasks on `{exchange}_rest`
+    'celery_app.celery_tasks.backfill_ohlcvs': {
+        'queue': 'all_rest'
+    },
+    'celery_app.celery_tasks.backfill_ohlcvs_done': {
+        'queue': 'all_rest'
     }
 }
\ No newline at end of file
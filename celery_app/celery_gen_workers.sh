@@ -12,6 +12,13 @@ celery -A celery_app.celery_main worker -Q binance_rest -n binanceRestWorker@h -
 
 celery -A celery_app.celery_main worker -Q bittrex_rest -n bittrexRestWorker@h -l INFO --logfile="./logs/celery/celery_main_%n.log_$(date +'%Y-%m-%dT%H:%M:%S').log"
 
+# Backfill chunks have queues of their own, so they never hold the workers above
+celery -A celery_app.celery_main worker -Q bitfinex_backfill -n bitfinexBackfillWorker@h -l INFO --logfile="./logs/celery/celery_main_%n.log_$(date +'%Y-%m-%dT%H:%M:%S').log"
+
+celery -A celery_app.celery_main worker -Q binance_backfill -n binanceBackfillWorker@h -l INFO --logfile="./logs/celery/celery_main_%n.log_$(date +'%Y-%m-%dT%H:%M:%S').log"
+
+celery -A celery_app.celery_main worker -Q bittrex_backfill -n bittrexBackfillWorker@h -l INFO --logfile="./logs/celery/celery_main_%n.log_$(date +'%Y-%m-%dT%H:%M:%S').log"
+
 celery -A celery_app.celery_main worker -Q all_rest -c 4 -n allRestWorker@h -l INFO --logfile="./logs/celery/celery_main_%n.log_$(date +'%Y-%m-%dT%H:%M:%S').log"
 
 # Celery beat for period tasks
@@ -1,6 +1,7 @@
 # This module contains the main Celery app
 
 from celery import Celery
+from fetchers.config.constants import OHLCVS_RETRY_BASE_SECS
 
 
 # Celery main app
@@ -23,3 +24,19 @@ app.config_from_object('celery_app.celery_config')
 #         'schedule': 120.0
 #     }
 # }
+
+# Periodic retry of failed OHLCV windows
+app.conf.beat_schedule = {
+    'bitfinex_retry_errors': {
+        'task': "celery_app.celery_tasks.bitfinex_retry_errors",
+        'schedule': float(OHLCVS_RETRY_BASE_SECS)
+    },
+    'binance_retry_errors': {
+        'task': "celery_app.celery_tasks.binance_retry_errors",
+        'schedule': float(OHLCVS_RETRY_BASE_SECS)
+    },
+    'bittrex_retry_errors': {
+        'task': "celery_app.celery_tasks.bittrex_retry_errors",
+        'schedule': float(OHLCVS_RETRY_BASE_SECS)
+    }
+}
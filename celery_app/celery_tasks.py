@@ -2,12 +2,41 @@
 
 import json
 import datetime
+from celery import chord, group
 from celery_app.celery_main import app
 from common.config.constants import DEFAULT_DATETIME_STR_QUERY
-from common.helpers.datetimehelpers import str_to_datetime
+from common.helpers.datetimehelpers import datetime_to_str, str_to_datetime
+from fetchers.config.constants import \
+    BACKFILL_CHUNK_DAYS, BACKFILL_CHUNK_SYMBOLS, BACKFILL_PROGRESS_TTL_SECS, \
+    OHLCVS_LANE_BACKFILL, OHLCVS_LANE_LIVE, OHLCVS_LANE_RETRY
+from fetchers.rest.backfill import BackfillProgress, make_backfill_chunks
 from fetchers.rest.bitfinex import BitfinexOHLCVFetcher
 from fetchers.rest.bittrex import BittrexOHLCVFetcher
 from fetchers.rest.binance import BinanceOHLCVFetcher
+from fetchers.rest.retrier import OHLCVErrorsRetrier
+
+
+# REST fetcher classes by exchange name
+FETCHER_CLASSES = {
+    'bitfinex': BitfinexOHLCVFetcher,
+    'binance': BinanceOHLCVFetcher,
+    'bittrex': BittrexOHLCVFetcher
+}
+
+
+def resume_fetch_lanes(fetcher_class, lanes):
+    '''
+    Consumes only the to-fetch `lanes` of an exchange, without
+        recovering params in flight in other fetchers
+    params:
+        `fetcher_class`: REST fetcher class of the exchange
+        `lanes`: list of lane names
+    '''
+
+    fetcher = fetcher_class()
+    fetcher.only_lanes(lanes)
+    fetcher.run_resume_fetch()
+    fetcher.close_connections()
 
 
 # Fetch symbol data to get all symbols into
@@ -60,6 +89,15 @@ def bitfinex_resume_fetch():
     bitfinex_fetcher.run_resume_fetch()
     bitfinex_fetcher.close_connections()
 
+@app.task
+def bitfinex_resume_fetch_live():
+    '''
+    Consumes the live lane on Bitfinex only, without recovery
+        (e.g., to repair gaps of the WS fetcher)
+    '''
+
+    resume_fetch_lanes(BitfinexOHLCVFetcher, [OHLCVS_LANE_LIVE])
+
 @app.task
 def bitfinex_fetch_ohlcvs_mutual_basequote(start_date, end_date):
     bitfinex_fetcher = BitfinexOHLCVFetcher()
@@ -81,7 +119,21 @@ def bitfinex_fetch_ohlcvs_mutual_basequote_1min():
     end = datetime.datetime.now() - datetime.timedelta(minutes=1)
     start = end - datetime.timedelta(minutes=4)
     print(f"Celery: Fetching OHLCVs from {start} to {end}")
-    bitfinex_fetcher.run_fetch_ohlcvs_mutual_basequote(start, end, update=True)
+    bitfinex_fetcher.run_fetch_ohlcvs_mutual_basequote(
+        start, end, update=True, lane=OHLCVS_LANE_LIVE)
+
+@app.task
+def bitfinex_retry_errors():
+    '''
+    Feeds failed OHLCV windows on Bitfinex that are due for retry
+        into the retry lane and consumes that lane only
+    '''
+
+    retrier = OHLCVErrorsRetrier("bitfinex", BitfinexOHLCVFetcher)
+    fed = retrier.enqueue()
+    retrier.close_connections()
+    if fed:
+        resume_fetch_lanes(BitfinexOHLCVFetcher, [OHLCVS_LANE_RETRY])
 
 # Binance
 @app.task
@@ -119,6 +171,15 @@ def binance_resume_fetch():
     binance_fetcher.run_resume_fetch()
     binance_fetcher.close_connections()
 
+@app.task
+def binance_resume_fetch_live():
+    '''
+    Consumes the live lane on Binance only, without recovery
+        (e.g., to repair gaps of the WS fetcher)
+    '''
+
+    resume_fetch_lanes(BinanceOHLCVFetcher, [OHLCVS_LANE_LIVE])
+
 @app.task
 def binance_fetch_ohlcvs_mutual_basequote(start_date, end_date):
     binance_fetcher = BinanceOHLCVFetcher()
@@ -139,7 +200,21 @@ def binance_fetch_ohlcvs_mutual_basequote_1min():
     end = datetime.datetime.now() - datetime.timedelta(minutes=1)
     start = end - datetime.timedelta(minutes=4)
     print(f"Celery: Fetching OHLCVs from {start} to {end}")
-    binance_fetcher.run_fetch_ohlcvs_mutual_basequote(start, end, update=True)
+    binance_fetcher.run_fetch_ohlcvs_mutual_basequote(
+        start, end, update=True, lane=OHLCVS_LANE_LIVE)
+
+@app.task
+def binance_retry_errors():
+    '''
+    Feeds failed OHLCV windows on Binance that are due for retry
+        into the retry lane and consumes that lane only
+    '''
+
+    retrier = OHLCVErrorsRetrier("binance", BinanceOHLCVFetcher)
+    fed = retrier.enqueue()
+    retrier.close_connections()
+    if fed:
+        resume_fetch_lanes(BinanceOHLCVFetcher, [OHLCVS_LANE_RETRY])
 
 # Bittrex
 @app.task
@@ -177,6 +252,15 @@ def bittrex_resume_fetch():
     bittrex_fetcher.run_resume_fetch()
     bittrex_fetcher.close_connections()
 
+@app.task
+def bittrex_resume_fetch_live():
+    '''
+    Consumes the live lane on Bittrex only, without recovery
+        (e.g., to repair gaps of the WS fetcher)
+    '''
+
+    resume_fetch_lanes(BittrexOHLCVFetcher, [OHLCVS_LANE_LIVE])
+
 @app.task
 def bittrex_fetch_ohlcvs_mutual_basequote(start_date, end_date):
     bittrex_fetcher = BittrexOHLCVFetcher()
@@ -197,4 +281,130 @@ def bittrex_fetch_ohlcvs_mutual_basequote_1min():
     end = datetime.datetime.now() - datetime.timedelta(minutes=1)
     start = end - datetime.timedelta(minutes=4)
     print(f"Celery: Fetching OHLCVs from {start} to {end}")
-    bittrex_fetcher.run_fetch_ohlcvs_mutual_basequote(start, end, update=True)
+    bittrex_fetcher.run_fetch_ohlcvs_mutual_basequote(
+        start, end, update=True, lane=OHLCVS_LANE_LIVE)
+
+@app.task
+def bittrex_retry_errors():
+    '''
+    Feeds failed OHLCV windows on Bittrex that are due for retry
+        into the retry lane and consumes that lane only
+    '''
+
+    retrier = OHLCVErrorsRetrier("bittrex", BittrexOHLCVFetcher)
+    fed = retrier.enqueue()
+    retrier.close_connections()
+    if fed:
+        resume_fetch_lanes(BittrexOHLCVFetcher, [OHLCVS_LANE_RETRY])
+
+# All exchanges
+@app.task(bind=True)
+def backfill_ohlcvs(
+        self, exchange, start_date, end_date, symbols=None,
+        chunk_symbols=BACKFILL_CHUNK_SYMBOLS, chunk_days=BACKFILL_CHUNK_DAYS
+    ):
+    '''
+    Backfills OHLCVs of an exchange by splitting symbols and dates
+        into chunks and fanning them out as a chord of
+        `backfill_ohlcvs_chunk` tasks across the workers of
+        the backfill queue of the exchange (`{exchange}_backfill`),
+        so that they never hold the workers of live tasks;
+        Returns the backfill id to follow its progress with
+        (the id of this task)
+    params (all params are str because Celery serializes args):
+        `exchange`: name of the exchange
+        `start_date`: string of datetime
+        `end_date`: string of datetime
+        `symbols`: list of symbols; all symbols if not provided
+        `chunk_symbols`: max number of symbols per chunk
+        `chunk_days`: max number of days per chunk
+    '''
+
+    fetcher = FETCHER_CLASSES[exchange]()
+    if symbols is None:
+        # Have to fetch symbol data first to
+        # make sure it's up-to-date
+        fetcher.fetch_symbol_data()
+        # Half-open symbols are not probed by chunks: they would
+        #   fetch every page of them
+        symbols = fetcher.skip_open_circuits(
+            fetcher.symbol_data.keys(), probe=False)
+    elif isinstance(symbols, str):
+        symbols = json.loads(symbols)
+    fetcher.close_connections()
+
+    # The dates need to be de-serialized
+    start_date = str_to_datetime(start_date, f=DEFAULT_DATETIME_STR_QUERY)
+    end_date = str_to_datetime(end_date, f=DEFAULT_DATETIME_STR_QUERY)
+    chunks = make_backfill_chunks(
+        symbols, start_date, end_date,
+        int(chunk_symbols), datetime.timedelta(days=int(chunk_days))
+    )
+
+    backfill_id = self.request.id
+    BackfillProgress(backfill_id).start(exchange, len(chunks))
+    queue = f'{exchange}_backfill'
+    chord(
+        group(
+            backfill_ohlcvs_chunk.s(
+                backfill_id, exchange, chunk,
+                datetime_to_str(chunk_start, DEFAULT_DATETIME_STR_QUERY),
+                datetime_to_str(chunk_end, DEFAULT_DATETIME_STR_QUERY)
+            ).set(queue=queue)
+            for chunk, chunk_start, chunk_end in chunks
+        )
+    )(backfill_ohlcvs_done.s(backfill_id))
+    print(f"Celery: Backfill {backfill_id} of {exchange} fanned out in {len(chunks)} chunks")
+    return backfill_id
+
+@app.task(bind=True)
+def backfill_ohlcvs_chunk(self, backfill_id, exchange, symbols, start_date, end_date):
+    '''
+    Fetches OHLCVs of a chunk of a backfill through to-fetch keys
+        of its own (see `use_backfill_keys`), so it consumes only
+        its own params and finishes when they are done;
+        Returns whether the chunk succeeded (it did not fail or drain)
+    params (all params are str because Celery serializes args):
+        `backfill_id`: id of the backfill
+        `exchange`: name of the exchange
+        `symbols`: list of symbols
+        `start_date`: string of datetime
+        `end_date`: string of datetime
+    '''
+
+    fetcher = FETCHER_CLASSES[exchange]()
+    fetcher.use_backfill_keys(backfill_id, self.request.id)
+    fetcher.use_parallel_sink(bulk_load=True)
+    # The dates need to be de-serialized
+    start_date = str_to_datetime(start_date, f=DEFAULT_DATETIME_STR_QUERY)
+    end_date = str_to_datetime(end_date, f=DEFAULT_DATETIME_STR_QUERY)
+    success = True
+    try:
+        fetcher.run_fetch_ohlcvs(
+            symbols, start_date, end_date, lane=OHLCVS_LANE_BACKFILL)
+        success = not fetcher.draining
+    except Exception as exc:
+        success = False
+        fetcher.logger.warning(
+            f"Backfill {backfill_id}: chunk from {start_date} to {end_date} failed: {exc}")
+    finally:
+        # Params left over are not picked up by anything else
+        fetcher._expire_tofetch_redis(BACKFILL_PROGRESS_TTL_SECS)
+        fetcher.close_connections()
+    progress = BackfillProgress(backfill_id)
+    progress.chunk_done(failed=not success)
+    print(f"Celery: {progress.describe()}")
+    return success
+
+@app.task
+def backfill_ohlcvs_done(results, backfill_id):
+    '''
+    Reports the aggregate progress of a backfill once all its chunks finished
+    params:
+        `results`: list of results of chunk tasks
+        `backfill_id`: id of the backfill
+    '''
+
+    progress = BackfillProgress(backfill_id)
+    print(f"Celery: Finished {progress.describe()}")
+    return progress.get()
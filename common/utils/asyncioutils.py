@@ -4,7 +4,7 @@ import traceback
 import asyncio
 from signal import Signals
 from threading import Thread
-from typing import Any
+from typing import Any, Callable
 from fetchers.config.constants import ASYNC_SIGNALS
 
 
@@ -49,17 +49,28 @@ async def aio_shutdown(loop: asyncio.AbstractEventLoop, signal: Signals=None) ->
     print(f"Flushing metrics")
     loop.stop()
 
-def aio_set_exception_handler(loop: asyncio.AbstractEventLoop) -> None:
+def aio_set_exception_handler(
+        loop: asyncio.AbstractEventLoop,
+        on_signal: Callable[[Signals], None]=None
+    ) -> None:
     '''
     Sets exception handler for a loop
 
+    :params:
+        `loop`: asyncio event loop
+        `on_signal`: callable, called with the signal on `ASYNC_SIGNALS`;
+            `aio_shutdown` is used if not provided
+
     Source: https://www.roguelynn.com/words/asyncio-exception-handling/
     '''
 
     for s in ASYNC_SIGNALS:
-        loop.add_signal_handler(
-            s, lambda s=s: asyncio.create_task(aio_shutdown(loop, signal=s))
-        )
+        if on_signal is None:
+            loop.add_signal_handler(
+                s, lambda s=s: asyncio.create_task(aio_shutdown(loop, signal=s))
+            )
+        else:
+            loop.add_signal_handler(s, on_signal, s)
     loop.set_exception_handler(aio_handle_exception)
 
 
@@ -1,5 +1,6 @@
 # This module contains constants
 
+import os
 import signal
 from dotenv import dotenv_values 
 
@@ -26,10 +27,32 @@ HTTPX_DEFAULT_RETRIES = 12
 # Asyncio signals
 ASYNC_SIGNALS = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
 
+# Seconds a REST fetcher has to drain after an asyncio signal
+#   before its outstanding tasks are cancelled
+REST_DRAIN_TIMEOUT_SECS = 20
+
 # REST/WS rate limit Redis keys
 REST_RATE_LIMIT_REDIS_KEY = "rest_rate_limit_{exchange}"
 WS_RATE_LIMIT_REDIS_KEY = "ws_rate_limit_{exchange}"
 
+# REST backoff Redis hash key and pub/sub channel
+# Backoff state (e.g., after a 429/418) is kept in the hash and
+#   its changes are published to all fetchers on the channel
+REST_BACKOFF_REDIS_KEY = "rest_backoff_{exchange}"
+REST_BACKOFF_CHANNEL = "rest_backoff_channel_{exchange}"
+REST_BACKOFF_RESYNC_SECS = 5.0
+
+# Redis server clock
+# The offset of the local monotonic clock to the Redis server clock
+#   is re-measured every `REDIS_CLOCK_RESYNC_SECS`, keeping the sample
+#   with the smallest round trip out of `REDIS_CLOCK_SYNC_SAMPLES`;
+#   The error bound of an offset grows by `REDIS_CLOCK_DRIFT_RATE`
+#   seconds per second since it was measured; Re-measurements forced
+#   by a caller's error bound take a single sample
+REDIS_CLOCK_RESYNC_SECS = 60.0
+REDIS_CLOCK_SYNC_SAMPLES = 3
+REDIS_CLOCK_DRIFT_RATE = 1e-4
+
 # Websocket Redis keys
 # Sub is for storing temp subscribed ws data to update psql db later
 # Serve is for serving real time data to our web service
@@ -39,13 +62,183 @@ WS_SERVE_REDIS_KEY = "ws_serve_{exchange}{delimiter}{base_id}{delimiter}{quote_i
 WS_SUB_LIST_REDIS_KEY = "ws_sub_list"
 WS_SUB_PROCESSING_REDIS_KEY = "ws_sub_processing"
 
-# To-fetch and fetching Redis set keys
+# Websocket Redis pub/sub channels
+# Candle updates are published whenever a serve key changes,
+#   on the channel of the symbol and on the all-symbols channel
+WS_CANDLE_CHANNEL = "ws_candle_{exchange}{delimiter}{base_id}{delimiter}{quote_id}"
+WS_CANDLE_ALL_CHANNEL = "ws_candle_all"
+
+# Websocket receive loops
+# Frames already received are processed in batches of at most
+#   `WS_BATCH_MAX_MESSAGES`, yielding the event loop after each batch;
+#   At most `WS_QUEUE_MAX_MESSAGES` frames wait for processing
+#   before the connection stops being read
+WS_BATCH_MAX_MESSAGES = 100
+WS_QUEUE_MAX_MESSAGES = 10000
+
+# Seconds between flushes of the latest candles of a WS fetcher to Redis
+WS_FLUSH_TICK_SECS = float(
+    os.getenv('WS_FLUSH_TICK_SECS') or configs.get('WS_FLUSH_TICK_SECS') or 0.25
+)
+
+# Direct insert mode of WS fetchers
+# Closed candles are copied into PSQL by a sink of
+#   `WS_DIRECT_INSERT_CONNECTIONS` connections, flushed every
+#   `WS_DIRECT_INSERT_FLUSH_SECS`, instead of being staged in Redis
+#   for the WS updater
+WS_DIRECT_INSERT_CONNECTIONS = 1
+WS_DIRECT_INSERT_FLUSH_SECS = 0.2
+
+# WS gaps repaired with REST
+# When symbols are (re)subscribed, the minutes missed since their last
+#   candle, up to `WS_GAP_MAX_SECS`, are fed to the REST live lane;
+#   The live lane is consumed `WS_GAP_RESUME_DELAY_SECS` after the first
+#   gap, so that gaps of reconnects close in time share one run
+WS_GAP_MAX_SECS = 86400
+WS_GAP_RESUME_DELAY_SECS = 1.0
+
+# WS frame recording
+# Raw frames received by a WS fetcher are written with their receive
+#   time to gzipped JSON-lines segments (for replay, see
+#   `scripts.benchmark.ws_replay`); A new segment is started after
+#   `WS_RECORD_SEGMENT_SECS` or `WS_RECORD_SEGMENT_BYTES` bytes of frames
+WS_RECORD_SEGMENT_SECS = 3600
+WS_RECORD_SEGMENT_BYTES = 256 * 1024 * 1024
+WS_RECORD_COMPRESSLEVEL = 1
+
+# To-fetch and fetching Redis keys
+# To-fetch is split into lanes, one set per lane; The fetching hash
+#   maps params being fetched to their lane
+# The single to-fetch set used before lanes is still read when
+#   resuming and its params moved to the history lane
 OHLCVS_TOFETCH_REDIS_KEY = "ohlcvs_tofetch_{exchange}"
+OHLCVS_TOFETCH_LANE_REDIS_KEY = "ohlcvs_tofetch_{exchange}_{lane}"
 OHLCVS_FETCHING_REDIS_KEY = "ohlcvs_fetching_{exchange}"
 
+# To-fetch lanes
+# Live lane always fills a batch first; The room left is shared among
+#   the other lanes by their weights
+# Params are fed to the live lane if their start date is at most
+#   `OHLCVS_LIVE_LANE_SECS` ago, to the recent lane if at most
+#   `OHLCVS_RECENT_LANE_SECS` ago, else to the history lane
+OHLCVS_LANE_LIVE = "live"
+OHLCVS_LANE_RECENT = "recent"
+OHLCVS_LANE_HISTORY = "history"
+OHLCVS_LANE_RETRY = "retry"
+OHLCVS_STRICT_LANES = (OHLCVS_LANE_LIVE,)
+OHLCVS_LANE_WEIGHTS = {
+    OHLCVS_LANE_RECENT: 6,
+    OHLCVS_LANE_HISTORY: 3,
+    OHLCVS_LANE_RETRY: 1
+}
+OHLCVS_LIVE_LANE_SECS = 3600
+OHLCVS_RECENT_LANE_SECS = 86400 * 7
+
+# Number of params consumed from the to-fetch set in each batch
+OHLCVS_CONSUME_BATCH_SIZE = {
+    'bittrex': 100,
+    'bitfinex': 500,
+    'binance': 500
+}
+
+# Retry of failed OHLCV windows recorded in the ohlcvs errors table
+# Retry params are fed to the retry lane of to-fetch
+# Retry windows hash maps such params to the window they cover
+OHLCVS_RETRY_WINDOWS_REDIS_KEY = "ohlcvs_retry_windows_{exchange}"
+OHLCVS_RETRY_BASE_SECS = 300 # backoff is base * 2^retries
+OHLCVS_RETRY_MAX_RETRIES = 8
+OHLCVS_PAGE_SPAN_MINS = { # minutes covered by one request
+    'bittrex': 1440,
+    'bitfinex': 9500,
+    'binance': 1000
+}
+
+# Optional on-disk cache of immutable REST pages, one directory
+#   per exchange under `REST_PAGE_CACHE_DIR` (disabled if not set)
+# A page is immutable if it ends more than
+#   `REST_PAGE_CACHE_IMMUTABLE_SECS` ago
+REST_PAGE_CACHE_DIR = os.getenv('REST_PAGE_CACHE_DIR') or configs.get('REST_PAGE_CACHE_DIR')
+REST_PAGE_CACHE_MAX_BYTES = 10 * 1024 ** 3 # per exchange
+REST_PAGE_CACHE_IMMUTABLE_SECS = 86400
+
+# Circuit breakers of symbols of an exchange
+# A circuit opens after `CIRCUIT_FAILURE_THRESHOLD` consecutive failures
+#   (client errors other than rate limits, e.g., unknown symbols) and is
+#   half-open after `CIRCUIT_OPEN_SECS`; Symbols with open circuits
+#   are skipped when fetching all or mutual symbols
+# A half-open symbol is probed with a single request by the fetcher
+#   that claims `CIRCUIT_PROBE_REDIS_KEY`
+CIRCUIT_FAILURES_REDIS_KEY = "circuit_failures_{exchange}"
+CIRCUIT_OPENED_REDIS_KEY = "circuit_opened_{exchange}"
+CIRCUIT_PROBE_REDIS_KEY = "circuit_probe_{exchange}_{symbol}"
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_OPEN_SECS = 3600 * 6
+
+# Backfills of OHLCVs fanned out across Celery workers of an exchange
+#   (queue `{exchange}_backfill`)
+# A backfill is split into chunks of at most `BACKFILL_CHUNK_SYMBOLS`
+#   symbols and `BACKFILL_CHUNK_DAYS` days; Its progress is kept
+#   in a Redis hash for `BACKFILL_PROGRESS_TTL_SECS`
+# Each chunk feeds and consumes its own to-fetch set and fetching hash
+#   (lane `OHLCVS_LANE_BACKFILL`), apart from the lanes of the exchange;
+#   Params left in them (e.g., after a drain) expire with the progress
+BACKFILL_CHUNK_SYMBOLS = 20
+BACKFILL_CHUNK_DAYS = 30
+BACKFILL_PROGRESS_REDIS_KEY = "backfill_progress_{backfill_id}"
+BACKFILL_PROGRESS_TTL_SECS = 86400 * 7
+OHLCVS_LANE_BACKFILL = "backfill"
+BACKFILL_TOFETCH_REDIS_KEY = "ohlcvs_tofetch_{exchange}_backfill_{backfill_id}_{chunk_id}"
+BACKFILL_FETCHING_REDIS_KEY = "ohlcvs_fetching_{exchange}_backfill_{backfill_id}_{chunk_id}"
+
+# Signal to dump stage timers of a running REST fetcher to its log
+STAGE_TIMERS_DUMP_SIGNAL = signal.SIGUSR1
+
+# Prometheus metrics HTTP listeners
+# Each process serves its metrics on the port of its kind; If several
+#   processes of one kind run on a host (e.g., Celery prefork workers),
+#   the next free port among `METRICS_PORT_TRIES` ports is used
+METRICS_ADDR = "0.0.0.0"
+METRICS_PORTS = {
+    'bitfinex_rest': 9100,
+    'binance_rest': 9110,
+    'bittrex_rest': 9120,
+    'bitfinex_ws': 9130,
+    'binance_ws': 9131,
+    'bittrex_ws': 9132,
+    'ws_updater': 9133,
+    'ws_supervisor': 9134
+}
+METRICS_PORT_TRIES = 10
+
+# WS supervisor
+# Runs the WS fetchers of several exchanges and the WS updater as tasks
+#   of one event loop; Tasks that stop are restarted after a delay from
+#   `WS_SUPERVISOR_RESTART_MIN_SECS`, doubled up to
+#   `WS_SUPERVISOR_RESTART_MAX_SECS` while they keep stopping
+# Its health (JSON) is served over HTTP on `WS_SUPERVISOR_HEALTH_PORT`
+WS_SUPERVISOR_RESTART_MIN_SECS = 2.0
+WS_SUPERVISOR_RESTART_MAX_SECS = 60.0
+WS_SUPERVISOR_HEALTH_PORT = 9140
+
 # PSQL Constants
 OHLCV_UNIQUE_COLUMNS = ("time", "exchange", "base_id", "quote_id")
 OHLCV_UPDATE_COLUMNS = ("open", "high", "low", "close", "volume")
 SYMEXCH_UNIQUE_COLUMNS = ("exchange", "base_id", "quote_id")
 SYMEXCH_UPDATE_COLUMNS = ("is_trading", "symbol")
 NUM_DECIMALS = 4 # number of decimals
+
+# Parallel COPY sink (e.g., for backfills)
+# Buffered rows are flushed when `PSQL_SINK_FLUSH_ROWS` are buffered
+#   or `PSQL_SINK_FLUSH_SECS` after the first one; They are sharded
+#   across `PSQL_SINK_CONNECTIONS` connections by symbol and time chunk
+#   of `PSQL_SINK_CHUNK_SECS`
+PSQL_SINK_CONNECTIONS = 4
+PSQL_SINK_FLUSH_ROWS = 20000
+PSQL_SINK_FLUSH_SECS = 0.5
+PSQL_SINK_CHUNK_SECS = 86400 * 7
+
+# Bulk-load mode of the sink (for historical backfills)
+# Buffers are larger and rows are sorted by chunk time bucket
+#   and primary key before they are copied
+PSQL_BULK_LOAD_FLUSH_ROWS = 100000
+PSQL_BULK_LOAD_FLUSH_SECS = 2.0
@@ -73,4 +73,86 @@ from (
    where difference > 60
    order by "time" asc
 ) results;
-'''
\ No newline at end of file
+'''
+
+# Get unresolved OHLCV errors of an exchange that are due for retry;
+#  a row is due when `OHLCVS_RETRY_BASE_SECS * 2^retries` seconds
+#  have passed since its last retry
+UNRESOLVED_ERRORS_QUERY = '''
+select symbol, start_date, end_date
+from ohlcvs_errors
+where exchange = %s
+   and not resolved
+   and retries < %s
+   and (
+      last_retry_at is null
+      or last_retry_at + make_interval(secs => %s * power(2, retries)) <= now()
+   )
+order by symbol asc, start_date asc;
+'''
+
+# Record a retry attempt for unresolved errors of a symbol
+#  whose start dates are in a window
+RETRIED_ERRORS_QUERY = '''
+update ohlcvs_errors
+set retries = retries + 1, last_retry_at = now()
+where exchange = %s and symbol = %s and not resolved
+   and start_date >= %s and start_date <= %s;
+'''
+
+# Resolve errors of a symbol whose start dates are in a window
+RESOLVE_ERRORS_QUERY = '''
+update ohlcvs_errors
+set resolved = true
+where exchange = %s and symbol = %s and not resolved
+   and start_date >= %s and start_date < %s;
+'''
+
+# Get symbols of an exchange with their base and quote ids
+SYMBOLS_BASEQUOTE_EXCHANGE_QUERY = '''
+select symbol, base_id, quote_id from symbol_exchange where exchange=%s;
+'''
+
+# Temp table that rows of an OHLCV archive file are copied into;
+#  its rows are deleted when the transaction of the file commits
+ARCHIVE_TEMP_TABLE_QUERY = '''
+create temp table if not exists ohlcvs_archive (
+   time_ms BIGINT NOT NULL,
+   open NUMERIC NOT NULL,
+   high NUMERIC NOT NULL,
+   low NUMERIC NOT NULL,
+   close NUMERIC NOT NULL,
+   volume NUMERIC NOT NULL
+) on commit delete rows;
+'''
+
+ARCHIVE_COPY_QUERY = '''
+copy ohlcvs_archive from stdin with (format csv);
+'''
+
+# Insert rows of the archive temp table of a base-quote into ohlcvs,
+#  rounding values like the REST fetchers do; {} is the conflict clause
+ARCHIVE_INSERT_QUERY = '''
+insert into ohlcvs
+select distinct on (time_ms)
+   to_timestamp(time_ms / 1000.0), %s, %s, %s,
+   round(open, 2), round(high, 2), round(low, 2), round(close, 2), round(volume, 2)
+from ohlcvs_archive
+order by time_ms
+{};
+'''
+ARCHIVE_IGNOREDUP_CLAUSE = "on conflict do nothing"
+ARCHIVE_UPDATE_CLAUSE = '''on conflict (time, exchange, base_id, quote_id) do update
+set (open, high, low, close, volume) =
+   (excluded.open, excluded.high, excluded.low, excluded.close, excluded.volume)'''
+
+# Session settings of bulk-load connections: commits do not wait
+#  for WAL flushes, so a PSQL crash may lose the last commits
+#  (but never corrupts data)
+PSQL_BULK_LOAD_SESSION_QUERY = "SET synchronous_commit TO off;"
+# Synchronous commit of a bulk-load flush: it waits for the WAL to be
+#  flushed up to its commit record, so the asynchronous commits before it
+#  on every connection are durable too; Rows of a flush are reported
+#  inserted (and their params checkpointed) only after it
+PSQL_BULK_LOAD_SYNC_COMMIT_QUERY = \
+    "SET LOCAL synchronous_commit TO on; SELECT txid_current();"
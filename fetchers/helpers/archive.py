@@ -0,0 +1,164 @@
+# This module contains helpers to import OHLCV archive files
+#   (zipped CSVs of candles, e.g., from data.binance.vision) into PSQL
+
+import os
+import time
+import zipfile
+from io import TextIOWrapper
+from typing import Iterable, Iterator, Tuple
+
+import psycopg2
+
+from common.config.constants import DBCONNECTION
+from fetchers.config.queries import \
+    ARCHIVE_COPY_QUERY, ARCHIVE_IGNOREDUP_CLAUSE, ARCHIVE_INSERT_QUERY, \
+    ARCHIVE_TEMP_TABLE_QUERY, ARCHIVE_UPDATE_CLAUSE
+
+
+# Timestamps at or above this are in microseconds, not milliseconds
+MICROSECONDS_TS_MIN = 10 ** 14
+
+
+def archive_symbol(path: str) -> str:
+    '''
+    Returns the symbol of an archive file from its name,
+        e.g., `BTCUSDT` from `BTCUSDT-1m-2021-01.zip`
+
+    :params:
+        `path`: string - path of the archive file
+    '''
+
+    return os.path.basename(path).split("-", 1)[0]
+
+def parse_archive_lines(lines: Iterable[str]) -> Iterator[str]:
+    '''
+    Yields CSV lines of (open time in milliseconds, open, high, low,
+        close, volume) from CSV lines of an archive;
+        The first six columns of archive lines must be these,
+        with the open time in milliseconds or microseconds;
+        Header and blank lines are skipped
+
+    :params:
+        `lines`: iterable of CSV lines
+    '''
+
+    for line in lines:
+        fields = line.rstrip("\r\n").split(",", 6)
+        if len(fields) < 6 or not fields[0].isdigit():
+            continue
+        ts = int(fields[0])
+        if ts >= MICROSECONDS_TS_MIN:
+            ts //= 1000
+        yield f"{ts},{fields[1]},{fields[2]},{fields[3]},{fields[4]},{fields[5]}\n"
+
+def read_archive(path: str) -> Iterator[str]:
+    '''
+    Yields CSV lines of all CSV files in the zip archive at `path`,
+        decompressing them as they are read
+
+    :params:
+        `path`: string - path of the zip archive
+    '''
+
+    with zipfile.ZipFile(path) as archive:
+        for name in archive.namelist():
+            if not name.lower().endswith(".csv"):
+                continue
+            with archive.open(name) as member:
+                yield from TextIOWrapper(member, encoding="utf-8")
+
+
+class LinesReader:
+    '''
+    File-like object over an iterator of lines, so that they can be
+        streamed into `copy_expert` without being held in memory
+    '''
+
+    def __init__(self, lines: Iterator[str]):
+        self.lines = lines
+        self.buffer = ""
+        self.count = 0
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+            self.count += 1
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+class ArchiveImporter:
+    '''
+    Imports OHLCV archive files of an exchange into PSQL;
+        Meant to be used in worker processes, one importer each
+
+    Rows of each file are streamed into a temp table with COPY,
+        then inserted into ohlcvs with their base and quote ids,
+        in one transaction per file
+    '''
+
+    def __init__(self, exchange_name: str, symbols: dict, update: bool=False):
+        '''
+        :params:
+            `exchange_name`: string
+            `symbols`: dict of symbol to (base_id, quote_id)
+            `update`: bool - whether to update existing rows
+        '''
+
+        self.exchange_name = exchange_name
+        self.symbols = symbols
+        self.insert_query = ARCHIVE_INSERT_QUERY.format(
+            ARCHIVE_UPDATE_CLAUSE if update else ARCHIVE_IGNOREDUP_CLAUSE
+        )
+        self.psql_conn = psycopg2.connect(DBCONNECTION)
+        with self.psql_conn.cursor() as cursor:
+            cursor.execute(ARCHIVE_TEMP_TABLE_QUERY)
+        self.psql_conn.commit()
+
+    def import_file(
+            self, path: str, symbol: str=None
+        ) -> Tuple[str, int, int, float, str]:
+        '''
+        Imports the archive file at `path`; Returns a tuple with:
+            - path
+            - rows read
+            - rows inserted
+            - seconds taken
+            - error message (None if there's none)
+
+        :params:
+            `path`: string
+            `symbol`: string - symbol of the file; from its name if not provided
+        '''
+
+        start = time.perf_counter()
+        symbol = symbol or archive_symbol(path)
+        if symbol not in self.symbols:
+            return (path, 0, 0, 0.0, f"unknown symbol {symbol} on {self.exchange_name}")
+        base_id, quote_id = self.symbols[symbol]
+        reader = LinesReader(parse_archive_lines(read_archive(path)))
+        try:
+            with self.psql_conn.cursor() as cursor:
+                cursor.copy_expert(ARCHIVE_COPY_QUERY, reader)
+                cursor.execute(
+                    self.insert_query, (self.exchange_name, base_id, quote_id)
+                )
+                inserted = cursor.rowcount
+            self.psql_conn.commit()
+        # Errors of decompressing and parsing are raised from within COPY
+        except Exception as exc:
+            self.psql_conn.rollback()
+            return (path, reader.count, 0, time.perf_counter() - start, str(exc))
+        return (path, reader.count, inserted, time.perf_counter() - start, None)
+
+    def close_connections(self) -> None:
+        '''
+        Interface to close all connections (e.g., PSQL)
+        '''
+
+        self.psql_conn.close()
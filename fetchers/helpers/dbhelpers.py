@@ -3,10 +3,12 @@
 import sys
 import csv
 import logging
+import time
 import psycopg2
 from psycopg2 import sql, extras
 from typing import Iterable
 from io import StringIO
+from fetchers.utils.metrics import BULK_INSERT_SECONDS
 
 
 def log_psycopg2_exc(err: Exception) -> None:
@@ -76,16 +78,20 @@ def psql_bulk_insert(
         if not cursor:
             cursor = conn.cursor()
         try:
+            start = time.perf_counter()
             buffer = StringIO()
             writer = csv.writer(buffer)
             writer.writerows(rows)
             buffer.seek(0)
             cursor.copy_from(buffer, table, sep=",", null="")
             conn.commit()
+            BULK_INSERT_SECONDS.labels(table, 'copy').observe(
+                time.perf_counter() - start)
             logging.info(f'PSQL Bulk Insert: Successfully copied rows to table {table}')
             return True
         except psycopg2.IntegrityError:
             conn.rollback()
+            start = time.perf_counter()
             if insert_update_query is not None:
                 logging.info(
                     f"PSQL Bulk Insert: Performing insert with update to table {table}"
@@ -117,6 +123,8 @@ def psql_bulk_insert(
                 )
             extras.execute_values(cursor, insert_query, rows, page_size=1000)
             conn.commit()
+            BULK_INSERT_SECONDS.labels(table, 'insert').observe(
+                time.perf_counter() - start)
             logging.info(f'PSQL Bulk Insert: Successfully inserted rows to table {table}')
             return True
         # Is it fine to catch ANY exception?
@@ -0,0 +1,250 @@
+# This module contains a sink that inserts OHLCV rows into PSQL
+#   over several connections in parallel
+
+import asyncio
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import Dict, List, Tuple
+
+import psycopg2
+
+from common.config.constants import DBCONNECTION, OHLCVS_TABLE
+from fetchers.config.constants import \
+    OHLCV_UNIQUE_COLUMNS, OHLCV_UPDATE_COLUMNS, PSQL_BULK_LOAD_FLUSH_ROWS, \
+    PSQL_BULK_LOAD_FLUSH_SECS, PSQL_SINK_CHUNK_SECS, PSQL_SINK_CONNECTIONS, \
+    PSQL_SINK_FLUSH_ROWS, PSQL_SINK_FLUSH_SECS
+from fetchers.config.queries import \
+    PSQL_BULK_LOAD_SESSION_QUERY, PSQL_BULK_LOAD_SYNC_COMMIT_QUERY, \
+    PSQL_INSERT_IGNOREDUP_QUERY, PSQL_INSERT_UPDATE_QUERY
+from fetchers.helpers.dbhelpers import psql_bulk_insert
+
+
+def sink_shard(row: tuple, shards: int, chunk_secs: int) -> int:
+    '''
+    Returns the shard of an OHLCV row from its symbol and time chunk;
+        Rows with the same unique key always go to the same shard,
+        so connections never conflict on a row
+
+    :params:
+        `row`: tuple of (time, exchange, base_id, quote_id, ...)
+        `shards`: int - number of shards
+        `chunk_secs`: int - seconds of a time chunk
+    '''
+
+    symbol_hash = zlib.crc32(f"{row[1]}{row[2]}{row[3]}".encode())
+    return (symbol_hash + int(row[0].timestamp()) // chunk_secs) % shards
+
+def bulk_load_sorted(rows: list, chunk_secs: int) -> list:
+    '''
+    Returns OHLCV `rows` sorted by time chunk, then by primary key
+        (exchange, base_id, quote_id, time), so that a COPY fills
+        one hypertable chunk and walks its indexes in order
+        before moving on to the next
+
+    :params:
+        `rows`: list of tuples of (time, exchange, base_id, quote_id, ...)
+        `chunk_secs`: int - seconds of a time chunk
+    '''
+
+    pk = itemgetter(1, 2, 3, 0)
+    return sorted(
+        rows, key=lambda row: (int(row[0].timestamp()) // chunk_secs, pk(row))
+    )
+
+
+class ParallelCopySink:
+    '''
+    Inserts OHLCV rows into PSQL over a pool of connections
+
+    Rows of concurrent `insert` calls are buffered, then sharded across
+        the connections (see `sink_shard`) and copied in parallel,
+        one thread per connection; Each call still gets whether its
+        own rows were inserted, so params are checkpointed as before
+
+    In bulk-load mode (for historical backfills), buffers are larger,
+        rows are sorted with `bulk_load_sorted` before they are copied
+        and their commits do not wait for WAL flushes
+        (see `PSQL_BULK_LOAD_SESSION_QUERY`); Each flush then ends with
+        one synchronous commit, so rows are reported inserted only
+        once they are durable
+    '''
+
+    def __init__(
+            self,
+            connections: int = PSQL_SINK_CONNECTIONS,
+            bulk_load: bool = False,
+            flush_rows: int = None,
+            flush_secs: float = None,
+            chunk_secs: int = PSQL_SINK_CHUNK_SECS,
+            table: str = OHLCVS_TABLE
+        ):
+        '''
+        :params:
+            `connections`: int - number of PSQL connections
+            `bulk_load`: bool - whether to use bulk-load mode
+            `flush_rows`: int - buffered rows that trigger a flush;
+                `PSQL_SINK_FLUSH_ROWS` or `PSQL_BULK_LOAD_FLUSH_ROWS`
+                if not provided
+            `flush_secs`: float - seconds after the first buffered row
+                that trigger a flush; `PSQL_SINK_FLUSH_SECS` or
+                `PSQL_BULK_LOAD_FLUSH_SECS` if not provided
+            `chunk_secs`: int - seconds of a time chunk for sharding
+                and sorting
+            `table`: string - table to insert into
+        '''
+
+        self.bulk_load = bulk_load
+        if flush_rows is None:
+            flush_rows = PSQL_BULK_LOAD_FLUSH_ROWS if bulk_load else PSQL_SINK_FLUSH_ROWS
+        if flush_secs is None:
+            flush_secs = PSQL_BULK_LOAD_FLUSH_SECS if bulk_load else PSQL_SINK_FLUSH_SECS
+        self.flush_rows = flush_rows
+        self.flush_secs = flush_secs
+        self.chunk_secs = chunk_secs
+        self.table = table
+        self.conns = [psycopg2.connect(DBCONNECTION) for _ in range(connections)]
+        if bulk_load:
+            for conn in self.conns:
+                with conn.cursor() as cursor:
+                    cursor.execute(PSQL_BULK_LOAD_SESSION_QUERY)
+                conn.commit()
+        self.executors = [
+            ThreadPoolExecutor(max_workers=1) for _ in range(connections)
+        ]
+
+        # Buffers of (rows, future) and their flush timers,
+        #   one each for inserts with and without update
+        self.buffers: Dict[bool, List[Tuple[list, asyncio.Future]]] = \
+            {False: [], True: []}
+        self.buffered_rows = {False: 0, True: 0}
+        self.timers = {False: None, True: None}
+        self.flush_tasks = set()
+
+    async def insert(self, rows: list, update: bool=False) -> bool:
+        '''
+        Buffers OHLCV `rows` to be inserted with the next flush;
+            Returns whether they were inserted
+
+        :params:
+            `rows`: list of OHLCV rows
+            `update`: bool - whether to update on conflict
+        '''
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.buffers[update].append((rows, future))
+        self.buffered_rows[update] += len(rows)
+        if self.buffered_rows[update] >= self.flush_rows:
+            self._flush(update)
+        elif self.timers[update] is None:
+            self.timers[update] = loop.call_later(
+                self.flush_secs, self._flush, update)
+        return await future
+
+    def _flush(self, update: bool) -> None:
+        '''
+        Starts copying the buffer of `update` inserts
+        '''
+
+        if self.timers[update] is not None:
+            self.timers[update].cancel()
+            self.timers[update] = None
+        entries = self.buffers[update]
+        self.buffers[update] = []
+        self.buffered_rows[update] = 0
+        if entries:
+            task = asyncio.create_task(self._copy(entries, update))
+            self.flush_tasks.add(task)
+            task.add_done_callback(self.flush_tasks.discard)
+
+    async def _copy(
+            self, entries: List[Tuple[list, asyncio.Future]], update: bool
+        ) -> None:
+        '''
+        Copies the rows of `entries` in parallel, one shard per connection,
+            then sets the result of each entry's future
+        '''
+
+        loop = asyncio.get_running_loop()
+        shards = len(self.conns)
+        shard_rows = [[] for _ in range(shards)]
+        entry_shards = []
+        for rows, _ in entries:
+            indices = set()
+            for row in rows:
+                index = sink_shard(row, shards, self.chunk_secs)
+                shard_rows[index].append(row)
+                indices.add(index)
+            entry_shards.append(indices)
+
+        indices = [i for i in range(shards) if shard_rows[i]]
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self.executors[i], self._copy_shard, i, shard_rows[i], update
+                ) for i in indices
+            ),
+            return_exceptions=True
+        )
+        success = {i: result is True for i, result in zip(indices, results)}
+        if self.bulk_load and any(success.values()):
+            synced = await loop.run_in_executor(
+                self.executors[indices[0]], self._sync_commit, indices[0])
+            if not synced:
+                success = dict.fromkeys(success, False)
+        for (_, future), entry_indices in zip(entries, entry_shards):
+            if not future.done():
+                future.set_result(all(success[i] for i in entry_indices))
+
+    def _copy_shard(self, index: int, rows: list, update: bool) -> bool:
+        '''
+        Bulk inserts `rows` over connection `index`;
+            Runs in the thread of that connection
+        '''
+
+        if self.bulk_load:
+            rows = bulk_load_sorted(rows, self.chunk_secs)
+        if update:
+            return psql_bulk_insert(
+                self.conns[index],
+                rows,
+                self.table,
+                insert_update_query = PSQL_INSERT_UPDATE_QUERY,
+                unique_cols = OHLCV_UNIQUE_COLUMNS,
+                update_cols = OHLCV_UPDATE_COLUMNS
+            )
+        return psql_bulk_insert(
+            self.conns[index],
+            rows,
+            self.table,
+            insert_ignoredup_query = PSQL_INSERT_IGNOREDUP_QUERY
+        )
+
+    def _sync_commit(self, index: int) -> bool:
+        '''
+        Commits a transaction synchronously over connection `index`,
+            waiting for the WAL flush of all commits before it;
+            Runs in the thread of that connection
+        '''
+
+        conn = self.conns[index]
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(PSQL_BULK_LOAD_SYNC_COMMIT_QUERY)
+            conn.commit()
+            return True
+        except psycopg2.Error:
+            conn.rollback()
+            return False
+
+    def close(self) -> None:
+        '''
+        Stops the connection threads and closes the connections;
+            Rows still buffered are not inserted
+        '''
+
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+        for conn in self.conns:
+            conn.close()
@@ -1,6 +1,90 @@
 # Helpers for WS fetchers
 
-from fetchers.config.constants import WS_SUB_REDIS_KEY, WS_SERVE_REDIS_KEY
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator, NoReturn, Tuple
+
+import redis
+
+from common.helpers.datetimehelpers import milliseconds_to_datetime
+from common.helpers.numbers import round_decimal
+from fetchers.config.constants import \
+    NUM_DECIMALS, OHLCVS_LANE_LIVE, OHLCVS_PAGE_SPAN_MINS, \
+    OHLCVS_TOFETCH_LANE_REDIS_KEY, WS_BATCH_MAX_MESSAGES, \
+    WS_FLUSH_TICK_SECS, WS_GAP_MAX_SECS, \
+    WS_CANDLE_ALL_CHANNEL, WS_CANDLE_CHANNEL, WS_GAP_RESUME_DELAY_SECS, \
+    WS_QUEUE_MAX_MESSAGES, WS_RECORD_COMPRESSLEVEL, WS_RECORD_SEGMENT_BYTES, \
+    WS_RECORD_SEGMENT_SECS, WS_SUB_LIST_REDIS_KEY, WS_SUB_REDIS_KEY, \
+    WS_SERVE_REDIS_KEY
+from fetchers.helpers.sink import ParallelCopySink
+from fetchers.rest.retrier import split_window
+from fetchers.utils.metrics import \
+    ROWS_INSERTED, WS_CANDLE_WRITES, WS_CLOSED_INSERT_SECONDS, WS_GAP_PARAMS
+
+
+# Records a candle in one round trip, atomically:
+#   - registers the sub key in the sub list
+#   - sets the sub value of the timestamp in the sub key hash
+#   - replaces the serve key hash if the timestamp is not older
+#     and the candle changed, then publishes the candle message
+#     on the candle channel of the symbol and on the all-symbols channel
+# KEYS: sub list key, sub key, serve key
+# ARGV: timestamp, sub value, open, high, low, close, volume,
+#   candle channel, all-symbols candle channel, candle message
+# Returns 1 if the serve key hash was replaced, else 0
+WS_UPDATE_SCRIPT = '''
+redis.call('SADD', KEYS[1], KEYS[2])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+local current = redis.call('HMGET', KEYS[3],
+    'time', 'open', 'high', 'low', 'close', 'volume')
+if current[1] then
+    if tonumber(ARGV[1]) < tonumber(current[1]) then
+        return 0
+    end
+    if current[1] == ARGV[1] and current[2] == ARGV[3]
+        and current[3] == ARGV[4] and current[4] == ARGV[5]
+        and current[5] == ARGV[6] and current[6] == ARGV[7] then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[3],
+    'time', ARGV[1], 'open', ARGV[3], 'high', ARGV[4],
+    'low', ARGV[5], 'close', ARGV[6], 'volume', ARGV[7])
+redis.call('PUBLISH', ARGV[8], ARGV[10])
+redis.call('PUBLISH', ARGV[9], ARGV[10])
+return 1
+'''
+
+# Same as `WS_UPDATE_SCRIPT`, without staging the candle in the sub key;
+#   For candles inserted into PSQL directly
+# KEYS: serve key
+# ARGV: timestamp, open, high, low, close, volume,
+#   candle channel, all-symbols candle channel, candle message
+WS_SERVE_SCRIPT = '''
+local current = redis.call('HMGET', KEYS[1],
+    'time', 'open', 'high', 'low', 'close', 'volume')
+if current[1] then
+    if tonumber(ARGV[1]) < tonumber(current[1]) then
+        return 0
+    end
+    if current[1] == ARGV[1] and current[2] == ARGV[2]
+        and current[3] == ARGV[3] and current[4] == ARGV[4]
+        and current[5] == ARGV[5] and current[6] == ARGV[6] then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[1],
+    'time', ARGV[1], 'open', ARGV[2], 'high', ARGV[3],
+    'low', ARGV[4], 'close', ARGV[5], 'volume', ARGV[6])
+redis.call('PUBLISH', ARGV[7], ARGV[9])
+redis.call('PUBLISH', ARGV[8], ARGV[9])
+return 1
+'''
 
 
 def make_sub_val(t, o, h, l, c, v, d) -> str:
@@ -16,6 +100,29 @@ def make_sub_val(t, o, h, l, c, v, d) -> str:
 
     return f'{t}{d}{o}{d}{h}{d}{l}{d}{c}{d}{v}'
 
+def make_ohlcv_row(t, exch: str, base: str, quote: str, o, h, l, c, v) -> tuple:
+    '''
+    Makes an OHLCV row to insert to PSQL db from a WS candle
+
+    :params:
+        `t`: timestamp in milliseconds
+        `exch`: exchange name
+        `base`: base id
+        `quote`: quote id
+    '''
+
+    return (
+        milliseconds_to_datetime(int(t)),
+        exch,
+        base,
+        quote,
+        round_decimal(o, NUM_DECIMALS),
+        round_decimal(h, NUM_DECIMALS),
+        round_decimal(l, NUM_DECIMALS),
+        round_decimal(c, NUM_DECIMALS),
+        round_decimal(v, NUM_DECIMALS)
+    )
+
 def make_sub_redis_key(exch: str, base: str, quote: str, delimiter: str) -> str:
     '''
     Makes sub Redis key for the e-b-q combination
@@ -57,3 +164,979 @@ def make_serve_redis_key(exch: str, base: str, quote: str, delimiter: str) -> st
         quote_id = quote,
         delimiter = delimiter
     )
+
+def make_candle_channel(exch: str, base: str, quote: str, delimiter: str) -> str:
+    '''
+    Makes the Redis pub/sub channel of candle updates of the e-b-q combination
+
+    Consumers (e.g., the web service) can subscribe to it instead of
+        polling the serve key
+
+    :params:
+        `exch`: exchange name
+        `base`: base id
+        `quote`: quote id
+    '''
+
+    return WS_CANDLE_CHANNEL.format(
+        exchange = exch,
+        base_id = base,
+        quote_id = quote,
+        delimiter = delimiter
+    )
+
+def make_candle_message(exch: str, base: str, quote: str, t, o, h, l, c, v, d) -> str:
+    '''
+    Serializes a candle update into a pub/sub message
+
+    :params:
+        `exch`: exchange name
+        `base`: base id
+        `quote`: quote id
+        `t`: timestamp
+        `d`: delimiter
+    '''
+
+    return f'{exch}{d}{base}{d}{quote}{d}{t}{d}{o}{d}{h}{d}{l}{d}{c}{d}{v}'
+
+def parse_candle_message(message: str, delimiter: str) -> dict:
+    '''
+    Parses a candle update message of `make_candle_message` into a dict of
+        exchange, base_id, quote_id and the OHLCV fields of the serve key
+
+    :params:
+        `message`: string
+        `delimiter`: Redis delimiter
+    '''
+
+    exch, base, quote, t, o, h, l, c, v = message.split(delimiter)
+    return {
+        'exchange': exch,
+        'base_id': base,
+        'quote_id': quote,
+        'time': t,
+        'open': o,
+        'high': h,
+        'low': l,
+        'close': c,
+        'volume': v
+    }
+
+async def iter_frame_batches(
+        ws_client: Any,
+        max_messages: int = WS_BATCH_MAX_MESSAGES,
+        max_queued: int = WS_QUEUE_MAX_MESSAGES,
+        recorder: 'WSFrameRecorder' = None,
+        connection: int = 0
+    ) -> AsyncIterator[list]:
+    '''
+    Yields batches of frames received from a websocket: waits for
+        one frame, then takes the frames already received without
+        waiting, up to `max_messages`; Frames are read by a separate
+        task, so the connection keeps being read while a batch
+        is processed
+
+    Raises the exception that stopped the connection
+        (e.g., ConnectionClosed) after the frames before it
+
+    :params:
+        `ws_client`: websockets client obj
+        `max_messages`: int - max frames per batch
+        `max_queued`: int - max frames waiting to be processed
+        `recorder`: WSFrameRecorder obj to record frames with
+            as they are received (optional)
+        `connection`: int - connection ID of the recorded frames
+    '''
+
+    queue = asyncio.Queue(max_queued)
+
+    async def read() -> None:
+        try:
+            while True:
+                frame = await ws_client.recv()
+                if recorder is not None:
+                    recorder.record(connection, frame)
+                await queue.put(frame)
+        except Exception as exc:
+            await queue.put(exc)
+
+    reader = asyncio.create_task(read())
+    try:
+        while True:
+            frames = [await queue.get()]
+            while len(frames) < max_messages and not queue.empty():
+                frames.append(queue.get_nowait())
+            if isinstance(frames[-1], Exception):
+                if len(frames) > 1:
+                    yield frames[:-1]
+                raise frames[-1]
+            yield frames
+    finally:
+        reader.cancel()
+
+
+async def run_until_first_stops(*aws: Awaitable) -> None:
+    '''
+    Runs `aws` as tasks until one of them stops (returns or raises),
+        then cancels the others and waits for them; Unlike `gather`,
+        no task outlives the call, e.g., when a WS fetcher restarted
+        by the supervisor stops with an exception
+
+    Raises the exception of the task that stopped, if any
+
+    :params:
+        `aws`: awaitables (e.g., coroutines) to run
+    '''
+
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class WSCandleWriter:
+    '''
+    Writes candles of an exchange from WS fetchers into Redis
+        with `WS_UPDATE_SCRIPT`, one round trip per candle
+
+    The sub key of a symbol is a hash with timestamps as its [internal]
+        keys, so that the WS updater can bulk-insert all of its candles
+        into PSQL later; The serve key is a hash of the latest candle
+        (time, open, high, low, close, volume), which the web service
+        serves to users in real time
+
+    Whenever a serve key changes, the candle is also published
+        on its candle channel (see `make_candle_channel`) and on
+        `WS_CANDLE_ALL_CHANNEL`, so consumers need not poll serve keys
+
+    Candles are not staged in sub keys if `stage` is False (e.g., when
+        they are inserted into PSQL directly); Only serve keys are written,
+        with `WS_SERVE_SCRIPT`
+    '''
+
+    def __init__(
+            self,
+            redis_client: redis.Redis,
+            exchange_name: str,
+            delimiter: str,
+            stage: bool = True
+        ):
+        '''
+        :params:
+            `redis_client`: Redis client
+            `exchange_name`: string
+            `delimiter`: Redis delimiter
+            `stage`: bool - whether to stage candles in sub keys by default
+        '''
+
+        self.redis_client = redis_client
+        self.exchange_name = exchange_name
+        self.delimiter = delimiter
+        self.stage = stage
+        self.script = redis_client.register_script(WS_UPDATE_SCRIPT)
+        self.serve_script = redis_client.register_script(WS_SERVE_SCRIPT)
+
+    def write(
+            self, base_id: str, quote_id: str,
+            timestamp, open_, high_, low_, close_, volume_,
+            client: redis.Redis = None,
+            stage: bool = None
+        ) -> int:
+        '''
+        Records a candle of the e-b-q combination;
+            Returns 1 if it is the latest one, else 0
+
+        :params:
+            `base_id`: base id
+            `quote_id`: quote id
+            `timestamp`: timestamp in milliseconds
+            `client`: Redis client or pipeline to run the script with
+                (optional); results of pipelines come from `execute`
+            `stage`: bool - whether to stage the candle in its sub key;
+                `self.stage` if not provided
+        '''
+
+        if stage is None:
+            stage = self.stage
+        publish_args = [
+            make_candle_channel(
+                self.exchange_name, base_id, quote_id, self.delimiter),
+            WS_CANDLE_ALL_CHANNEL,
+            make_candle_message(
+                self.exchange_name, base_id, quote_id,
+                timestamp, open_, high_, low_, close_, volume_, self.delimiter)
+        ]
+        if not stage:
+            return self.serve_script(
+                keys=[
+                    make_serve_redis_key(
+                        self.exchange_name, base_id, quote_id, self.delimiter)
+                ],
+                args=[
+                    timestamp, open_, high_, low_, close_, volume_,
+                    *publish_args
+                ],
+                client=client
+            )
+        return self.script(
+            keys=[
+                WS_SUB_LIST_REDIS_KEY,
+                make_sub_redis_key(
+                    self.exchange_name, base_id, quote_id, self.delimiter),
+                make_serve_redis_key(
+                    self.exchange_name, base_id, quote_id, self.delimiter)
+            ],
+            args=[
+                timestamp,
+                make_sub_val(
+                    timestamp, open_, high_, low_, close_, volume_, self.delimiter),
+                open_, high_, low_, close_, volume_,
+                *publish_args
+            ],
+            client=client
+        )
+
+
+class CandleCoalescer:
+    '''
+    Latest-candle table of a WS fetcher, keyed by
+        (base_id, quote_id, open time), flushed to Redis by a
+        `WSCandleWriter` in one pipeline every `tick_secs`
+
+    Updates of a candle within a tick replace each other in memory,
+        so Redis writes scale with the number of symbols,
+        not with the message rate
+
+    With a `sink` (direct insert mode), closed candles are also
+        inserted into PSQL through it on the next tick; A candle is
+        closed when the exchange flags it (`closed`) or when a candle
+        of the same symbol with a later open time arrives; Closed candles
+        that fail to insert are staged in sub keys for the WS updater
+    '''
+
+    def __init__(
+            self,
+            writer: WSCandleWriter,
+            tick_secs: float = WS_FLUSH_TICK_SECS,
+            logger: logging.Logger = None,
+            sink: ParallelCopySink = None
+        ):
+        '''
+        :params:
+            `writer`: WSCandleWriter obj
+            `tick_secs`: float - seconds between flushes
+            `logger`: Logger obj (optional)
+            `sink`: ParallelCopySink obj to insert closed candles with
+                (optional)
+        '''
+
+        self.writer = writer
+        self.tick_secs = tick_secs
+        self.logger = logger or logging.getLogger(__name__)
+        self.sink = sink
+        self.candles = {}
+
+        # Direct insert mode: open candle of each (base_id, quote_id),
+        #   open time of its last closed candle, and closed candles
+        #   waiting to be inserted
+        self.open_candles = {}
+        self.closed_at = {}
+        self.closed_candles = []
+        self.insert_tasks = set()
+
+    def add(
+            self, base_id: str, quote_id: str,
+            timestamp, open_, high_, low_, close_, volume_,
+            closed: bool = False
+        ) -> None:
+        '''
+        Records the latest update of a candle, to be flushed on the next tick
+
+        :params:
+            `base_id`: base id
+            `quote_id`: quote id
+            `timestamp`: open time in milliseconds
+            `closed`: bool - whether the exchange flags the candle as closed
+        '''
+
+        timestamp = int(timestamp)
+        ohlcv = (open_, high_, low_, close_, volume_)
+        self.candles[(base_id, quote_id, timestamp)] = ohlcv
+        if self.sink is None:
+            return
+
+        # Late updates of closed candles were inserted already
+        symbol = (base_id, quote_id)
+        if timestamp <= self.closed_at.get(symbol, -1):
+            return
+        current = self.open_candles.get(symbol)
+        if current is not None and timestamp > current[0]:
+            self._close(symbol, *current)
+        if closed:
+            self._close(symbol, timestamp, ohlcv)
+        else:
+            self.open_candles[symbol] = (timestamp, ohlcv)
+
+    def _close(self, symbol: tuple, timestamp: int, ohlcv: tuple) -> None:
+        '''
+        Moves a candle of `symbol` to the closed candles to insert
+        '''
+
+        self.closed_at[symbol] = timestamp
+        self.open_candles.pop(symbol, None)
+        self.closed_candles.append((*symbol, timestamp, ohlcv))
+
+    def flush(self) -> int:
+        '''
+        Writes the recorded candles to Redis in one pipeline;
+            Returns the number of candles written
+
+        If the pipeline fails, candles not updated since are kept
+            to be written on the next flush
+        '''
+
+        if not self.candles:
+            return 0
+        candles, self.candles = self.candles, {}
+        pipe = self.writer.redis_client.pipeline(transaction=False)
+        for (base_id, quote_id, timestamp), ohlcv in candles.items():
+            self.writer.write(base_id, quote_id, timestamp, *ohlcv, client=pipe)
+        try:
+            pipe.execute()
+        except Exception:
+            for key, ohlcv in candles.items():
+                self.candles.setdefault(key, ohlcv)
+            raise
+        WS_CANDLE_WRITES.labels(self.writer.exchange_name).inc(len(candles))
+        return len(candles)
+
+    def flush_closed(self) -> None:
+        '''
+        Starts inserting the closed candles through the sink
+        '''
+
+        if not self.closed_candles:
+            return
+        candles, self.closed_candles = self.closed_candles, []
+        task = asyncio.create_task(self._insert_closed(candles))
+        self.insert_tasks.add(task)
+        task.add_done_callback(self.insert_tasks.discard)
+
+    async def _insert_closed(self, candles: list) -> None:
+        '''
+        Inserts closed `candles` through the sink;
+            Stages them in sub keys for the WS updater if it fails
+        '''
+
+        exchange_name = self.writer.exchange_name
+        rows = [
+            make_ohlcv_row(timestamp, exchange_name, base_id, quote_id, *ohlcv)
+            for base_id, quote_id, timestamp, ohlcv in candles
+        ]
+        if await self.sink.insert(rows):
+            ROWS_INSERTED.labels(exchange_name, 'ws').inc(len(rows))
+            now = time.time()
+            for _, _, timestamp, _ in candles:
+                # Candles close a minute after they open
+                WS_CLOSED_INSERT_SECONDS.labels(exchange_name) \
+                    .observe(now - (timestamp + 60000) / 1000)
+            return
+        self.logger.warning(
+            f"{exchange_name} candle coalescer: Direct insert failed, "
+            f"staging {len(candles)} closed candles for the WS updater")
+        pipe = self.writer.redis_client.pipeline(transaction=False)
+        for base_id, quote_id, timestamp, ohlcv in candles:
+            self.writer.write(
+                base_id, quote_id, timestamp, *ohlcv, client=pipe, stage=True)
+        try:
+            pipe.execute()
+        except Exception as exc:
+            self.logger.warning(
+                f"{exchange_name} candle coalescer: EXCEPTION: {exc}")
+
+    async def run(self) -> NoReturn:
+        '''
+        Flushes the recorded candles every `tick_secs`
+        '''
+
+        while True:
+            await asyncio.sleep(self.tick_secs)
+            try:
+                self.flush()
+            except Exception as exc:
+                self.logger.warning(
+                    f"{self.writer.exchange_name} candle coalescer: EXCEPTION: {exc}")
+            if self.sink is not None:
+                self.flush_closed()
+
+
+class SubscribePacer:
+    '''
+    Spaces messages sent over a WS connection to at most `rate`
+        per second (e.g., subscribe requests, under the message-rate
+        limit of an exchange)
+    '''
+
+    def __init__(self, rate: float):
+        '''
+        :params:
+            `rate`: float - max messages per second
+        '''
+
+        self.interval = 1 / rate
+        self.next_at = 0.0
+
+    async def wait(self) -> None:
+        '''
+        Waits until the next message can be sent
+        '''
+
+        now = asyncio.get_running_loop().time()
+        delay = self.next_at - now
+        self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class WSShard:
+    '''
+    A WS connection of a fetcher and the symbols assigned to it
+
+    Symbols assigned while the shard is connected are subscribed to
+        (or unsubscribed from) through its `commands` queue
+        of (`subscribe` or `unsubscribe`, symbols); On (re)connect,
+        the shard subscribes to all of its symbols instead
+    '''
+
+    def __init__(self, id_: int, capacity: int):
+        '''
+        :params:
+            `id_`: int - id of the shard (e.g., for logs and metrics)
+            `capacity`: int - max symbols of the shard
+        '''
+
+        self.id = id_
+        self.capacity = capacity
+        self.symbols = set()
+        self.commands = asyncio.Queue()
+        self.connected = False
+        self.disconnected_at = time.time()
+        self.last_frame_at = None
+        self.lag_secs = 0.0
+
+    @property
+    def room(self) -> int:
+        '''
+        Number of symbols the shard can still take
+        '''
+
+        return self.capacity - len(self.symbols)
+
+    def connect(self) -> list:
+        '''
+        Marks the shard as connected; Returns its symbols to subscribe to
+
+        Commands queued before are covered by these symbols and dropped
+        '''
+
+        while not self.commands.empty():
+            self.commands.get_nowait()
+        self.connected = True
+        self.last_frame_at = time.time()
+        self.lag_secs = 0.0
+        return sorted(self.symbols)
+
+    def disconnect(self) -> None:
+        '''
+        Marks the shard as disconnected
+        '''
+
+        if self.connected:
+            self.connected = False
+            self.disconnected_at = time.time()
+
+    def observe(self, event_secs: float = None) -> None:
+        '''
+        Records that frames were received
+
+        :params:
+            `event_secs`: float - exchange time of the latest event
+                in seconds (optional)
+        '''
+
+        self.last_frame_at = time.time()
+        if event_secs is not None:
+            self.lag_secs = max(self.last_frame_at - event_secs, 0.0)
+
+    def lag(self, now: float) -> float:
+        '''
+        Returns the seconds the shard lags behind the exchange:
+            the lag of its latest event, or the time since its
+            last frame if longer
+
+        :params:
+            `now`: float - current time in seconds
+        '''
+
+        if not self.symbols or self.last_frame_at is None:
+            return 0.0
+        return max(self.lag_secs, now - self.last_frame_at)
+
+
+class WSShardManager:
+    '''
+    Packs the symbols of a WS fetcher into shards (connections)
+        of at most `capacity` symbols, filled up to a `fill`
+        fraction so that shards have room to take over symbols of others
+
+    `rebalance` moves symbols of shards that lag or stay disconnected
+        to healthy shards, and opens new shards for lagging shards
+        if healthy shards are full
+
+    Each shard runs as one connection task (see `start`); Tasks that stop
+        with an exception are restarted by `restart_stopped`
+    '''
+
+    def __init__(
+            self,
+            capacity: int,
+            fill: float = 1.0,
+            logger: logging.Logger = None
+        ):
+        '''
+        :params:
+            `capacity`: int - max symbols per shard
+            `fill`: float - fraction of `capacity` filled by `assign`
+            `logger`: Logger obj (optional)
+        '''
+
+        self.capacity = capacity
+        self.fill_size = max(int(capacity * fill), 1)
+        self.logger = logger or logging.getLogger(__name__)
+        self.shards = []
+        self.tasks = {}
+
+    def start(self, shards: Iterable, connect: Callable) -> None:
+        '''
+        Starts a connection task of `connect(shard)` for each of `shards`
+
+        :params:
+            `shards`: iterable of WSShard obj
+            `connect`: coroutine function of a shard (e.g., `subscribe`)
+        '''
+
+        for shard in shards:
+            self.tasks[shard.id] = asyncio.create_task(connect(shard))
+
+    def restart_stopped(self, connect: Callable) -> int:
+        '''
+        Restarts the connection tasks that stopped;
+            Returns the number of tasks restarted
+
+        :params:
+            `connect`: coroutine function of a shard (e.g., `subscribe`)
+        '''
+
+        restarted = 0
+        for shard in self.shards:
+            task = self.tasks.get(shard.id)
+            if task is None or not task.done():
+                continue
+            exc = None if task.cancelled() else task.exception()
+            shard.disconnect()
+            self.logger.error(
+                f"Shard manager: Connection {shard.id} stopped ({exc!r}) - restarting")
+            self.tasks[shard.id] = asyncio.create_task(connect(shard))
+            restarted += 1
+        return restarted
+
+    def stop(self) -> None:
+        '''
+        Cancels all connection tasks
+        '''
+
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks = {}
+        for shard in self.shards:
+            shard.disconnect()
+
+    def add_shard(self) -> WSShard:
+        '''
+        Adds an empty shard; Returns it
+        '''
+
+        shard = WSShard(len(self.shards), self.capacity)
+        self.shards.append(shard)
+        return shard
+
+    def assign(self, symbols: Iterable) -> list:
+        '''
+        Packs `symbols` into shards, adding shards as needed;
+            Returns the added shards
+
+        :params:
+            `symbols`: iterable of symbols
+        '''
+
+        added = []
+        for symbol in symbols:
+            if not self.shards or len(self.shards[-1].symbols) >= self.fill_size:
+                added.append(self.add_shard())
+            self.shards[-1].symbols.add(symbol)
+        return added
+
+    def move(self, symbols: list, source: WSShard, target: WSShard) -> None:
+        '''
+        Moves `symbols` from shard `source` to shard `target`
+        '''
+
+        source.symbols.difference_update(symbols)
+        target.symbols.update(symbols)
+        if source.connected:
+            source.commands.put_nowait(('unsubscribe', symbols))
+        if target.connected:
+            target.commands.put_nowait(('subscribe', symbols))
+        self.logger.info(
+            f"Shard manager: Moved {len(symbols)} symbols "
+            f"from connection {source.id} to connection {target.id}"
+        )
+
+    def rebalance(self, max_lag: float) -> list:
+        '''
+        Moves symbols off unhealthy shards; Returns the added shards
+
+        A connected shard is lagging if it lags more than `max_lag`
+            behind the least lagging shard (so that a skewed local clock
+            does not count), and sheds half of its symbols; A shard
+            disconnected for more than `max_lag` sheds all of them
+
+        :params:
+            `max_lag`: float - seconds of lag tolerated
+        '''
+
+        now = time.time()
+        lags = {
+            shard.id: shard.lag(now) for shard in self.shards if shard.connected
+        }
+        baseline = min(lags.values(), default=0.0)
+        healthy = [
+            shard for shard in self.shards
+            if shard.connected and lags[shard.id] - baseline <= max_lag
+        ]
+        added = []
+        for shard in list(self.shards):
+            if not shard.symbols or shard in healthy:
+                continue
+            symbols = sorted(shard.symbols)
+            if shard.connected:
+                symbols = symbols[len(symbols) // 2:]
+            elif now - shard.disconnected_at <= max_lag:
+                continue
+            added.extend(self.relocate(
+                symbols, shard, healthy, add_shard=shard.connected))
+        return added
+
+    def relocate(
+            self,
+            symbols: list,
+            source: WSShard,
+            targets: list = None,
+            add_shard: bool = True
+        ) -> list:
+        '''
+        Moves `symbols` of shard `source` to the `targets` shards with
+            the most room, then the rest to a new shard if `add_shard`;
+            Returns the added shards
+
+        :params:
+            `symbols`: list of symbols
+            `source`: WSShard obj
+            `targets`: list of WSShard obj; Connected shards other than
+                `source` if not provided
+            `add_shard`: bool - whether to add a shard for symbols
+                that do not fit
+        '''
+
+        if targets is None:
+            targets = [
+                shard for shard in self.shards
+                if shard.connected and shard is not source
+            ]
+        for target in sorted(targets, key=lambda s: s.room, reverse=True):
+            take, symbols = symbols[:target.room], symbols[target.room:]
+            if take:
+                self.move(take, source, target)
+        if symbols and add_shard:
+            target = self.add_shard()
+            self.move(symbols, source, target)
+            return [target]
+        return []
+
+
+class WSGapFiller:
+    '''
+    Repairs gaps of a WS fetcher with its REST fetcher
+
+    Records the open time of the latest candle seen of each symbol;
+        When symbols are (re)subscribed (e.g., after a reconnect),
+        params covering the minutes missed since then are fed to the REST
+        live lane, one page at most each, and `resume` is called shortly
+        after to consume them; `resume` should consume the live lane
+        only, without recovering params in flight in other fetchers
+    '''
+
+    def __init__(
+            self,
+            fetcher_class: Any,
+            exchange_name: str,
+            redis_client: redis.Redis,
+            resume: Callable = None,
+            logger: logging.Logger = None,
+            max_gap_secs: float = WS_GAP_MAX_SECS
+        ):
+        '''
+        :params:
+            `fetcher_class`: REST fetcher class of the exchange
+            `exchange_name`: string
+            `redis_client`: Redis client
+            `resume`: callable that starts consuming the live lane
+                (e.g., the `delay` of a Celery `resume_fetch_live` task)
+                (optional)
+            `logger`: Logger obj (optional)
+            `max_gap_secs`: float - max seconds of a gap to repair
+        '''
+
+        self.fetcher_class = fetcher_class
+        self.exchange_name = exchange_name
+        self.redis_client = redis_client
+        self.resume = resume
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_gap_secs = max_gap_secs
+        self.page_span = datetime.timedelta(
+            minutes=OHLCVS_PAGE_SPAN_MINS[exchange_name])
+        self.last_seen = {}
+        self.resume_handle = None
+
+    def seen(self, symbol: str, timestamp: int) -> None:
+        '''
+        Records a candle of `symbol`
+
+        :params:
+            `symbol`: string - symbol of the REST fetcher
+            `timestamp`: open time in milliseconds
+        '''
+
+        timestamp = int(timestamp)
+        if timestamp > self.last_seen.get(symbol, -1):
+            self.last_seen[symbol] = timestamp
+
+    def windows(self, symbols: Iterable, now: float = None) -> list:
+        '''
+        Returns the missed windows of `symbols` as (symbol, start, end):
+            from the latest candle seen (which may not have been final)
+            to the last minute closed before `now`; Marks them as repaired
+
+        :params:
+            `symbols`: iterable of symbols
+            `now`: float - current time in seconds (optional)
+        '''
+
+        if now is None:
+            now = time.time()
+        current = int(now // 60) * 60000
+        oldest = current - int(self.max_gap_secs * 1000)
+        windows = []
+        for symbol in symbols:
+            start = self.last_seen.get(symbol)
+            if start is None or start >= current:
+                continue
+            windows.append((symbol, max(start, oldest), current - 60000))
+            self.last_seen[symbol] = current
+        return windows
+
+    def fill(self, symbols: Iterable) -> int:
+        '''
+        Feeds params of the missed windows of `symbols` to the live lane
+            and schedules `resume`; Returns the number of params fed
+
+        :params:
+            `symbols`: iterable of symbols
+        '''
+
+        params_list = []
+        for symbol, start, end in self.windows(symbols):
+            # Pages end one minute before the next page starts
+            for page_start, page_end in split_window(
+                    milliseconds_to_datetime(start),
+                    milliseconds_to_datetime(end + 60000),
+                    self.page_span):
+                params_list.append(
+                    self.fetcher_class.make_window_params(
+                        symbol,
+                        page_start,
+                        page_end - datetime.timedelta(minutes=1)
+                    )
+                )
+        if not params_list:
+            return 0
+
+        # Gaps are at most `WS_GAP_MAX_SECS` old, and are fed to the live
+        #   lane even if older than `OHLCVS_LIVE_LANE_SECS`, so that
+        #   they are repaired before any backlog
+        self.redis_client.sadd(
+            OHLCVS_TOFETCH_LANE_REDIS_KEY.format(
+                exchange=self.exchange_name, lane=OHLCVS_LANE_LIVE),
+            *params_list
+        )
+        fed = len(params_list)
+        WS_GAP_PARAMS.labels(self.exchange_name).inc(fed)
+        self.logger.info(
+            f"{self.exchange_name} gap filler: Fed {fed} params to repair WS gaps")
+        if self.resume is not None and self.resume_handle is None:
+            self.resume_handle = asyncio.get_running_loop().call_later(
+                WS_GAP_RESUME_DELAY_SECS, self._resume)
+        return fed
+
+    def _resume(self) -> None:
+        '''
+        Calls `resume`
+        '''
+
+        self.resume_handle = None
+        try:
+            self.resume()
+        except Exception as exc:
+            self.logger.warning(
+                f"{self.exchange_name} gap filler: Resume failed: {exc}")
+
+
+class WSFrameRecorder:
+    '''
+    Records raw frames of a WS fetcher, with their receive time
+        and connection ID, to gzipped JSON-lines segment files
+        named `{exchange}-{start in milliseconds}.jsonl.gz` in `directory`
+
+    The first line of a segment is a header dict (exchange, start time
+        and the dict returned by `meta`, e.g., the symbol data needed
+        to replay it); Each other line is a list of
+        [receive time in seconds, connection ID, frame]
+
+    A new segment is started after `segment_secs` or `segment_bytes`
+        bytes of frames (uncompressed), so segments can be replayed,
+        copied or deleted while recording goes on
+    '''
+
+    def __init__(
+            self,
+            directory: str,
+            exchange_name: str,
+            meta: Callable[[], dict] = None,
+            segment_secs: float = WS_RECORD_SEGMENT_SECS,
+            segment_bytes: int = WS_RECORD_SEGMENT_BYTES,
+            compresslevel: int = WS_RECORD_COMPRESSLEVEL
+        ):
+        '''
+        :params:
+            `directory`: string - directory of the segment files
+            `exchange_name`: string
+            `meta`: callable returning a JSON-serializable dict
+                to write in the header of each segment (optional)
+            `segment_secs`: float - max seconds of a segment
+            `segment_bytes`: int - max bytes of frames of a segment
+            `compresslevel`: int - gzip compression level
+        '''
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.exchange_name = exchange_name
+        self.meta = meta
+        self.segment_secs = segment_secs
+        self.segment_bytes = segment_bytes
+        self.compresslevel = compresslevel
+        self.file = None
+        self.path = None
+        self.started_at = 0.0
+        self.written = 0
+
+    def _open(self, now: float) -> None:
+        '''
+        Closes the current segment and starts a new one at `now`
+        '''
+
+        self.close()
+        self.path = os.path.join(
+            self.directory, f"{self.exchange_name}-{int(now * 1000)}.jsonl.gz")
+        self.file = gzip.open(
+            self.path, 'wt', compresslevel=self.compresslevel, encoding='utf-8')
+        header = {'exchange': self.exchange_name, 'started_at': now}
+        if self.meta is not None:
+            header.update(self.meta())
+        self.file.write(json.dumps(header) + "\n")
+        self.started_at = now
+        self.written = 0
+
+    def record(self, connection: int, frame: Any, recv_time: float = None) -> None:
+        '''
+        Writes a frame received on `connection`
+
+        :params:
+            `connection`: int - connection ID
+            `frame`: string (or JSON-serializable obj) of the frame
+            `recv_time`: float - receive time in seconds;
+                Now if not provided
+        '''
+
+        if recv_time is None:
+            recv_time = time.time()
+        if self.file is None \
+            or recv_time - self.started_at >= self.segment_secs \
+            or self.written >= self.segment_bytes:
+            self._open(recv_time)
+        line = json.dumps([recv_time, connection, frame]) + "\n"
+        self.file.write(line)
+        self.written += len(line)
+
+    def close(self) -> None:
+        '''
+        Closes the current segment
+        '''
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_frame_segment(path: str) -> Tuple[dict, Iterator[list]]:
+    '''
+    Returns the header of a segment written by `WSFrameRecorder`
+        and an iterator of its [receive time, connection ID, frame] lists;
+        The file is closed when the iterator is exhausted
+
+    :params:
+        `path`: string - path of the segment file
+    '''
+
+    file = gzip.open(path, 'rt', encoding='utf-8')
+    try:
+        header = json.loads(file.readline())
+    except Exception:
+        file.close()
+        raise
+
+    def frames() -> Iterator[list]:
+        # A segment still being written ends with an incomplete
+        #   gzip stream and possibly an incomplete line
+        with file:
+            try:
+                for line in file:
+                    yield json.loads(line)
+            except (EOFError, ValueError):
+                return
+
+    return header, frames()
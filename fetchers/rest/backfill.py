@@ -0,0 +1,140 @@
+# This module splits OHLCV backfills into chunks
+#   and keeps their progress in Redis
+
+import datetime
+import time
+from typing import Iterable, List, Tuple
+
+import redis
+
+from common.config.constants import \
+    REDIS_HOST, REDIS_PASSWORD, REDIS_USER
+from fetchers.config.constants import \
+    BACKFILL_PROGRESS_REDIS_KEY, BACKFILL_PROGRESS_TTL_SECS
+from fetchers.rest.retrier import split_window
+
+
+def make_backfill_chunks(
+        symbols: Iterable[str],
+        start_date: datetime.datetime,
+        end_date: datetime.datetime,
+        chunk_symbols: int,
+        chunk_span: datetime.timedelta
+    ) -> List[Tuple[List[str], datetime.datetime, datetime.datetime]]:
+    '''
+    Splits a backfill of `symbols` from `start_date` to `end_date`
+        into chunks of at most `chunk_symbols` symbols and `chunk_span`;
+        Returns a list of (symbols, start_date, end_date) tuples,
+        most recent windows first
+
+    :params:
+        `symbols`: iterable of symbol strings
+        `start_date`: datetime obj
+        `end_date`: datetime obj
+        `chunk_symbols`: int
+        `chunk_span`: timedelta obj
+    '''
+
+    symbols = sorted(symbols)
+    symbol_chunks = [
+        symbols[i:i + chunk_symbols]
+        for i in range(0, len(symbols), chunk_symbols)
+    ]
+    windows = split_window(start_date, end_date, chunk_span)
+    return [
+        (symbol_chunk, window_start, window_end)
+        for window_start, window_end in reversed(windows)
+        for symbol_chunk in symbol_chunks
+    ]
+
+
+class BackfillProgress:
+    '''
+    Aggregate progress of a backfill, kept in a Redis hash
+        shared by all its chunk tasks
+    '''
+
+    def __init__(self, backfill_id: str):
+        '''
+        :params:
+            `backfill_id`: string - e.g., id of the Celery task
+                that started the backfill
+        '''
+
+        self.backfill_id = backfill_id
+        self.key = BACKFILL_PROGRESS_REDIS_KEY.format(backfill_id=backfill_id)
+        self.redis_client = redis.Redis(
+            host=REDIS_HOST,
+            username=REDIS_USER,
+            password=REDIS_PASSWORD,
+            decode_responses=True
+        )
+
+    def start(self, exchange_name: str, chunks: int) -> None:
+        '''
+        Records the start of a backfill of `chunks` chunks
+
+        :params:
+            `exchange_name`: string
+            `chunks`: int
+        '''
+
+        with self.redis_client.pipeline() as pipe:
+            pipe.hset(self.key, mapping={
+                'exchange': exchange_name,
+                'chunks': chunks,
+                'done': 0,
+                'failed': 0,
+                'started_at': time.time()
+            })
+            pipe.expire(self.key, BACKFILL_PROGRESS_TTL_SECS)
+            pipe.execute()
+
+    def chunk_done(self, failed: bool=False) -> dict:
+        '''
+        Records a finished chunk; Returns the progress
+
+        :params:
+            `failed`: bool - whether the chunk failed
+        '''
+
+        self.redis_client.hincrby(self.key, 'failed' if failed else 'done', 1)
+        return self.get()
+
+    def get(self) -> dict:
+        '''
+        Returns the progress in this form:
+            {
+                'exchange': 'binance',
+                'chunks': 40,
+                'done': 12,
+                'failed': 1,
+                'elapsed_secs': 360.5
+            }
+        '''
+
+        progress = self.redis_client.hgetall(self.key)
+        if not progress:
+            return {}
+        return {
+            'exchange': progress['exchange'],
+            'chunks': int(progress['chunks']),
+            'done': int(progress['done']),
+            'failed': int(progress['failed']),
+            'elapsed_secs': round(time.time() - float(progress['started_at']), 1)
+        }
+
+    def describe(self) -> str:
+        '''
+        Returns a printable line of the progress
+        '''
+
+        progress = self.get()
+        if not progress:
+            return f"Backfill {self.backfill_id}: no progress found"
+        finished = progress['done'] + progress['failed']
+        return (
+            f"Backfill {self.backfill_id} of {progress['exchange']}: "
+            f"{finished}/{progress['chunks']} chunks finished "
+            f"({progress['failed']} failed) in {progress['elapsed_secs']}s"
+        )
@@ -2,47 +2,113 @@
 
 import asyncio
 import datetime
+import json
+import os
+import signal
+import time
 from asyncio.events import AbstractEventLoop
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Iterable
 
 import httpx
 import psycopg2
 import redis
 
 from common.config.constants import \
-    DBCONNECTION, REDIS_HOST, REDIS_PASSWORD, \
+    DBCONNECTION, DEFAULT_DATETIME_STR_QUERY, \
+    OHLCVS_TABLE, REDIS_DELIMITER, REDIS_HOST, REDIS_PASSWORD, \
     REDIS_USER, SYMBOL_EXCHANGE_TABLE
-from common.utils.asyncioutils import aio_set_exception_handler
+from common.helpers.datetimehelpers import str_to_datetime
+from common.utils.asyncioutils import \
+    aio_set_exception_handler, aio_shutdown
 from common.utils.logutils import create_logger
 from fetchers.config.constants import \
+    BACKFILL_FETCHING_REDIS_KEY, BACKFILL_TOFETCH_REDIS_KEY, \
     HTTPX_DEFAULT_TIMEOUT, HTTPX_MAX_CONCURRENT_CONNECTIONS, \
-    OHLCVS_FETCHING_REDIS_KEY, OHLCVS_TOFETCH_REDIS_KEY, \
+    OHLCVS_CONSUME_BATCH_SIZE, OHLCVS_FETCHING_REDIS_KEY, \
+    OHLCVS_LANE_BACKFILL, OHLCVS_LANE_HISTORY, OHLCVS_LANE_LIVE, OHLCVS_LANE_RECENT, \
+    OHLCVS_LANE_RETRY, OHLCVS_LANE_WEIGHTS, OHLCVS_LIVE_LANE_SECS, \
+    OHLCVS_RECENT_LANE_SECS, OHLCVS_RETRY_WINDOWS_REDIS_KEY, \
+    OHLCVS_STRICT_LANES, OHLCVS_TOFETCH_LANE_REDIS_KEY, \
+    OHLCVS_TOFETCH_REDIS_KEY, OHLCV_UNIQUE_COLUMNS, \
+    OHLCV_UPDATE_COLUMNS, PSQL_SINK_CONNECTIONS, REST_DRAIN_TIMEOUT_SECS, \
+    REST_PAGE_CACHE_DIR, REST_PAGE_CACHE_MAX_BYTES, STAGE_TIMERS_DUMP_SIGNAL, \
     SYMEXCH_UNIQUE_COLUMNS, SYMEXCH_UPDATE_COLUMNS
 from fetchers.config.queries import \
-    MUTUAL_BASE_QUOTE_QUERY, PSQL_INSERT_UPDATE_QUERY
+    MUTUAL_BASE_QUOTE_QUERY, PSQL_INSERT_IGNOREDUP_QUERY, \
+    PSQL_INSERT_UPDATE_QUERY, RESOLVE_ERRORS_QUERY
 from fetchers.helpers.dbhelpers import psql_bulk_insert
+from fetchers.helpers.sink import ParallelCopySink
+from fetchers.utils.cache import PageCache
+from fetchers.utils.circuit import CIRCUIT_OPEN, SymbolCircuitBreaker
+from fetchers.utils.lanes import WeightedLaneScheduler
+from fetchers.utils.metrics import \
+    FETCHING_PARAMS, PAGE_CACHE_REQUESTS, ROWS_INSERTED, TOFETCH_PARAMS, \
+    start_metrics_server
+from fetchers.utils.timers import StageTimer
 
 
 class BaseOHLCVFetcher:
     '''Base REST fetcher for all exchanges
     '''
 
-    def __init__(self, exchange_name: str):
-        # Name, Redis to-fetch and fetching set keys
+    def __init__(
+        self,
+        exchange_name: str,
+        redis_client: redis.Redis = None,
+        psql_conn = None
+    ):
+        '''
+        :params:
+            `exchange_name`: string - exchange name
+            `redis_client`: Redis client to share (optional)
+            `psql_conn`: psycopg2 conn obj to share (optional);
+                it is not closed by `close_connections`
+        '''
+
+        # Name, Redis to-fetch lane set keys and fetching hash key
+        # Lane scheduler plans how many params to take from each lane
         self.exchange_name = exchange_name
-        self.tofetch_key = OHLCVS_TOFETCH_REDIS_KEY.format(exchange=exchange_name)
+        self.lane_scheduler = WeightedLaneScheduler(
+            OHLCVS_LANE_WEIGHTS, OHLCVS_STRICT_LANES
+        )
+        self.tofetch_keys = {
+            lane: OHLCVS_TOFETCH_LANE_REDIS_KEY.format(
+                exchange=exchange_name, lane=lane
+            ) for lane in self.lane_scheduler.lanes
+        }
         self.fetching_key = OHLCVS_FETCHING_REDIS_KEY.format(exchange=exchange_name)
 
-        # Postgres connection
-        self.psql_conn = psycopg2.connect(DBCONNECTION)
+        # Redis retry windows hash key
+        #   and windows of retry params being consumed
+        self.retry_windows_key = \
+            OHLCVS_RETRY_WINDOWS_REDIS_KEY.format(exchange=exchange_name)
+        self.retry_windows = {}
+        self.consume_batch_size = OHLCVS_CONSUME_BATCH_SIZE[exchange_name]
+
+        # Postgres connection, closed with the fetcher only if it is its own
+        self.owns_psql_conn = psql_conn is None
+        if psql_conn is None:
+            psql_conn = psycopg2.connect(DBCONNECTION)
+        self.psql_conn = psql_conn
         self.psql_cur = self.psql_conn.cursor()
 
         # Redis client
-        self.redis_client = redis.Redis(
-            host=REDIS_HOST,
-            username=REDIS_USER,
-            password=REDIS_PASSWORD,
-            decode_responses=True
-        )
+        if redis_client is None:
+            redis_client = redis.Redis(
+                host=REDIS_HOST,
+                username=REDIS_USER,
+                password=REDIS_PASSWORD,
+                decode_responses=True
+            )
+        self.redis_client = redis_client
+
+        # Circuit breakers of symbols, symbols whose circuit this fetcher
+        #   opened and half-open symbols this fetcher probes;
+        #   Their new params are not fetched
+        self.circuit_breaker = SymbolCircuitBreaker(self.redis_client, exchange_name)
+        self.open_circuits = set()
+        self.probing = set()
 
         # HTTPX limits
         self.httpx_limits = httpx.Limits(
@@ -50,12 +116,39 @@ class BaseOHLCVFetcher:
         )
         self.httpx_timout = httpx.Timeout(HTTPX_DEFAULT_TIMEOUT)
 
-        # Redis initial feeding status
+        # Redis initial feeding status and lane being fed
         self.feeding = False
+        self.feeding_lane = OHLCVS_LANE_HISTORY
+
+        # Whether to recover params left in the fetching hash when consuming;
+        #   Off for fetchers running alongside others of the same exchange
+        #   (e.g., backfill chunks), whose params in the fetching hash
+        #   are not left over
+        self.recover = True
+
+        # Drain status and tasks waiting for rate limiters,
+        #   which are cancelled first when draining
+        self.draining = False
+        self.waiting_tasks = set()
 
         # Log
         self.logger = create_logger(exchange_name)
 
+        # Stage timers of the fetch pipeline
+        self.stage_timer = StageTimer(exchange_name)
+
+        # Optional on-disk cache of immutable pages
+        self.page_cache = None
+        if REST_PAGE_CACHE_DIR:
+            self.page_cache = PageCache(
+                os.path.join(REST_PAGE_CACHE_DIR, exchange_name),
+                REST_PAGE_CACHE_MAX_BYTES
+            )
+
+        # Optional sink inserting OHLCVs over several PSQL connections
+        #   (see `use_parallel_sink`)
+        self.sink = None
+
         # Symbol data
         self.symbol_data = {}
 
@@ -69,18 +162,605 @@ class BaseOHLCVFetcher:
         if loop.is_closed():
             asyncio.set_event_loop(asyncio.new_event_loop())
             loop = asyncio.get_event_loop()
-        aio_set_exception_handler(loop)
+        self.draining = False
+        aio_set_exception_handler(loop, self._drain)
         return loop
 
+    def _drain(self, sig: signal.Signals) -> None:
+        '''
+        Signal handler that drains the fetcher: stops consuming new params,
+            requeues params still waiting for rate limiters and lets
+            in-flight pages finish and checkpoint; Outstanding tasks are
+            cancelled after `REST_DRAIN_TIMEOUT_SECS` or on a second signal
+
+        :params:
+            `sig`: signal received
+        '''
+
+        loop = asyncio.get_event_loop()
+        if self.draining:
+            self.logger.info(f"Drain: Received {sig.name} again, shutting down")
+            asyncio.create_task(aio_shutdown(loop, signal=sig))
+            return
+        self.logger.info(
+            f"Drain: Received {sig.name}, draining within {REST_DRAIN_TIMEOUT_SECS}s")
+        self.draining = True
+        for task in self.waiting_tasks:
+            task.cancel()
+        loop.call_later(
+            REST_DRAIN_TIMEOUT_SECS,
+            lambda: asyncio.create_task(aio_shutdown(loop, signal=sig))
+        )
+
+    @contextmanager
+    def _drainable(self):
+        '''
+        Marks the current task as cancellable by `_drain` during its block;
+            Cancels it right away if already draining
+        '''
+
+        if self.draining:
+            raise asyncio.CancelledError()
+        task = asyncio.current_task()
+        self.waiting_tasks.add(task)
+        try:
+            yield
+        finally:
+            self.waiting_tasks.discard(task)
+
+    @classmethod
+    def make_window_params(cls, *args, **kwargs) -> str:
+        '''
+        Signature for make_window_params in child class
+        '''
+
     async def _fetch_ohlcvs_symbols(*args, **kwargs) -> None:
         '''
         Signature for _fetch_ohlcvs_symbols in child class
         '''
 
-    async def _consume_ohlcvs_redis(self, *args, **kwargs) -> None:
+    async def _get_and_parse_ohlcv(self, *args, **kwargs) -> None:
+        '''
+        Signature for _get_and_parse_ohlcv in child class
+        '''
+
+    @asynccontextmanager
+    async def _rate_limited(self):
+        '''
+        Waits for the rate limiter before its block, timing the `wait` stage
+        '''
+
+        with self.stage_timer.time('wait'), self._drainable():
+            await self.rate_limiter.wait()
+        yield
+
+    async def _timed_get(self, url: str) -> httpx.Response:
+        '''
+        GETs `url` with `self.async_httpx_client`, timing the `connect`
+            (new connections only) and `transfer` stages
+
+        Uses the httpx `trace` extension, see:
+            https://www.encode.io/httpcore/extensions/#trace
+
+        :params:
+            `url`: string
+        '''
+
+        started = {}
+        stages = {'connect': 0.0, 'transfer': 0.0}
+
+        async def trace(event_name: str, info: dict) -> None:
+            name, _, state = event_name.rpartition('.')
+            if state == "started":
+                started[name] = time.perf_counter()
+            elif name in started:
+                stage = 'connect' if name.startswith("connection.") else 'transfer'
+                stages[stage] += time.perf_counter() - started.pop(name)
+
+        try:
+            return await self.async_httpx_client.get(
+                url, extensions={'trace': trace}
+            )
+        finally:
+            if stages['connect']:
+                self.stage_timer.observe('connect', stages['connect'])
+            self.stage_timer.observe('transfer', stages['transfer'])
+
+    def _is_immutable_page(self, url: str, data: Any = None) -> bool:
+        '''
+        Signature for _is_immutable_page in child class;
+            Returns whether the page of `url` never changes
+            (e.g., historical candles), so it can be cached
+
+        :params:
+            `url`: string
+            `data`: decoded body of the page; None when the page
+                is looked up before being requested
+        '''
+
+        return False
+
+    def _get_cached_page(self, url: str) -> Any:
+        '''
+        Returns the decoded page of `url` from the page cache;
+            None if it is not cached, not immutable or there is no cache
+
+        :params:
+            `url`: string
+        '''
+
+        if self.page_cache is None or not self._is_immutable_page(url):
+            return None
+        content = self.page_cache.get(url)
+        if content is None:
+            PAGE_CACHE_REQUESTS.labels(self.exchange_name, 'miss').inc()
+            return None
+        PAGE_CACHE_REQUESTS.labels(self.exchange_name, 'hit').inc()
+        with self.stage_timer.time('decode'):
+            return json.loads(content)
+
+    def _cache_page(self, url: str, resp: httpx.Response, data: Any) -> None:
+        '''
+        Puts the body of a successful response of `url` in the page cache,
+            if there is one and the page is immutable
+
+        :params:
+            `url`: string
+            `resp`: httpx response
+            `data`: decoded body of `resp`
+        '''
+
+        if self.page_cache is not None and self._is_immutable_page(url, data):
+            self.page_cache.put(url, resp.content)
+
+    def use_parallel_sink(
+            self, connections: int=PSQL_SINK_CONNECTIONS, bulk_load: bool=False
+        ) -> None:
+        '''
+        Inserts OHLCVs through a sink of `connections` PSQL connections
+            copying in parallel, instead of `self.psql_conn`;
+            Meant for backfills, whose inserts are the bottleneck
+
+        :params:
+            `connections`: int - number of PSQL connections
+            `bulk_load`: bool - whether to use the bulk-load mode
+                of the sink (for historical runs)
+        '''
+
+        self.sink = ParallelCopySink(connections, bulk_load=bulk_load)
+
+    def only_lanes(self, lanes: Iterable[str]) -> None:
+        '''
+        Consumes only the to-fetch `lanes`, without recovering params
+            left in the fetching hash; For tasks that must not pick up
+            the backlog of other lanes or params in flight in other
+            fetchers (e.g., retries, WS gap repairs)
+
+        :params:
+            `lanes`: iterable of lane names
+        '''
+
+        lanes = set(lanes)
+        self.lane_scheduler = WeightedLaneScheduler(
+            {
+                lane: weight for lane, weight in OHLCVS_LANE_WEIGHTS.items()
+                if lane in lanes
+            },
+            [lane for lane in OHLCVS_STRICT_LANES if lane in lanes]
+        )
+        self.tofetch_keys = {
+            lane: key for lane, key in self.tofetch_keys.items() if lane in lanes
+        }
+        self.recover = False
+
+    def use_backfill_keys(self, backfill_id: str, chunk_id: str) -> None:
+        '''
+        Feeds and consumes a to-fetch set and fetching hash of its own
+            (lane `OHLCVS_LANE_BACKFILL`) instead of the lanes of
+            the exchange, so that a backfill chunk fetches only its own
+            params and finishes when they are done, and other fetchers
+            never recover its params in flight
+
+        :params:
+            `backfill_id`: string - id of the backfill
+            `chunk_id`: string - id of the chunk (e.g., its task id)
+        '''
+
+        keys = {
+            'exchange': self.exchange_name,
+            'backfill_id': backfill_id,
+            'chunk_id': chunk_id
+        }
+        self.lane_scheduler = WeightedLaneScheduler({OHLCVS_LANE_BACKFILL: 1})
+        self.tofetch_keys = {
+            OHLCVS_LANE_BACKFILL: BACKFILL_TOFETCH_REDIS_KEY.format(**keys)
+        }
+        self.fetching_key = BACKFILL_FETCHING_REDIS_KEY.format(**keys)
+        self.feeding_lane = OHLCVS_LANE_BACKFILL
+        self.recover = False
+
+    def _expire_tofetch_redis(self, secs: int) -> None:
+        '''
+        Sets the to-fetch sets and fetching hash of the fetcher to expire
+            in `secs` (e.g., those of a backfill chunk, once it stops)
+        '''
+
+        with self.redis_client.pipeline() as pipe:
+            for key in self.tofetch_keys.values():
+                pipe.expire(key, secs)
+            pipe.expire(self.fetching_key, secs)
+            pipe.execute()
+
+    async def _insert_ohlcvs(self, ohlcvs_parsed: list, update: bool=False) -> bool:
+        '''
+        Bulk inserts parsed OHLCV rows into PSQL db, timing the `insert` stage;
+            through the parallel sink if there's one;
+            Returns a boolean value indicating whether insert is successful
+
+        :params:
+            `ohlcvs_parsed`: list of OHLCV rows
+            `update`: bool - whether to update on conflict
+        '''
+
+        with self.stage_timer.time('insert'):
+            if self.sink is not None:
+                insert_success = await self.sink.insert(ohlcvs_parsed, update)
+            elif update:
+                insert_success = psql_bulk_insert(
+                    self.psql_conn,
+                    ohlcvs_parsed,
+                    OHLCVS_TABLE,
+                    insert_update_query = PSQL_INSERT_UPDATE_QUERY,
+                    unique_cols = OHLCV_UNIQUE_COLUMNS,
+                    update_cols = OHLCV_UPDATE_COLUMNS
+                )
+            else:
+                insert_success = psql_bulk_insert(
+                    self.psql_conn,
+                    ohlcvs_parsed,
+                    OHLCVS_TABLE,
+                    insert_ignoredup_query = PSQL_INSERT_IGNOREDUP_QUERY
+                )
+        if insert_success:
+            ROWS_INSERTED.labels(self.exchange_name, 'rest').inc(len(ohlcvs_parsed))
+        return insert_success
+
+    def _dump_stage_timers(self, *args) -> None:
+        '''
+        Logs the summary of stage timers; Also a signal handler
+        '''
+
+        self.logger.info(self.stage_timer.summary())
+
+    @contextmanager
+    def _stage_timers_dumped(self):
+        '''
+        Resets stage timers before its block and dumps them after it;
+            Also dumps them on `STAGE_TIMERS_DUMP_SIGNAL` during the block
+            (only in the main thread)
+        '''
+
+        self.stage_timer.reset()
+        try:
+            previous_handler = signal.signal(
+                STAGE_TIMERS_DUMP_SIGNAL, self._dump_stage_timers)
+        except ValueError:
+            previous_handler = None
+        try:
+            yield
+        finally:
+            if previous_handler is not None:
+                signal.signal(STAGE_TIMERS_DUMP_SIGNAL, previous_handler)
+            self._dump_stage_timers()
+
+    @classmethod
+    def get_lane(cls, start_date: datetime.datetime) -> str:
+        '''
+        Returns the to-fetch lane for params starting from `start_date`
+
+        :params:
+            `start_date`: datetime obj
+        '''
+
+        now = datetime.datetime.now(start_date.tzinfo)
+        age = (now - start_date).total_seconds()
+        if age <= OHLCVS_LIVE_LANE_SECS:
+            return OHLCVS_LANE_LIVE
+        if age <= OHLCVS_RECENT_LANE_SECS:
+            return OHLCVS_LANE_RECENT
+        return OHLCVS_LANE_HISTORY
+
+    def _load_retry_windows(self, params_list: list) -> None:
+        '''
+        Remembers the windows covered by retry params in `params_list`;
+            params that are not retries are ignored
+
+        :params:
+            `params_list`: list of params
+        '''
+
+        windows = self.redis_client.hmget(self.retry_windows_key, params_list)
+        for params, window in zip(params_list, windows):
+            if window:
+                self.retry_windows[params] = json.loads(window)
+
+    def _on_params_done(self, params: str, exc_type: Any) -> None:
+        '''
+        Called by child class after params are processed;
+            If params were a retry, resolves errors of their window
+            when there is no exception
+
+        :params:
+            `params`: params consumed from Redis to-fetch set
+            `exc_type`: exception type (None if there's none)
+        '''
+
+        window = self.retry_windows.pop(params, None)
+        if window is None:
+            return
+        self.redis_client.hdel(self.retry_windows_key, params)
+        if exc_type is None:
+            with self.psql_conn.cursor() as cursor:
+                cursor.execute(
+                    RESOLVE_ERRORS_QUERY,
+                    (
+                        self.exchange_name,
+                        window['symbol'],
+                        str_to_datetime(window['start'], DEFAULT_DATETIME_STR_QUERY),
+                        str_to_datetime(window['end'], DEFAULT_DATETIME_STR_QUERY)
+                    )
+                )
+            self.psql_conn.commit()
+            self.logger.info(f"Retry: Resolved errors of {window['symbol']} from {window['start']} to {window['end']}")
+
+    def _on_symbol_done(self, symbol: str, resp_status_code: int) -> None:
+        '''
+        Called by child class after params are processed;
+            Records the result in the circuit breaker of `symbol`:
+            - a failure on client errors (other than rate limits),
+                e.g., unknown symbols
+            - a success on successful responses, even empty pages
+            - nothing otherwise (e.g., server errors, timeouts)
+            A probe of `symbol` ends with a failure or a success
+
+        :params:
+            `symbol`: string
+            `resp_status_code`: http status (None if there's none)
+        '''
+
+        if resp_status_code is None or resp_status_code >= 500:
+            return
+        failed = 400 <= resp_status_code < 500 \
+            and resp_status_code not in (418, 429)
+        if not failed and resp_status_code >= 400:
+            return
+        self.probing.discard(symbol)
+        if self.circuit_breaker.record(symbol, failed) == CIRCUIT_OPEN:
+            if symbol not in self.open_circuits:
+                self.logger.warning(f"Circuit: Opened circuit of {symbol}")
+            self.open_circuits.add(symbol)
+        else:
+            self.open_circuits.discard(symbol)
+
+    def skip_open_circuits(self, symbols: Iterable[str], probe: bool=True) -> list:
+        '''
+        Returns `symbols` without those whose circuit is open;
+            Half-open ones are kept as probes if this fetcher claims them,
+            and added to `self.probing`: only their first params
+            are fetched until the probe closes their circuit
+
+        :params:
+            `symbols`: iterable of symbol strings
+            `probe`: bool - whether to probe half-open symbols,
+                else they are skipped too
+        '''
+
+        symbols = list(symbols)
+        allowed, half_open = self.circuit_breaker.split_symbols(symbols)
+        if probe:
+            probes = [
+                symbol for symbol in half_open
+                if self.circuit_breaker.claim_probe(symbol)
+            ]
+            if probes:
+                self.logger.info(f"Circuit: Probing {len(probes)} symbols")
+            self.probing.update(probes)
+            allowed.extend(probes)
+        if len(allowed) < len(symbols):
+            self.logger.info(
+                f"Circuit: Skipping {len(symbols) - len(allowed)} symbols with open circuits")
+        return allowed
+
+    def _recover_tofetch_redis(self) -> None:
+        '''
+        Moves params left in the Redis fetching hash (e.g., after a crash)
+            back to their to-fetch lanes
+
+        Params left in the to-fetch and fetching sets used before lanes
+            are moved to the history lane
+        '''
+
+        history_key = self.tofetch_keys[OHLCVS_LANE_HISTORY]
+        legacy_key = OHLCVS_TOFETCH_REDIS_KEY.format(exchange=self.exchange_name)
+        if self.redis_client.exists(legacy_key):
+            self.redis_client.sunionstore(history_key, history_key, legacy_key)
+            self.redis_client.delete(legacy_key)
+        if self.redis_client.type(self.fetching_key) == 'set':
+            self.redis_client.sunionstore(history_key, history_key, self.fetching_key)
+            self.redis_client.delete(self.fetching_key)
+
+        fetching_params = self.redis_client.hgetall(self.fetching_key)
+        if fetching_params:
+            pipe = self.redis_client.pipeline()
+            for params, lane in fetching_params.items():
+                pipe.sadd(self.tofetch_keys.get(lane, history_key), params)
+            pipe.delete(self.fetching_key)
+            pipe.execute()
+
+    def _count_tofetch_redis(self) -> int:
+        '''
+        Returns the number of params in the to-fetch lanes and, if
+            `self.recover`, in the fetching hash; Also sets queue depth metrics
+
+        A fetcher that does not recover params does not wait for params
+            in flight in other fetchers (to follow their successors),
+            so it stops once its lanes are empty
+        '''
+
+        pipe = self.redis_client.pipeline()
+        for key in self.tofetch_keys.values():
+            pipe.scard(key)
+        pipe.hlen(self.fetching_key)
+        counts = pipe.execute()
+        for lane, count in zip(self.tofetch_keys, counts):
+            TOFETCH_PARAMS.labels(self.exchange_name, lane).set(count)
+        FETCHING_PARAMS.labels(self.exchange_name).set(counts[-1])
+        if not self.recover:
+            return sum(counts[:-1])
+        return sum(counts)
+
+    def _pop_tofetch_redis(self) -> dict:
+        '''
+        Pops a batch of at most `self.consume_batch_size` params
+            from the to-fetch lanes, as planned by the lane scheduler
+
+        Returns a dict of params to their lane
+        '''
+
+        lanes = self.lane_scheduler.lanes
+        pipe = self.redis_client.pipeline()
+        for lane in lanes:
+            pipe.scard(self.tofetch_keys[lane])
+        sizes = dict(zip(lanes, pipe.execute()))
+
+        plan = self.lane_scheduler.plan(sizes, self.consume_batch_size)
+        if not plan:
+            return {}
+        for lane, count in plan.items():
+            pipe.spop(self.tofetch_keys[lane], count)
+        batch = {}
+        for lane, params_list in zip(plan, pipe.execute()):
+            for params in params_list or []:
+                batch[params] = lane
+        return batch
+
+    def _checkpoint_params(self, params: str, lane: str, new_params: str) -> None:
+        '''
+        Atomically removes `params` from the Redis fetching hash
+            and adds `new_params` (if not None) to `lane`;
+            Called as soon as `params` are processed (their page is inserted
+            and committed), so that a crash or cancellation redoes
+            at most one page per symbol
+
+        :params:
+            `params`: params consumed from Redis to-fetch lanes
+            `lane`: string - lane of `params`
+            `new_params`: successor params (None if there's none)
         '''
-        Signature for _consume_ohlcvs_redis in child class
+
+        with self.redis_client.pipeline() as pipe:
+            if new_params is not None:
+                pipe.sadd(self.tofetch_keys[lane], new_params)
+            pipe.hdel(self.fetching_key, params)
+            pipe.execute()
+
+    def _requeue_params(self, params: str, lane: str) -> None:
         '''
+        Atomically moves `params` from the Redis fetching hash
+            back to `lane`, e.g., when their fetch is cancelled
+
+        :params:
+            `params`: params consumed from Redis to-fetch lanes
+            `lane`: string - lane of `params`
+        '''
+
+        with self.redis_client.pipeline() as pipe:
+            pipe.sadd(self.tofetch_keys[lane], params)
+            pipe.hdel(self.fetching_key, params)
+            pipe.execute()
+
+    async def _get_parse_and_checkpoint(
+            self, params: str, lane: str, update: bool=False
+        ) -> None:
+        '''
+        Gets and parses OHLCVs of `params`, then checkpoints them in Redis;
+            If cancelled before their page is inserted, requeues them
+
+        :params:
+            `params`: params consumed from Redis to-fetch lanes
+            `lane`: string - lane of `params`
+            `update`: bool - whether to update on conflict
+        '''
+
+        try:
+            new_params = await self._get_and_parse_ohlcv(params, update)
+        except asyncio.CancelledError:
+            self._requeue_params(params, lane)
+            # Cancelled by `_drain`, the batch goes on with in-flight pages
+            if self.draining:
+                return
+            raise
+        # Stop following symbols whose circuit opened,
+        #   or whose probe has no result yet
+        if new_params is not None:
+            symbol = new_params.split(REDIS_DELIMITER)[0]
+            if symbol in self.open_circuits or symbol in self.probing:
+                new_params = None
+        self._checkpoint_params(params, lane, new_params)
+
+    async def _consume_ohlcvs_redis(self, update: bool=False) -> None:
+        '''
+        Consumes OHLCV parameters from the Redis to-fetch lanes
+        '''
+
+        # When start, move all [existing] params from fetching hash to to-fetch lanes
+        #   (if `self.recover`)
+        # Keep looping and processing in batch, unless draining, if either:
+        #   - self.feeding or
+        #   - there are elements in to-fetch lanes or fetching hash
+        if self.recover:
+            self._recover_tofetch_redis()
+
+        # Pop a batch of size `consume_batch_size` from Redis to-fetch lanes;
+        #   The live lane fills the batch first, so freshness updates
+        #   always preempt backfills; The other lanes share the room left
+        # Add params in the batch to Redis fetching hash, with their lanes
+        # Each params is checkpointed as soon as it is processed:
+        #   in one transaction, it is removed from Redis fetching hash
+        #   and its new to-fetch params with new start date (if not None)
+        #   are added to its lane
+        # Params of a batch interrupted by a crash or cancellation stay in
+        #   Redis fetching hash and are recovered on the next run
+        async with httpx.AsyncClient(
+            timeout=self.httpx_timout, limits=self.httpx_limits) as client:
+            self.async_httpx_client = client
+            while not self.draining \
+                and (self.feeding or self._count_tofetch_redis() > 0):
+                batch = self._pop_tofetch_redis()
+                if batch:
+                    params_list = list(batch)
+                    self.redis_client.hset(self.fetching_key, mapping=batch)
+                    retry_params = [
+                        params for params in params_list
+                        if batch[params] == OHLCVS_LANE_RETRY
+                    ]
+                    if retry_params:
+                        self._load_retry_windows(retry_params)
+                    get_parse_tasks = [
+                        self._get_parse_and_checkpoint(params, lane, update)
+                        for params, lane in batch.items()
+                    ]
+                    await asyncio.gather(*get_parse_tasks)
+                else:
+                    # Release event loop while params are being fed
+                    await asyncio.sleep(1)
+
+        # When drained, in-flight pages are inserted and checkpointed,
+        #   the other params are back in their lanes;
+        #   Flush pending PSQL writes (e.g., resolved retry errors)
+        if self.draining:
+            self.psql_conn.commit()
+            self.logger.info("Drain: Drained, params left are kept in to-fetch lanes")
 
     async def _resume_fetch(self, update: bool=False) -> None:
         '''
@@ -98,7 +778,12 @@ class BaseOHLCVFetcher:
         Interface to close all connections (e.g., PSQL)
         '''
 
-        self.psql_conn.close()
+        if self.owns_psql_conn:
+            self.psql_conn.close()
+        else:
+            self.psql_cur.close()
+        if self.sink is not None:
+            self.sink.close()
 
     def fetch_symbol_data(self) -> None:
         '''
@@ -157,7 +842,8 @@ class BaseOHLCVFetcher:
         symbols: list,
         start_date_dt: datetime.datetime,
         end_date_dt: datetime.datetime,
-        update: bool=False
+        update: bool=False,
+        lane: str=None
     ) -> None:
         '''
         Interface to run fetching OHLCVS for some specified symbols
@@ -168,14 +854,19 @@ class BaseOHLCVFetcher:
             `end_date_dt`: datetime obj - for end date
             `update`: bool - whether to update when inserting
                 to PSQL database
+            `lane`: string - to-fetch lane to feed params to;
+                chosen from `start_date_dt` if not provided
         '''
 
+        self.feeding_lane = lane or self.get_lane(start_date_dt)
+        start_metrics_server(f'{self.exchange_name}_rest')
         loop = self._setup_event_loop()
         try:
             self.logger.info("Run_fetch_ohlcvs: Fetching OHLCVS for indicated symbols")
-            loop.run_until_complete(
-                self._fetch_ohlcvs_symbols(symbols, start_date_dt, end_date_dt, update)
-            )
+            with self._stage_timers_dumped():
+                loop.run_until_complete(
+                    self._fetch_ohlcvs_symbols(symbols, start_date_dt, end_date_dt, update)
+                )
         finally:
             self.logger.info(
                 "Run_fetch_ohlcvs: Finished fetching OHLCVS for indicated symbols")
@@ -185,7 +876,8 @@ class BaseOHLCVFetcher:
         self,
         start_date_dt: datetime.datetime,
         end_date_dt: datetime.datetime,
-        update: bool=False
+        update: bool=False,
+        lane: str=None
     ) -> None:
         '''
         Interface to run the fetching OHLCVS for all symbols
@@ -194,21 +886,23 @@ class BaseOHLCVFetcher:
             `symbols`: list of symbol string
             `start_date_dt`: datetime obj - for start date
             `end_date_dt`: datetime obj - for end date
+            `lane`: string - to-fetch lane (see `run_fetch_ohlcvs`)
         '''
 
         # Have to fetch symbol data first to
         # make sure it's up-to-date
         self.fetch_symbol_data()
-        symbols = self.symbol_data.keys()
+        symbols = self.skip_open_circuits(self.symbol_data.keys())
 
-        self.run_fetch_ohlcvs(symbols, start_date_dt, end_date_dt, update)
+        self.run_fetch_ohlcvs(symbols, start_date_dt, end_date_dt, update, lane)
         self.logger.info("Run_fetch_ohlcvs_all: Finished fetching OHLCVS for all symbols")
 
     def run_fetch_ohlcvs_mutual_basequote(
         self,
         start_date_dt: datetime.datetime,
         end_date_dt: datetime.datetime,
-        update: bool=False
+        update: bool=False,
+        lane: str=None
     ) -> None:
         '''
         Interface to run the fetching of the mutual base-quote symbols
@@ -216,13 +910,15 @@ class BaseOHLCVFetcher:
         :params:
             `start_date_dt`: datetime obj
             `end_date_dt`: datetime obj
+            `lane`: string - to-fetch lane (see `run_fetch_ohlcvs`)
         '''
         # Have to fetch symbol data first to
         # make sure it's up-to-date
         self.fetch_symbol_data()
 
         symbols = self.get_symbols_from_exch(MUTUAL_BASE_QUOTE_QUERY)
-        self.run_fetch_ohlcvs(symbols.keys(), start_date_dt, end_date_dt, update)
+        symbols = self.skip_open_circuits(symbols.keys())
+        self.run_fetch_ohlcvs(symbols, start_date_dt, end_date_dt, update, lane)
         self.logger.info(
             "Run_fetch_ohlcvs_mutual_basequote: Finished fetching OHLCVS for mutual symbols"
         )
@@ -232,10 +928,12 @@ class BaseOHLCVFetcher:
         Interface to run the resuming of fetching tasks
         '''
 
+        start_metrics_server(f'{self.exchange_name}_rest')
         loop = self._setup_event_loop()
         try:
             self.logger.info("Run_resume_fetch: Resuming fetching tasks from Redis sets")
-            loop.run_until_complete(self._resume_fetch())
+            with self._stage_timers_dumped():
+                loop.run_until_complete(self._resume_fetch())
         finally:
             self.logger.info("Run_resume_fetch: Finished fetching OHLCVS")
             loop.close()
@@ -5,31 +5,33 @@ import datetime
 import logging
 import random
 import time
-from typing import Iterable, Tuple, Union
+from contextlib import asynccontextmanager
+from typing import Any, Iterable, Tuple, Union
 
 import httpx
 import redis
 from redis.exceptions import LockError
 
 from common.config.constants import \
-    OHLCVS_ERRORS_TABLE, OHLCVS_TABLE, \
+    OHLCVS_ERRORS_TABLE, \
     REDIS_DELIMITER, REDIS_HOST, \
     REDIS_PASSWORD, REDIS_USER
 from common.helpers.datetimehelpers import \
     datetime_to_milliseconds, \
-    milliseconds_to_datetime, redis_time
+    milliseconds_to_datetime
 from common.helpers.numbers import round_decimal
 from fetchers.config.constants import \
-    HTTPX_DEFAULT_RETRIES, OHLCV_UNIQUE_COLUMNS, \
-    OHLCV_UPDATE_COLUMNS, REST_RATE_LIMIT_REDIS_KEY, \
-    THROTTLER_RATE_LIMITS
-from fetchers.config.queries import \
-    PSQL_INSERT_IGNOREDUP_QUERY, PSQL_INSERT_UPDATE_QUERY
+    HTTPX_DEFAULT_RETRIES, REST_BACKOFF_CHANNEL, \
+    REST_BACKOFF_REDIS_KEY, REST_PAGE_CACHE_IMMUTABLE_SECS, \
+    REST_RATE_LIMIT_REDIS_KEY, THROTTLER_RATE_LIMITS
+from fetchers.config.queries import PSQL_INSERT_IGNOREDUP_QUERY
 from fetchers.helpers.dbhelpers import psql_bulk_insert
 from fetchers.rest.base import BaseOHLCVFetcher
+from fetchers.utils.clock import get_redis_clock
 from fetchers.utils.exceptions import \
     MaximumRetriesReached, UnsuccessfulDatabaseInsert
-from fetchers.utils.ratelimit import GCRARateLimiter
+from fetchers.utils.metrics import REST_REQUESTS
+from fetchers.utils.ratelimit import GCRARateLimiter, SharedBackoff
 
 URL = "https://api.binance.com/api/v3/klines?symbol=BTCTUSD&interval=1m&startTime=1357020000000&limit=1000"
 
@@ -43,12 +45,7 @@ OHLCV_LIMIT = 1000
 DEFAULT_WEIGHT_LIMIT = 1200
 RATE_LIMIT_HITS_PER_MIN = THROTTLER_RATE_LIMITS['RATE_LIMIT_HITS_PER_MIN'][EXCHANGE_NAME]
 RATE_LIMIT_SECS_PER_MIN = THROTTLER_RATE_LIMITS['RATE_LIMIT_SECS_PER_MIN']
-BACKOFF_STT_REDIS = "backoff_stt_binance" # Common Backoff status
-BACKOFF_URL_REDIS = "backoff_url_binance" # Common Backoff url
-BACKOFF_TIME_REDIS = "backoff_time_binance" # Common Backoff time
-BACKOFF_DUR_REDIS = "backoff_dur_binance" # Common Backoff duration
 
-OHLCVS_CONSUME_BATCH_SIZE = 500
 # At httpx concurrent limit of 200, lag bug seems to be gone
 
 LOCK_TIMEOUT_SECS = 5
@@ -80,6 +77,7 @@ class RequestWeightManager:
                 decode_responses=True
             )
         self.redis_client = redis_client
+        self.clock = get_redis_clock(redis_client)
     
     def _is_enough(self, weight: int) -> tuple:
         '''
@@ -88,7 +86,7 @@ class RequestWeightManager:
         '''
         
         # logging.info(f"Current request weight is {self.redis_client.get(self.key_rw)}")
-        now = redis_time(self.redis_client)
+        now = self.clock.now()
 
         try:
             with self.redis_client.lock(
@@ -158,8 +156,8 @@ class RequestWeightManager:
 class BinanceOHLCVFetcher(BaseOHLCVFetcher):
     '''REST Fetcher for OHLCV from Binance
     '''
-    def __init__(self, *args):
-        super().__init__(*args, exchange_name = EXCHANGE_NAME)
+    def __init__(self, **kwargs):
+        super().__init__(exchange_name = EXCHANGE_NAME, **kwargs)
 
         # Request weight manager
         self.rw_manager = RequestWeightManager(
@@ -176,6 +174,13 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
             redis_client = self.redis_client
         )
 
+        # Common backoff (e.g., after 429/418) shared by all fetchers
+        self.backoff = SharedBackoff(
+            REST_BACKOFF_REDIS_KEY.format(exchange = EXCHANGE_NAME),
+            REST_BACKOFF_CHANNEL.format(exchange = EXCHANGE_NAME),
+            redis_client = self.redis_client
+        )
+
         # Load market data
         self._load_symbol_data()
 
@@ -269,6 +274,31 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
 
         return f'{symbol}{REDIS_DELIMITER}{start_date_mls}{REDIS_DELIMITER}{end_date_mls}{REDIS_DELIMITER}{interval}{REDIS_DELIMITER}{limit}'
 
+    @classmethod
+    def make_window_params(
+            cls,
+            symbol: str,
+            start_date: datetime.datetime,
+            end_date: datetime.datetime
+        ) -> str:
+        '''
+        Makes tofetch params that cover a time window
+            with the default interval and limit
+
+        :params:
+            `symbol`: string - symbol
+            `start_date`: datetime obj
+            `end_date`: datetime obj
+        '''
+
+        return cls.make_tofetch_params(
+            symbol,
+            datetime_to_milliseconds(start_date),
+            datetime_to_milliseconds(end_date),
+            OHLCV_TIMEFRAME,
+            OHLCV_LIMIT
+        )
+
     @classmethod
     def parse_ohlcvs(
             cls,
@@ -318,6 +348,7 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
         ) -> tuple:
         '''
         Returns a list that contains: a tuple to insert into the ohlcvs error table
+            (with retry columns set to their defaults)
         
         :params:
             `symbol`: string
@@ -340,20 +371,61 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
         return (
             (EXCHANGE_NAME, symbol, start_date, end_date,
             interval, ohlcv_section, resp_status_code,
-            str(exception_class),exception_msg),
+            str(exception_class),exception_msg,
+            0, None, False),
         )
 
+    def close_connections(self) -> None:
+        '''
+        Interface to close all connections (e.g., PSQL, backoff pub/sub)
+        '''
+
+        self.backoff.close()
+        super().close_connections()
+
     def _reset_backoff(self):
         '''
-        Resets Redis backoff attributes
+        Resets common backoff, if any
         '''
 
-        self.redis_client.delete(
-            BACKOFF_STT_REDIS,
-            BACKOFF_URL_REDIS,
-            BACKOFF_TIME_REDIS,
-            BACKOFF_DUR_REDIS
-        )
+        self.backoff.reset()
+
+    @asynccontextmanager
+    async def _rate_limited(self):
+        '''
+        Waits for request weight and the rate limiter before its block,
+            timing both as the `wait` stage
+        '''
+
+        with self.stage_timer.time('wait'), self._drainable():
+            await self.rw_manager.acheck(1)
+            await self.rate_limiter.wait()
+        yield
+
+    def _is_immutable_page(self, url: str, data: Any = None) -> bool:
+        '''
+        Returns whether the klines page of `url` never changes,
+            i.e., it is of 1-minute klines and its last kline opened
+            more than `REST_PAGE_CACHE_IMMUTABLE_SECS` ago
+
+        A page runs `limit` klines from the first one at or after
+            `startTime`, so it may end long after `startTime + limit`
+            minutes (e.g., before a listing); Before the page is requested
+            (`data` is None), only pages starting before that are looked up
+
+        :params:
+            `url`: string
+            `data`: list of klines of the page (optional)
+        '''
+
+        params = httpx.URL(url).params
+        if params.get('interval') != OHLCV_TIMEFRAME:
+            return False
+        immutable_before_mls = datetime_to_milliseconds(datetime.datetime.now()) \
+            - REST_PAGE_CACHE_IMMUTABLE_SECS * 1000
+        if data is None:
+            return int(params['startTime']) < immutable_before_mls
+        return bool(data) and int(data[-1][0]) < immutable_before_mls
 
     async def _get_ohlcv_data(self, ohlcv_url: str) -> tuple:
         '''
@@ -371,21 +443,23 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
             `throttler`: asyncio throttler obj
         '''
         
+        # Immutable pages may be in the page cache
+        cached_data = self._get_cached_page(ohlcv_url)
+        if cached_data is not None:
+            return (200, cached_data, None, None)
+
         retries = 0
         while retries < HTTPX_DEFAULT_RETRIES:
-            await self.rw_manager.acheck(1)
-            backoff_stt = self.redis_client.get(BACKOFF_STT_REDIS)
-            backoff_url = self.redis_client.get(BACKOFF_URL_REDIS)
-            backoff_duration = self.redis_client.get(BACKOFF_DUR_REDIS)
-            backoff_time = self.redis_client.get(BACKOFF_TIME_REDIS)
-            if (backoff_stt != "429" and backoff_stt != "418") \
-                or ohlcv_url == backoff_url:
-                async with self.rate_limiter:
+            if not self.backoff.is_blocking(ohlcv_url):
+                async with self._rate_limited():
                     try:
-                        ohlcvs_resp = await self.async_httpx_client.get(ohlcv_url)
+                        ohlcvs_resp = await self._timed_get(ohlcv_url)
+                        REST_REQUESTS.labels(EXCHANGE_NAME, ohlcvs_resp.status_code).inc()
                         ohlcvs_resp.raise_for_status()
                         self._reset_backoff()
-                        ohlcv_data = ohlcvs_resp.json()
+                        with self.stage_timer.time('decode'):
+                            ohlcv_data = ohlcvs_resp.json()
+                        self._cache_page(ohlcv_url, ohlcvs_resp, ohlcv_data)
                         return (
                             ohlcvs_resp.status_code,
                             ohlcv_data,
@@ -397,12 +471,7 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
                         if resp_status_code == 429 or resp_status_code == 418:
                             retry_after = exc.response.headers['Retry-After']
 
-                            self.redis_client.set(BACKOFF_STT_REDIS, resp_status_code)
-                            self.redis_client.set(BACKOFF_URL_REDIS, ohlcv_url)
-                            self.redis_client.set(BACKOFF_DUR_REDIS, retry_after)
-                            self.redis_client.set(
-                                BACKOFF_TIME_REDIS, redis_time(self.redis_client)
-                            )
+                            self.backoff.set(resp_status_code, ohlcv_url, retry_after)
 
                             self.logger.info(f"get_ohlcv_data: Backing off...")
                             await asyncio.sleep(float(retry_after))
@@ -415,8 +484,10 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
                                 f'EXCEPTION: Response status code: {resp_status_code} while requesting {exc.request.url}'
                             )
                     except httpx.TimeoutException as exc:
+                        REST_REQUESTS.labels(EXCHANGE_NAME, 'timeout').inc()
                         await asyncio.sleep(1) # for now just 1 sec
                     except Exception as exc:
+                        REST_REQUESTS.labels(EXCHANGE_NAME, 'error').inc()
                         self._reset_backoff()
                         return (
                             None,
@@ -426,12 +497,15 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
                         )
             else:
                 self.logger.info("get_ohlcv_data: Backing off...")
-                if backoff_duration and backoff_time:
-                    await asyncio.sleep(
-                        min(float(backoff_duration) - (redis_time(self.redis_client) - float(backoff_time)) + 10 * random.random(), RATE_LIMIT_SECS_PER_MIN)
-                    )
+                backoff_remaining = self.backoff.remaining()
+                if backoff_remaining is not None:
+                    with self._drainable():
+                        await asyncio.sleep(
+                            min(backoff_remaining + 10 * random.random(), RATE_LIMIT_SECS_PER_MIN)
+                        )
                 else:
-                    await asyncio.sleep(RATE_LIMIT_SECS_PER_MIN)
+                    with self._drainable():
+                        await asyncio.sleep(RATE_LIMIT_SECS_PER_MIN)
             retries += 1
         self._reset_backoff()
         return (
@@ -504,25 +578,10 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
                 # Copy to PSQL if parsed successfully
                 # Get the latest date in OHLCVS list,
                 #   if latest date > start_date, update start_date
-                ohlcvs_parsed = self.parse_ohlcvs(ohlcvs, base_id, quote_id)
+                with self.stage_timer.time('parse'):
+                    ohlcvs_parsed = self.parse_ohlcvs(ohlcvs, base_id, quote_id)
                 if ohlcvs_parsed:
-                    insert_success = False
-                    if update:
-                        insert_success = psql_bulk_insert(
-                            self.psql_conn,
-                            ohlcvs_parsed,
-                            OHLCVS_TABLE,
-                            insert_update_query = PSQL_INSERT_UPDATE_QUERY,
-                            unique_cols = OHLCV_UNIQUE_COLUMNS,
-                            update_cols = OHLCV_UPDATE_COLUMNS
-                        )
-                    else:
-                        insert_success = psql_bulk_insert(
-                            self.psql_conn,
-                            ohlcvs_parsed,
-                            OHLCVS_TABLE,
-                            insert_ignoredup_query = PSQL_INSERT_IGNOREDUP_QUERY
-                        )
+                    insert_success = await self._insert_ohlcvs(ohlcvs_parsed, update)
                     
                     ohlcvs_last_date = datetime_to_milliseconds(ohlcvs_parsed[-1][0])
                     if ohlcvs_last_date > start_date_mls:
@@ -580,7 +639,10 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
             start_date_mls += (60000 * OHLCV_LIMIT)
         
         # PSQL Commit
-        self.psql_conn.commit()
+        with self.stage_timer.time('commit'):
+            self.psql_conn.commit()
+        self._on_params_done(params, exc_type)
+        self._on_symbol_done(symbol, resp_status_code)
         
         # what the heck? why need this condition check?
         # else:
@@ -613,7 +675,7 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
             `limit`: int
         
         Feeds the following information:
-            - key: `self.tofetch_key`
+            - key: to-fetch lane set of `self.feeding_lane`
             - value: `symbol;;start_date_mls;;end_date_mls;;time_frame;;limit;;sort`
         
         example:
@@ -636,60 +698,11 @@ class BinanceOHLCVFetcher(BaseOHLCVFetcher):
                 symbol, start_date_mls, end_date_mls, interval, limit
             ) for symbol in symbols
         ]
-        self.redis_client.sadd(self.tofetch_key, *params_list)
+        self.redis_client.sadd(
+            self.tofetch_keys[self.feeding_lane], *params_list)
         self.feeding = False
         self.logger.info("Redis: Successfully initialized feeding params")
 
-    async def _consume_ohlcvs_redis(self, update: bool=False) -> None:
-        '''
-        Consumes OHLCV parameters from the Redis to-fetch set
-        '''
-
-        # When start, move all [existing] params from fetching set to to-fetch set
-        # Keep looping and processing in batch if either:
-        # - self.feeding or
-        # - there are elements in to-fetch set or fetching set
-        fetching_params = self.redis_client.spop(
-            self.fetching_key,
-            self.redis_client.scard(self.fetching_key)
-        )
-        if fetching_params:
-            self.redis_client.sadd(
-                self.tofetch_key, *fetching_params
-            )
-        async with httpx.AsyncClient(
-            timeout=self.httpx_timout, limits=self.httpx_limits) as client:
-            self.async_httpx_client = client
-            while self.feeding or \
-                self.redis_client.scard(self.tofetch_key) > 0 \
-                or self.redis_client.scard(self.fetching_key) > 0:
-                # Pop a batch of size `rate_limit` from Redis to-fetch set,
-                #   send it to Redis fetching set
-                # Add params in params list to Redis fetching set
-                # New to-fetch params with new start dates will be results
-                #   of `get_parse_tasks`
-                #   Add these params to Redis to-fetch set, if not None
-                # Finally, remove params list from Redis fetching set
-                params_list = self.redis_client.spop(
-                    self.tofetch_key, OHLCVS_CONSUME_BATCH_SIZE
-                )
-                if params_list:
-                    self.redis_client.sadd(self.fetching_key, *params_list)
-                    get_parse_tasks = [
-                        self._get_and_parse_ohlcv(params, update) for params in params_list
-                    ]
-                    task_results = await asyncio.gather(*get_parse_tasks)
-                    new_tofetch_params = [
-                        params for params in task_results if params is not None
-                    ]
-                    if new_tofetch_params:
-                        self.logger.info(
-                            "Redis: Adding more params to to-fetch with new start dates")
-                        self.redis_client.sadd(
-                            self.tofetch_key, *new_tofetch_params)
-                       
-                    self.redis_client.srem(self.fetching_key, *params_list)
-    
     async def _fetch_ohlcvs_symbols(
             self,
             symbols: list,
@@ -8,22 +8,21 @@ import backoff
 import httpx
 
 from common.config.constants import \
-    OHLCVS_ERRORS_TABLE, OHLCVS_TABLE, \
+    OHLCVS_ERRORS_TABLE, \
     REDIS_DELIMITER
 from common.helpers.datetimehelpers import \
     datetime_to_milliseconds, milliseconds_to_datetime
 from common.helpers.numbers import round_decimal
 from fetchers.config.constants import \
-    HTTPX_DEFAULT_RETRIES, OHLCV_UNIQUE_COLUMNS, \
-    OHLCV_UPDATE_COLUMNS, REST_RATE_LIMIT_REDIS_KEY, \
-    THROTTLER_RATE_LIMITS
-from fetchers.config.queries import \
-    PSQL_INSERT_IGNOREDUP_QUERY, PSQL_INSERT_UPDATE_QUERY
+    HTTPX_DEFAULT_RETRIES, REST_PAGE_CACHE_IMMUTABLE_SECS, \
+    REST_RATE_LIMIT_REDIS_KEY, THROTTLER_RATE_LIMITS
+from fetchers.config.queries import PSQL_INSERT_IGNOREDUP_QUERY
 from fetchers.helpers.dbhelpers import psql_bulk_insert
 from fetchers.rest.base import BaseOHLCVFetcher
 from fetchers.utils.asyncioutils import onbackoff, onsuccessgiveup
 from fetchers.utils.exceptions import \
     MaximumRetriesReached, UnsuccessfulDatabaseInsert
+from fetchers.utils.metrics import REST_REQUESTS
 from fetchers.utils.ratelimit import GCRARateLimiter
 
 EXCHANGE_NAME = "bitfinex"
@@ -36,13 +35,12 @@ OHLCV_SECTION_LAST = "last"
 OHLCV_LIMIT = 9500
 RATE_LIMIT_HITS_PER_MIN = THROTTLER_RATE_LIMITS['RATE_LIMIT_HITS_PER_MIN'][EXCHANGE_NAME]
 RATE_LIMIT_SECS_PER_MIN = THROTTLER_RATE_LIMITS['RATE_LIMIT_SECS_PER_MIN']
-OHLCVS_CONSUME_BATCH_SIZE = 500
 
 class BitfinexOHLCVFetcher(BaseOHLCVFetcher):
     '''REST Fetcher for OHLCV from Bitfinex
     '''
-    def __init__(self, *args):
-        super().__init__(*args, exchange_name = EXCHANGE_NAME)
+    def __init__(self, **kwargs):
+        super().__init__(exchange_name = EXCHANGE_NAME, **kwargs)
 
         # Rate limiter
         self.rate_limiter = GCRARateLimiter(
@@ -192,6 +190,27 @@ class BitfinexOHLCVFetcher(BaseOHLCVFetcher):
         
         return f'{symbol}{REDIS_DELIMITER}{start_date}{REDIS_DELIMITER}{end_date}{REDIS_DELIMITER}{time_frame}{REDIS_DELIMITER}{limit}{REDIS_DELIMITER}{sort}'
 
+    @classmethod
+    def make_window_params(
+            cls,
+            symbol: str,
+            start_date: datetime.datetime,
+            end_date: datetime.datetime
+        ) -> str:
+        '''
+        Makes tofetch params that cover a time window
+            with the default time frame, limit and sort
+
+        :params:
+            `symbol`: symbol string
+            `start_date`: datetime obj
+            `end_date`: datetime obj
+        '''
+
+        return cls.make_tofetch_params(
+            symbol, start_date, end_date, OHLCV_TIMEFRAME, OHLCV_LIMIT, 1
+        )
+
     @classmethod
     def parse_ohlcvs(
             cls,
@@ -260,6 +279,7 @@ class BitfinexOHLCVFetcher(BaseOHLCVFetcher):
         ) -> tuple:
         '''
         Returns a list that contains: a tuple to insert into the ohlcvs error table
+            (with retry columns set to their defaults)
         
         :params:
             `symbol`: string
@@ -282,9 +302,29 @@ class BitfinexOHLCVFetcher(BaseOHLCVFetcher):
         return (
             (EXCHANGE_NAME, symbol, start_date, end_date,
             time_frame, ohlcv_section, resp_status_code,
-            str(exception_class),exception_msg),
+            str(exception_class),exception_msg,
+            0, None, False),
         )
 
+    def _is_immutable_page(self, url: str, data: Any = None) -> bool:
+        '''
+        Returns whether the candles page of `url` never changes,
+            i.e., it is historical and its `end` is more than
+            `REST_PAGE_CACHE_IMMUTABLE_SECS` ago; Candles never
+            go past `end`, so `data` is not needed
+
+        :params:
+            `url`: string
+            `data`: list of candles of the page (optional)
+        '''
+
+        url = httpx.URL(url)
+        if not url.path.endswith(f'/{OHLCV_SECTION_HIST}') or 'end' not in url.params:
+            return False
+        return int(url.params['end']) < \
+            datetime_to_milliseconds(datetime.datetime.now()) \
+            - REST_PAGE_CACHE_IMMUTABLE_SECS * 1000
+
     @backoff.on_predicate(
         backoff.constant,
         lambda result: result[0] == 429,
@@ -316,13 +356,21 @@ class BitfinexOHLCVFetcher(BaseOHLCVFetcher):
             `exchange_name`: string - this exchange's name
         '''
         
+        # Immutable pages may be in the page cache
+        cached_data = self._get_cached_page(ohlcv_url)
+        if cached_data is not None:
+            return (200, cached_data, None, None)
+
         retries = 0
         while retries < HTTPX_DEFAULT_RETRIES:
-            async with self.rate_limiter:
+            async with self._rate_limited():
                 try:
-                    ohlcvs_resp = await self.async_httpx_client.get(ohlcv_url)
+                    ohlcvs_resp = await self._timed_get(ohlcv_url)
+                    REST_REQUESTS.labels(EXCHANGE_NAME, ohlcvs_resp.status_code).inc()
                     ohlcvs_resp.raise_for_status()
-                    ohlcv_data = ohlcvs_resp.json()
+                    with self.stage_timer.time('decode'):
+                        ohlcv_data = ohlcvs_resp.json()
+                    self._cache_page(ohlcv_url, ohlcvs_resp, ohlcv_data)
                     return (
                         ohlcvs_resp.status_code,
                         ohlcv_data,
@@ -338,8 +386,10 @@ class BitfinexOHLCVFetcher(BaseOHLCVFetcher):
                         f'EXCEPTION: Response status code: {resp_status_code} while requesting {exc.request.url}'
                     )
                 except httpx.TimeoutException as exc:
+                    REST_REQUESTS.labels(EXCHANGE_NAME, 'timeout').inc()
                     await asyncio.sleep(1) # for now just 1 sec
                 except Exception as exc:
+                    REST_REQUESTS.labels(EXCHANGE_NAME, 'error').inc()
                     return (
                         None,
                         None,
@@ -405,26 +455,11 @@ class BitfinexOHLCVFetcher(BaseOHLCVFetcher):
         #   - empty ohlcvs from API
         if exc_type is None:
             try:
-                ohlcvs_parsed = self.parse_ohlcvs(
-                    ohlcvs, base_id, quote_id, ohlcv_section)
+                with self.stage_timer.time('parse'):
+                    ohlcvs_parsed = self.parse_ohlcvs(
+                        ohlcvs, base_id, quote_id, ohlcv_section)
                 if ohlcvs_parsed:
-                    insert_success = False
-                    if update:
-                        insert_success = psql_bulk_insert(
-                            self.psql_conn,
-                            ohlcvs_parsed,
-                            OHLCVS_TABLE,
-                            insert_update_query = PSQL_INSERT_UPDATE_QUERY,
-                            unique_cols = OHLCV_UNIQUE_COLUMNS,
-                            update_cols = OHLCV_UPDATE_COLUMNS
-                        )
-                    else:
-                        insert_success = psql_bulk_insert(
-                            self.psql_conn,
-                            ohlcvs_parsed,
-                            OHLCVS_TABLE,
-                            insert_ignoredup_query = PSQL_INSERT_IGNOREDUP_QUERY
-                        )
+                    insert_success = await self._insert_ohlcvs(ohlcvs_parsed, update)
                     
                     ohlcvs_last_date = datetime_to_milliseconds(ohlcvs_parsed[-1][0])
                     if ohlcvs_last_date > start_date_mls:
@@ -479,7 +514,10 @@ class BitfinexOHLCVFetcher(BaseOHLCVFetcher):
             start_date_mls += (60000 * OHLCV_LIMIT)
         
         # PSQL Commit
-        self.psql_conn.commit()
+        with self.stage_timer.time('commit'):
+            self.psql_conn.commit()
+        self._on_params_done(params, exc_type)
+        self._on_symbol_done(symbol, resp_status_code)
 
         # Also make more params for to-fetch set
         if start_date_mls < end_date_mls:
@@ -510,7 +548,7 @@ class BitfinexOHLCVFetcher(BaseOHLCVFetcher):
             `sort`: int (1 or -1)
         
         Feeds the following information:
-            - key: `self.tofetch_key`
+            - key: to-fetch lane set of `self.feeding_lane`
             - value: `symbol;;start_date_mls;;end_date_mls;;time_frame;;limit;;sort`
         
         example:
@@ -533,61 +571,11 @@ class BitfinexOHLCVFetcher(BaseOHLCVFetcher):
                 symbol, start_date_mls, end_date_mls, time_frame, limit, sort
             ) for symbol in symbols
         ]
-        self.redis_client.sadd(self.tofetch_key, *params_list)
+        self.redis_client.sadd(
+            self.tofetch_keys[self.feeding_lane], *params_list)
         self.feeding = False
         self.logger.info("Redis: Successfully initialized feeding params")
 
-    async def _consume_ohlcvs_redis(self, update: bool=False) -> None:
-        '''
-        Consumes OHLCV parameters from Redis to-fetch set
-        '''
-
-        # When start, move all [existing] params from fetching set to to-fetch set
-        # Keep looping and processing in batch if either:
-        #   - self.feeding or
-        #   - there are elements in to-fetch set or fetching set
-        fetching_params = self.redis_client.spop(
-            self.fetching_key,
-            self.redis_client.scard(self.fetching_key)
-        )
-        if fetching_params:
-            self.redis_client.sadd(
-                self.tofetch_key, *fetching_params
-            )
-        
-        # Pop a batch of size `rate_limit` from Redis to-fetch set,
-        #   send it to Redis fetching set
-        # Add params in params list to Redis fetching set
-        # New to-fetch params with new start dates will be results
-        #   of `get_parse_tasks`
-        #   Add these params to Redis to-fetch set, if not None
-        # Finally, remove params list from Redis fetching set
-        async with httpx.AsyncClient(
-            timeout=self.httpx_timout, limits=self.httpx_limits) as client:
-            self.async_httpx_client = client
-            while self.feeding or \
-                self.redis_client.scard(self.tofetch_key) > 0 \
-                or self.redis_client.scard(self.fetching_key) > 0:
-                params_list = self.redis_client.spop(
-                    self.tofetch_key, OHLCVS_CONSUME_BATCH_SIZE
-                )
-                if params_list:
-                    self.redis_client.sadd(self.fetching_key, *params_list)
-                    get_parse_tasks = [
-                        self._get_and_parse_ohlcv(params, update) for params in params_list
-                    ]
-                    task_results = await asyncio.gather(*get_parse_tasks)
-                    new_tofetch_params = [
-                        params for params in task_results if params is not None
-                    ]
-                    if new_tofetch_params:
-                        self.logger.info(
-                            "Redis: Adding more params to to-fetch with new start dates")
-                        self.redis_client.sadd(
-                            self.tofetch_key, *new_tofetch_params)
-
-                    self.redis_client.srem(self.fetching_key, *params_list)
-    
     async def _fetch_ohlcvs_symbols(
             self,
             symbols: list,
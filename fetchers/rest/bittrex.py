@@ -9,22 +9,21 @@ import httpx
 
 from common.config.constants import \
     DEFAULT_DATETIME_STR_QUERY, \
-    OHLCVS_ERRORS_TABLE, OHLCVS_TABLE, \
+    OHLCVS_ERRORS_TABLE, \
     REDIS_DELIMITER
 from common.helpers.datetimehelpers import \
     datetime_to_str, list_days_fromto, str_to_datetime
 from common.helpers.numbers import round_decimal
 from fetchers.config.constants import \
-    HTTPX_DEFAULT_RETRIES, OHLCV_UNIQUE_COLUMNS, \
-    OHLCV_UPDATE_COLUMNS, REST_RATE_LIMIT_REDIS_KEY, \
-    THROTTLER_RATE_LIMITS
-from fetchers.config.queries import \
-    PSQL_INSERT_IGNOREDUP_QUERY, PSQL_INSERT_UPDATE_QUERY
+    HTTPX_DEFAULT_RETRIES, REST_PAGE_CACHE_IMMUTABLE_SECS, \
+    REST_RATE_LIMIT_REDIS_KEY, THROTTLER_RATE_LIMITS
+from fetchers.config.queries import PSQL_INSERT_IGNOREDUP_QUERY
 from fetchers.helpers.dbhelpers import psql_bulk_insert
 from fetchers.rest.base import BaseOHLCVFetcher
 from fetchers.utils.asyncioutils import onbackoff, onsuccessgiveup
 from fetchers.utils.exceptions import \
     MaximumRetriesReached, UnsuccessfulDatabaseInsert
+from fetchers.utils.metrics import REST_REQUESTS
 from fetchers.utils.ratelimit import GCRARateLimiter
 
 # Bittrex returns:
@@ -40,16 +39,13 @@ OHLCV_INTERVAL = "MINUTE_1"
 OHLCV_SECTION_HIST = "historical"
 RATE_LIMIT_HITS_PER_MIN = THROTTLER_RATE_LIMITS['RATE_LIMIT_HITS_PER_MIN'][EXCHANGE_NAME]
 RATE_LIMIT_SECS_PER_MIN = THROTTLER_RATE_LIMITS['RATE_LIMIT_SECS_PER_MIN']
-OHLCVS_BITTREX_TOFETCH_REDIS = "ohlcvs_tofetch_bittrex"
-OHLCVS_BITTREX_FETCHING_REDIS = "ohlcvs_fetching_bittrex"
 DATETIME_STR_FORMAT = "%Y-%m-%dT%H:%M:%S"
-OHLCVS_CONSUME_BATCH_SIZE = 100
 
 class BittrexOHLCVFetcher(BaseOHLCVFetcher):
     '''REST Fetcher for OHLCV from Bittrex
     '''
-    def __init__(self, *args):
-        super().__init__(*args, exchange_name = EXCHANGE_NAME)
+    def __init__(self, **kwargs):
+        super().__init__(exchange_name = EXCHANGE_NAME, **kwargs)
 
         # Rate limiter
         self.rate_limiter = GCRARateLimiter(
@@ -166,6 +162,31 @@ class BittrexOHLCVFetcher(BaseOHLCVFetcher):
 
         return f'{symbol}{REDIS_DELIMITER}{start_date}{REDIS_DELIMITER}{end_date}{REDIS_DELIMITER}{interval}'
 
+    @classmethod
+    def make_window_params(
+            cls,
+            symbol: str,
+            start_date: datetime.datetime,
+            end_date: datetime.datetime
+        ) -> str:
+        '''
+        Makes tofetch params that cover a time window
+            with the default interval;
+            Note that only the day of `start_date` is fetched
+
+        :params:
+            `symbol`: symbol string
+            `start_date`: datetime obj
+            `end_date`: datetime obj
+        '''
+
+        return cls.make_tofetch_params(
+            symbol,
+            datetime_to_str(start_date.replace(tzinfo=None), DEFAULT_DATETIME_STR_QUERY),
+            datetime_to_str(end_date.replace(tzinfo=None), DEFAULT_DATETIME_STR_QUERY),
+            OHLCV_INTERVAL
+        )
+
     @classmethod
     def parse_ohlcvs(
             cls,
@@ -213,6 +234,7 @@ class BittrexOHLCVFetcher(BaseOHLCVFetcher):
         ) -> tuple:
         '''
         Returns a list that contains: a tuple to insert into the ohlcvs error table
+            (with retry columns set to their defaults)
 
         :params:
             `symbol`: string
@@ -228,9 +250,33 @@ class BittrexOHLCVFetcher(BaseOHLCVFetcher):
         return (
             (EXCHANGE_NAME, symbol, start_date, end_date,
             interval, historical, resp_status_code,
-            str(exception_class),exception_msg),
+            str(exception_class),exception_msg,
+            0, None, False),
         )
 
+    def _is_immutable_page(self, url: str, data: Any = None) -> bool:
+        '''
+        Returns whether the candles page of `url` never changes,
+            i.e., it is a historical page of one day
+            (1-minute or 5-minute candles) that ended more than
+            `REST_PAGE_CACHE_IMMUTABLE_SECS` ago; Candles never
+            go past the day, so `data` is not needed
+
+        :params:
+            `url`: string
+            `data`: list of candles of the page (optional)
+        '''
+
+        # e.g., /v3/markets/1INCH-USD/candles/MINUTE_1/historical/2019/01/01
+        parts = httpx.URL(url).path.rstrip('/').split('/')
+        if len(parts) < 5 or parts[-4] != OHLCV_SECTION_HIST:
+            return False
+        day_end = datetime.datetime(
+            int(parts[-3]), int(parts[-2]), int(parts[-1])
+        ) + datetime.timedelta(days=1)
+        return day_end < datetime.datetime.now() \
+            - datetime.timedelta(seconds=REST_PAGE_CACHE_IMMUTABLE_SECS)
+
     @backoff.on_predicate(
         backoff.constant,
         lambda result: result[0] == 429,
@@ -262,13 +308,21 @@ class BittrexOHLCVFetcher(BaseOHLCVFetcher):
             `exchange_name`: string - this exchange's name
         '''
 
+        # Immutable pages may be in the page cache
+        cached_data = self._get_cached_page(ohlcv_url)
+        if cached_data is not None:
+            return (200, cached_data, None, None)
+
         retries = 0
         while retries < HTTPX_DEFAULT_RETRIES:
-            async with self.rate_limiter:
+            async with self._rate_limited():
                 try:
-                    ohlcvs_resp = await self.async_httpx_client.get(ohlcv_url)
+                    ohlcvs_resp = await self._timed_get(ohlcv_url)
+                    REST_REQUESTS.labels(EXCHANGE_NAME, ohlcvs_resp.status_code).inc()
                     ohlcvs_resp.raise_for_status()
-                    ohlcv_data = ohlcvs_resp.json()
+                    with self.stage_timer.time('decode'):
+                        ohlcv_data = ohlcvs_resp.json()
+                    self._cache_page(ohlcv_url, ohlcvs_resp, ohlcv_data)
                     return (
                         ohlcvs_resp.status_code,
                         ohlcv_data,
@@ -284,8 +338,10 @@ class BittrexOHLCVFetcher(BaseOHLCVFetcher):
                         f'EXCEPTION: Response status code: {resp_status_code} while requesting {exc.request.url}'
                     )
                 except httpx.TimeoutException as exc:
+                    REST_REQUESTS.labels(EXCHANGE_NAME, 'timeout').inc()
                     await asyncio.sleep(1) # for now just 1 sec
                 except Exception as exc:
+                    REST_REQUESTS.labels(EXCHANGE_NAME, 'error').inc()
                     return (
                         None,
                         None,
@@ -344,25 +400,10 @@ class BittrexOHLCVFetcher(BaseOHLCVFetcher):
                 # Copy to PSQL if parsed successfully
                 # Get the latest date in OHLCVS list,
                 #   if latest date > start_date, update start_date
-                ohlcvs_parsed = self.parse_ohlcvs(ohlcvs, base_id, quote_id)
+                with self.stage_timer.time('parse'):
+                    ohlcvs_parsed = self.parse_ohlcvs(ohlcvs, base_id, quote_id)
                 if ohlcvs_parsed:
-                    insert_success = False
-                    if update:
-                        insert_success = psql_bulk_insert(
-                            self.psql_conn,
-                            ohlcvs_parsed,
-                            OHLCVS_TABLE,
-                            insert_update_query = PSQL_INSERT_UPDATE_QUERY,
-                            unique_cols = OHLCV_UNIQUE_COLUMNS,
-                            update_cols = OHLCV_UPDATE_COLUMNS
-                        )
-                    else:
-                        insert_success = psql_bulk_insert(
-                            self.psql_conn,
-                            ohlcvs_parsed,
-                            OHLCVS_TABLE,
-                            insert_ignoredup_query = PSQL_INSERT_IGNOREDUP_QUERY
-                        )
+                    insert_success = await self._insert_ohlcvs(ohlcvs_parsed, update)
 
                     # Comment this out - not needed atm
                     # if insert_success:
@@ -410,7 +451,10 @@ class BittrexOHLCVFetcher(BaseOHLCVFetcher):
             )
         
         # PSQL Commit
-        self.psql_conn.commit()
+        with self.stage_timer.time('commit'):
+            self.psql_conn.commit()
+        self._on_params_done(params, exc_type)
+        self._on_symbol_done(symbol, resp_status_code)
 
     async def _init_tofetch_redis(
             self,
@@ -429,7 +473,7 @@ class BittrexOHLCVFetcher(BaseOHLCVFetcher):
             `interval`: string
         
         Feeds the following information:
-            - key: `self.tofetch_key`
+            - key: to-fetch lane set of `self.feeding_lane`
             - value: `symbol;;interval;;historical;;start_date_str;;end_date_str`
         
         example:
@@ -449,15 +493,26 @@ class BittrexOHLCVFetcher(BaseOHLCVFetcher):
         # while start_date < end_date:
         #     self.sadd_tofetch_redis(symbol, start_date, end_date, interval)
         #     start_date += datetime.timedelta(days=DAYDELTAS[interval])
+        # Symbols being probed are only fed their first day,
+        #   until their probe closes their circuit
+        # Stop feeding when draining, the days left are not fed
         # Finally reset feeding status
-        for date in list_days_fromto(start_date, end_date):
+        for i, date in enumerate(list_days_fromto(start_date, end_date)):
+            if self.draining:
+                self.feeding = False
+                self.logger.info(
+                    f"Drain: Stopped feeding params before {datetime_to_str(date, DEFAULT_DATETIME_STR_QUERY)}")
+                return
             date_fmted = datetime_to_str(date, DEFAULT_DATETIME_STR_QUERY)
             params_list = [
                 self.make_tofetch_params(
                     symbol, date_fmted, end_date_fmted, interval
                 ) for symbol in symbols
+                if i == 0 or symbol not in self.probing
             ]
-            self.redis_client.sadd(OHLCVS_BITTREX_TOFETCH_REDIS, *params_list)
+            if params_list:
+                self.redis_client.sadd(
+                    self.tofetch_keys[self.feeding_lane], *params_list)
             
             # Asyncio sleep to release event loop for the consume-ohlcvs task
             await asyncio.sleep(
@@ -466,49 +521,6 @@ class BittrexOHLCVFetcher(BaseOHLCVFetcher):
         self.feeding = False
         self.logger.info("Redis: Successfully initialized feeding params")
 
-    async def _consume_ohlcvs_redis(self, update: bool=False) -> None:
-        '''
-        Consumes OHLCV parameters from the Redis to-fetch set
-        '''
-
-        # When start, move all params from fetching set to to-fetch set
-        # Only create http client when consuming, hence the context manager
-        # Keep looping if either:
-        # - self.feeding or
-        # - there are elements in to-fetch set or fetching set
-        fetching_params = self.redis_client.spop(
-            OHLCVS_BITTREX_FETCHING_REDIS,
-            self.redis_client.scard(OHLCVS_BITTREX_FETCHING_REDIS)
-        )
-        if fetching_params:
-            self.redis_client.sadd(
-                OHLCVS_BITTREX_TOFETCH_REDIS, *fetching_params
-            )
-        async with httpx.AsyncClient(
-            timeout=self.httpx_timout, limits=self.httpx_limits) as client:
-            self.async_httpx_client = client
-            while self.feeding or \
-                self.redis_client.scard(OHLCVS_BITTREX_TOFETCH_REDIS) > 0 \
-                    or self.redis_client.scard(OHLCVS_BITTREX_FETCHING_REDIS) > 0:
-                # Pop a batch of size `rate_limit` from Redis to-fetch set,
-                #   send it to Redis fetching set
-                # Add params in params list to Redis fetching set
-                # New to-fetch params with new start dates will be results
-                #   of `get_parse_tasks`
-                #   Add these params to Redis to-fetch set, if not None
-                # Finally, remove params list from Redis fetching set
-                    params_list = self.redis_client.spop(
-                        OHLCVS_BITTREX_TOFETCH_REDIS, OHLCVS_CONSUME_BATCH_SIZE
-                    )
-                    if params_list:
-                        self.redis_client.sadd(OHLCVS_BITTREX_FETCHING_REDIS, *params_list)
-                        get_parse_tasks = [
-                            self._get_and_parse_ohlcv(params, update) for params in params_list
-                        ]
-                        await asyncio.gather(*get_parse_tasks)
-
-                        self.redis_client.srem(self.fetching_key, *params_list)
-
     async def _fetch_ohlcvs_symbols(
             self,
             symbols: list,
@@ -0,0 +1,168 @@
+# This module re-enqueues failed OHLCV windows recorded in the ohlcvs errors table
+
+import datetime
+import json
+from typing import Iterable, List, Tuple
+
+import psycopg2
+import redis
+
+from common.config.constants import \
+    DBCONNECTION, DEFAULT_DATETIME_STR_QUERY, \
+    REDIS_HOST, REDIS_PASSWORD, REDIS_USER
+from common.helpers.datetimehelpers import datetime_to_str
+from common.utils.logutils import create_logger
+from fetchers.config.constants import \
+    OHLCVS_LANE_RETRY, OHLCVS_PAGE_SPAN_MINS, \
+    OHLCVS_RETRY_BASE_SECS, OHLCVS_RETRY_MAX_RETRIES, \
+    OHLCVS_RETRY_WINDOWS_REDIS_KEY, OHLCVS_TOFETCH_LANE_REDIS_KEY
+from fetchers.config.queries import \
+    RETRIED_ERRORS_QUERY, UNRESOLVED_ERRORS_QUERY
+from fetchers.rest.base import BaseOHLCVFetcher
+
+
+def merge_windows(
+        windows: Iterable[Tuple[datetime.datetime, datetime.datetime]],
+        gap: datetime.timedelta = datetime.timedelta(minutes=1)
+    ) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+    '''
+    Merges overlapping or adjacent time windows;
+        Two windows are adjacent if the second starts at most
+        `gap` after the first ends
+
+    :params:
+        `windows`: iterable of (start, end) datetime tuples
+        `gap`: timedelta obj
+    '''
+
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def split_window(
+        start: datetime.datetime,
+        end: datetime.datetime,
+        span: datetime.timedelta
+    ) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+    '''
+    Splits a time window into consecutive windows of at most `span`
+
+    :params:
+        `start`: datetime obj
+        `end`: datetime obj
+        `span`: timedelta obj
+    '''
+
+    windows = []
+    while start < end:
+        windows.append((start, min(start + span, end)))
+        start += span
+    return windows
+
+
+class OHLCVErrorsRetrier:
+    '''
+    Retrier for failed OHLCV windows of an exchange
+
+    Reads unresolved errors that are due for retry, groups them by symbol,
+        merges adjacent windows and feeds one param per request into
+        the retry lane of the Redis to-fetch queue; The REST fetcher
+        consumes the retry lane with the lowest weight and resolves errors
+        of a window once its params are inserted
+    '''
+
+    def __init__(self, exchange_name: str, fetcher_class: BaseOHLCVFetcher):
+        '''
+        :params:
+            `exchange_name`: string - name of the exchange
+            `fetcher_class`: REST fetcher class of the exchange
+        '''
+
+        self.exchange_name = exchange_name
+        self.fetcher_class = fetcher_class
+        self.retry_key = OHLCVS_TOFETCH_LANE_REDIS_KEY.format(
+            exchange=exchange_name, lane=OHLCVS_LANE_RETRY
+        )
+        self.retry_windows_key = \
+            OHLCVS_RETRY_WINDOWS_REDIS_KEY.format(exchange=exchange_name)
+        self.page_span = datetime.timedelta(
+            minutes=OHLCVS_PAGE_SPAN_MINS[exchange_name]
+        )
+
+        self.psql_conn = psycopg2.connect(DBCONNECTION)
+        self.redis_client = redis.Redis(
+            host=REDIS_HOST,
+            username=REDIS_USER,
+            password=REDIS_PASSWORD,
+            decode_responses=True
+        )
+        self.logger = create_logger(f'{exchange_name}_retrier')
+
+    def get_due_windows(self) -> dict:
+        '''
+        Returns a dict of merged windows of unresolved errors due for retry
+            in this form:
+                {
+                    'ETHBTC': [(start_date, end_date), ...]
+                }
+
+        Each error window is capped to one request (page) from its start date
+        '''
+
+        with self.psql_conn.cursor() as cursor:
+            cursor.execute(
+                UNRESOLVED_ERRORS_QUERY,
+                (self.exchange_name, OHLCVS_RETRY_MAX_RETRIES, OHLCVS_RETRY_BASE_SECS)
+            )
+            results = cursor.fetchall()
+
+        windows = {}
+        for symbol, start_date, end_date in results:
+            windows.setdefault(symbol, []).append(
+                (start_date, min(end_date, start_date + self.page_span))
+            )
+        return {
+            symbol: merge_windows(symbol_windows)
+            for symbol, symbol_windows in windows.items()
+        }
+
+    def enqueue(self) -> int:
+        '''
+        Feeds params of due windows into the Redis retry lane
+            and records the retry attempt in the ohlcvs errors table
+
+        Returns the number of params fed
+        '''
+
+        params_windows = {}
+        with self.psql_conn.cursor() as cursor:
+            for symbol, windows in self.get_due_windows().items():
+                for start_date, end_date in windows:
+                    for start, end in split_window(start_date, end_date, self.page_span):
+                        params = self.fetcher_class.make_window_params(symbol, start, end)
+                        params_windows[params] = json.dumps({
+                            'symbol': symbol,
+                            'start': datetime_to_str(start, DEFAULT_DATETIME_STR_QUERY),
+                            'end': datetime_to_str(end, DEFAULT_DATETIME_STR_QUERY)
+                        })
+                    cursor.execute(
+                        RETRIED_ERRORS_QUERY,
+                        (self.exchange_name, symbol, start_date, end_date)
+                    )
+        if params_windows:
+            self.redis_client.hset(self.retry_windows_key, mapping=params_windows)
+            self.redis_client.sadd(self.retry_key, *params_windows.keys())
+        self.psql_conn.commit()
+        self.logger.info(f"Retrier: Fed {len(params_windows)} params to retry lane")
+        return len(params_windows)
+
+    def close_connections(self) -> None:
+        '''
+        Interface to close all connections (e.g., PSQL)
+        '''
+
+        self.psql_conn.close()
@@ -0,0 +1,136 @@
+# Utils for the on-disk cache of immutable REST pages
+
+import hashlib
+import os
+import tempfile
+import zlib
+from typing import Union
+
+import httpx
+
+
+class PageCache:
+    '''
+    Content-addressed on-disk cache of REST response bodies
+
+    Bodies are keyed by the sha256 of their normalized url
+        (see `normalize_url`) and stored zlib-compressed in
+        `{directory}/{key[:2]}/{key}`; Only pages that never change
+        (e.g., historical candles) should be put in it
+
+    When the cache grows over `max_bytes`, the least recently used
+        files (by modification time, touched on reads) are evicted
+        down to 90% of `max_bytes`; The size is tracked per process,
+        so several processes sharing a directory may exceed it
+        until one of them evicts
+    '''
+
+    def __init__(self, directory: str, max_bytes: int):
+        '''
+        :params:
+            `directory`: string - directory of the cache
+            `max_bytes`: int - size limit of the cache
+        '''
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # Scanned on the first put, not to slow down every fetcher start
+        self.size = None
+
+    @staticmethod
+    def normalize_url(url: Union[str, httpx.URL]) -> str:
+        '''
+        Returns `url` without scheme and host, and with sorted query params,
+            so that mirrors of an API (e.g., Binance base urls) share pages
+
+        :params:
+            `url`: string or httpx.URL
+        '''
+
+        url = httpx.URL(url)
+        return f"{url.path}?{'&'.join(sorted(str(url.params).split('&')))}"
+
+    def _path(self, url: Union[str, httpx.URL]) -> str:
+        '''
+        Returns the file path of the page of `url`
+        '''
+
+        key = hashlib.sha256(self.normalize_url(url).encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def _files(self) -> list:
+        '''
+        Returns a list of (mtime, path, size) of all cached files
+        '''
+
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        return files
+
+    def get(self, url: Union[str, httpx.URL]) -> Union[bytes, None]:
+        '''
+        Returns the body of the page of `url`, or None if not cached
+
+        :params:
+            `url`: string or httpx.URL
+        '''
+
+        path = self._path(url)
+        try:
+            with open(path, "rb") as f:
+                content = zlib.decompress(f.read())
+        except (FileNotFoundError, zlib.error):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return content
+
+    def put(self, url: Union[str, httpx.URL], content: bytes) -> None:
+        '''
+        Caches `content` as the body of the page of `url`;
+            Written to a temp file first, so readers never see partial pages
+
+        :params:
+            `url`: string or httpx.URL
+            `content`: bytes
+        '''
+
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(content)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        if self.size is None:
+            self.size = sum(size for _, _, size in self._files())
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        '''
+        Evicts least recently used files down to 90% of `max_bytes`
+        '''
+
+        files = sorted(self._files())
+        self.size = sum(size for _, _, size in files)
+        for _, path, size in files:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
@@ -0,0 +1,162 @@
+# Utils for circuit breakers of persistently failing symbols
+
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import redis
+
+from fetchers.config.constants import \
+    CIRCUIT_FAILURES_REDIS_KEY, CIRCUIT_FAILURE_THRESHOLD, \
+    CIRCUIT_OPENED_REDIS_KEY, CIRCUIT_OPEN_SECS, CIRCUIT_PROBE_REDIS_KEY
+from fetchers.utils.metrics import CIRCUIT_STATE
+
+
+# Circuit states and their values in the `CIRCUIT_STATE` gauge
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_HALF_OPEN = "half_open"
+CIRCUIT_OPEN = "open"
+CIRCUIT_STATE_VALUES = {
+    CIRCUIT_CLOSED: 0,
+    CIRCUIT_HALF_OPEN: 1,
+    CIRCUIT_OPEN: 2
+}
+
+
+class SymbolCircuitBreaker:
+    '''
+    Circuit breakers keyed by symbol for an exchange, kept in Redis
+        so that all fetchers of the exchange share them
+
+    A circuit opens after `threshold` consecutive failures of a symbol
+        and stays open for `open_secs`; It is then half-open: one fetcher
+        claims a probe (`claim_probe`), which opens the circuit again
+        for `open_secs` while a single request of the symbol is made;
+        A success closes the circuit, a failure keeps it open
+
+    Consecutive failures are counted in one Redis hash and the time
+        circuits opened at in another, both with symbols as fields
+    '''
+
+    def __init__(
+            self,
+            redis_client: redis.Redis,
+            exchange_name: str,
+            threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+            open_secs: float = CIRCUIT_OPEN_SECS
+        ):
+        '''
+        :params:
+            `redis_client`: Redis client
+            `exchange_name`: string
+            `threshold`: int - consecutive failures to open a circuit
+            `open_secs`: float - seconds a circuit stays open
+        '''
+
+        self.redis_client = redis_client
+        self.exchange_name = exchange_name
+        self.threshold = threshold
+        self.open_secs = open_secs
+        self.failures_key = CIRCUIT_FAILURES_REDIS_KEY.format(exchange=exchange_name)
+        self.opened_key = CIRCUIT_OPENED_REDIS_KEY.format(exchange=exchange_name)
+
+    def _state(self, failures: int, opened_at: float, now: float) -> str:
+        '''
+        Returns the state of a circuit from its failures and open time
+        '''
+
+        if failures < self.threshold:
+            return CIRCUIT_CLOSED
+        if now - opened_at < self.open_secs:
+            return CIRCUIT_OPEN
+        return CIRCUIT_HALF_OPEN
+
+    def _set_metric(self, symbol: str, state: str) -> None:
+        '''
+        Sets the `CIRCUIT_STATE` gauge of `symbol`
+        '''
+
+        CIRCUIT_STATE.labels(self.exchange_name, symbol) \
+            .set(CIRCUIT_STATE_VALUES[state])
+
+    def states(self) -> Dict[str, str]:
+        '''
+        Returns a dict of symbol to state of circuits that are not closed;
+            Also sets their `CIRCUIT_STATE` gauges
+        '''
+
+        pipe = self.redis_client.pipeline()
+        pipe.hgetall(self.failures_key)
+        pipe.hgetall(self.opened_key)
+        failures, opened = pipe.execute()
+        now = time.time()
+        states = {}
+        for symbol, count in failures.items():
+            state = self._state(int(count), float(opened.get(symbol, 0)), now)
+            if state != CIRCUIT_CLOSED:
+                states[symbol] = state
+                self._set_metric(symbol, state)
+        return states
+
+    def split_symbols(self, symbols: Iterable[str]) -> Tuple[List[str], List[str]]:
+        '''
+        Returns `symbols` whose circuit is closed,
+            and those whose circuit is half-open
+
+        :params:
+            `symbols`: iterable of symbol strings
+        '''
+
+        states = self.states()
+        closed, half_open = [], []
+        for symbol in symbols:
+            state = states.get(symbol, CIRCUIT_CLOSED)
+            if state == CIRCUIT_CLOSED:
+                closed.append(symbol)
+            elif state == CIRCUIT_HALF_OPEN:
+                half_open.append(symbol)
+        return closed, half_open
+
+    def claim_probe(self, symbol: str) -> bool:
+        '''
+        Claims the probe of the half-open circuit of `symbol`, so that
+            only one fetcher probes it; Opens the circuit again until
+            the result of the probe is recorded, or for `open_secs`
+            if there is none (e.g., on server errors or timeouts);
+            Returns whether the probe was claimed
+
+        :params:
+            `symbol`: string
+        '''
+
+        claimed = self.redis_client.set(
+            CIRCUIT_PROBE_REDIS_KEY.format(exchange=self.exchange_name, symbol=symbol),
+            1, nx=True, px=int(self.open_secs * 1000)
+        )
+        if not claimed:
+            return False
+        self.redis_client.hset(self.opened_key, symbol, time.time())
+        self._set_metric(symbol, CIRCUIT_HALF_OPEN)
+        return True
+
+    def record(self, symbol: str, failed: bool) -> str:
+        '''
+        Records the result of a request of `symbol`;
+            Returns the state of its circuit
+
+        :params:
+            `symbol`: string
+            `failed`: bool - whether it is a failure
+        '''
+
+        if not failed:
+            if self.redis_client.hdel(self.failures_key, symbol):
+                self.redis_client.hdel(self.opened_key, symbol)
+                self._set_metric(symbol, CIRCUIT_CLOSED)
+            return CIRCUIT_CLOSED
+        failures = self.redis_client.hincrby(self.failures_key, symbol, 1)
+        if failures < self.threshold:
+            return CIRCUIT_CLOSED
+        # Opens the circuit, or opens it again after a failed probe
+        self.redis_client.hset(self.opened_key, symbol, time.time())
+        self._set_metric(symbol, CIRCUIT_OPEN)
+        return CIRCUIT_OPEN
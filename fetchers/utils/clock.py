@@ -0,0 +1,132 @@
+# Utils for reading the Redis server clock without a round trip per read
+
+import threading
+import time
+from typing import Dict, Tuple
+
+import redis
+
+from fetchers.config.constants import \
+    REDIS_CLOCK_DRIFT_RATE, REDIS_CLOCK_RESYNC_SECS, REDIS_CLOCK_SYNC_SAMPLES
+
+
+class RedisClock:
+    '''
+    Estimate of the Redis server clock from the local monotonic clock
+
+    The offset between both clocks is measured with Redis TIME, taking
+        the midpoint of the round trip as the local time of the reply;
+        Its error bound is half the round trip, plus the drift of
+        both clocks since the measurement (see `REDIS_CLOCK_DRIFT_RATE`)
+
+    The offset is re-measured every `resync_secs`; Callers that need
+        a tighter bound (e.g., rate limiters) pass `max_error` to `now`,
+        which re-measures with a single sample if the current bound
+        exceeds it; `max_error` is floored at the round trip of the last
+        measurement, since a new one cannot do much better than half of it
+    '''
+
+    def __init__(
+            self,
+            redis_client: redis.Redis,
+            resync_secs: float = REDIS_CLOCK_RESYNC_SECS,
+            samples: int = REDIS_CLOCK_SYNC_SAMPLES,
+            drift_rate: float = REDIS_CLOCK_DRIFT_RATE
+        ):
+        '''
+        :params:
+            `redis_client`: Redis client
+            `resync_secs`: float - seconds between measurements of the offset
+            `samples`: int - TIME round trips per measurement
+            `drift_rate`: float - clock drift in seconds per second
+        '''
+
+        self.redis_client = redis_client
+        self.resync_secs = resync_secs
+        self.samples = samples
+        self.drift_rate = drift_rate
+        self.offset = None
+        self.rtt = None
+        self.synced_at = None
+        self.lock = threading.Lock()
+
+    def _sample(self) -> Tuple[float, float]:
+        '''
+        Returns (offset, round trip) of one Redis TIME call
+        '''
+
+        sent = time.monotonic()
+        secs, mics = self.redis_client.time()
+        received = time.monotonic()
+        server = int(secs) + int(mics) / 1_000_000
+        return (server - (sent + received) / 2, received - sent)
+
+    def sync(self, samples: int = None) -> None:
+        '''
+        Measures the offset, keeping the sample with the smallest round trip
+
+        :params:
+            `samples`: int - TIME round trips; `self.samples` if not provided
+        '''
+
+        with self.lock:
+            offset, rtt = min(
+                (self._sample() for _ in range(samples or self.samples)),
+                key=lambda sample: sample[1]
+            )
+            self.offset = offset
+            self.rtt = rtt
+            self.synced_at = time.monotonic()
+
+    def error(self) -> float:
+        '''
+        Returns the error bound in seconds of `now`;
+            None if the offset has not been measured yet
+        '''
+
+        if self.synced_at is None:
+            return None
+        return self.rtt / 2 \
+            + (time.monotonic() - self.synced_at) * self.drift_rate
+
+    def now(self, max_error: float = None) -> float:
+        '''
+        Returns the estimated Redis server time in seconds;
+            Measures the offset first if it has not been measured or
+            is due, or with a single sample if its error bound exceeds
+            `max_error` (floored at the last round trip)
+
+        :params:
+            `max_error`: float - largest acceptable error bound in seconds
+        '''
+
+        local = time.monotonic()
+        if self.synced_at is None \
+            or local - self.synced_at >= self.resync_secs:
+            self.sync()
+            local = time.monotonic()
+        elif max_error is not None \
+            and self.error() > max(max_error, self.rtt):
+            self.sync(samples=1)
+            local = time.monotonic()
+        return local + self.offset
+
+
+_clocks: Dict[tuple, RedisClock] = {}
+_clocks_lock = threading.Lock()
+
+def get_redis_clock(redis_client: redis.Redis) -> RedisClock:
+    '''
+    Returns the clock shared by all users of the Redis server
+        of `redis_client` in this process
+
+    :params:
+        `redis_client`: Redis client
+    '''
+
+    kwargs = redis_client.connection_pool.connection_kwargs
+    key = (kwargs.get('host'), kwargs.get('port'), kwargs.get('path'))
+    with _clocks_lock:
+        if key not in _clocks:
+            _clocks[key] = RedisClock(redis_client)
+        return _clocks[key]
@@ -0,0 +1,70 @@
+# Utils for priority lanes of the Redis to-fetch queue
+
+from typing import Dict, Iterable
+
+
+class WeightedLaneScheduler:
+    '''
+    Plans how many params to take from each to-fetch lane for a batch
+
+    Strict lanes are drained first, in order; The room left is shared
+        among weighted lanes using smooth weighted round-robin, so that
+        lanes with a low weight still progress but never preempt
+        higher-weighted ones
+
+    The round-robin state is kept between batches for long-run fairness
+
+    See: https://github.com/phusion/nginx/commit/27e94984486058d73157038f7950a0a36ecc6e35
+    '''
+
+    def __init__(self, weights: Dict[str, int], strict: Iterable[str] = ()):
+        '''
+        :params:
+            `weights`: dict of lane name to positive int weight
+            `strict`: iterable of lane names, from highest priority
+        '''
+
+        self.weights = weights
+        self.strict = tuple(strict)
+        self.current = {lane: 0 for lane in weights}
+
+    @property
+    def lanes(self) -> tuple:
+        '''
+        All lanes, strict ones first
+        '''
+
+        return self.strict + tuple(self.weights)
+
+    def plan(self, sizes: Dict[str, int], count: int) -> Dict[str, int]:
+        '''
+        Returns a dict of lane name to number of params to take
+
+        :params:
+            `sizes`: dict of lane name to number of params in the lane
+            `count`: int - batch size
+        '''
+
+        plan = {}
+        for lane in self.strict:
+            take = min(sizes.get(lane, 0), count)
+            if take:
+                plan[lane] = take
+                count -= take
+
+        left = {
+            lane: sizes.get(lane, 0) for lane in self.weights
+            if sizes.get(lane, 0) > 0
+        }
+        while count > 0 and left:
+            total = sum(self.weights[lane] for lane in left)
+            for lane in left:
+                self.current[lane] += self.weights[lane]
+            lane = max(left, key=lambda l: self.current[l])
+            self.current[lane] -= total
+            plan[lane] = plan.get(lane, 0) + 1
+            left[lane] -= 1
+            if left[lane] == 0:
+                del left[lane]
+            count -= 1
+        return plan
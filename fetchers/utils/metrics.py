@@ -0,0 +1,139 @@
+# Prometheus metrics of the REST fetchers, WS fetchers and WS updater
+
+import logging
+
+from prometheus_client import \
+    Counter, Gauge, Histogram, start_http_server
+
+from fetchers.config.constants import \
+    METRICS_ADDR, METRICS_PORTS, METRICS_PORT_TRIES
+
+
+# REST fetchers
+REST_REQUESTS = Counter(
+    'fetcher_rest_requests_total',
+    'REST OHLCV requests by response status (or timeout/error)',
+    ['exchange', 'status']
+)
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    'fetcher_rate_limit_wait_seconds',
+    'Time waited for a rate limiter',
+    ['limiter'],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+TOFETCH_PARAMS = Gauge(
+    'fetcher_tofetch_params',
+    'Params in the Redis to-fetch queue',
+    ['exchange', 'lane']
+)
+FETCHING_PARAMS = Gauge(
+    'fetcher_fetching_params',
+    'Params being fetched',
+    ['exchange']
+)
+PAGE_CACHE_REQUESTS = Counter(
+    'fetcher_page_cache_requests_total',
+    'Lookups of immutable pages in the on-disk page cache by result (hit/miss)',
+    ['exchange', 'result']
+)
+CIRCUIT_STATE = Gauge(
+    'fetcher_circuit_state',
+    'Circuit breaker state of a symbol (0 closed, 1 half-open, 2 open)',
+    ['exchange', 'symbol']
+)
+
+STAGE_SECONDS = Histogram(
+    'fetcher_stage_seconds',
+    'Duration of each stage of the REST fetch pipeline',
+    ['exchange', 'stage'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+# PSQL inserts
+ROWS_INSERTED = Counter(
+    'fetcher_rows_inserted_total',
+    'OHLCV rows inserted into PSQL',
+    ['exchange', 'source']
+)
+BULK_INSERT_SECONDS = Histogram(
+    'fetcher_bulk_insert_seconds',
+    'Latency of PSQL bulk inserts by method (copy, or insert on conflict)',
+    ['table', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+# WS fetchers and WS updater
+WS_MESSAGES = Counter(
+    'fetcher_ws_messages_total',
+    'WS messages received',
+    ['exchange', 'connection']
+)
+WS_SHARD_SYMBOLS = Gauge(
+    'fetcher_ws_shard_symbols',
+    'Symbols assigned to a WS connection',
+    ['exchange', 'connection']
+)
+WS_SHARD_LAG_SECONDS = Gauge(
+    'fetcher_ws_shard_lag_seconds',
+    'Lag of a WS connection behind the exchange',
+    ['exchange', 'connection']
+)
+WS_SHARD_RESTARTS = Counter(
+    'fetcher_ws_shard_restarts_total',
+    'WS connection tasks restarted after they stopped',
+    ['exchange']
+)
+WS_CANDLE_WRITES = Counter(
+    'fetcher_ws_candle_writes_total',
+    'WS candles written to Redis after coalescing',
+    ['exchange']
+)
+WS_GAP_PARAMS = Counter(
+    'fetcher_ws_gap_params_total',
+    'REST params fed to repair WS gaps',
+    ['exchange']
+)
+WS_SUB_KEYS = Gauge(
+    'fetcher_ws_sub_keys',
+    'WS sub keys waiting in Redis to be inserted'
+)
+WS_CLOSED_INSERT_SECONDS = Histogram(
+    'fetcher_ws_closed_insert_seconds',
+    'Latency from the close of a WS candle to its direct insert into PSQL',
+    ['exchange'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+WS_UPDATE_SECONDS = Histogram(
+    'fetcher_ws_update_seconds',
+    'Duration of a WS updater cycle (collect and insert)'
+)
+WS_SUPERVISOR_RESTARTS = Counter(
+    'fetcher_ws_supervisor_restarts_total',
+    'Tasks of the WS supervisor restarted after they stopped',
+    ['task']
+)
+
+_metrics_port = None
+
+def start_metrics_server(kind: str) -> int:
+    '''
+    Starts the metrics HTTP listener of this process, once;
+        Returns the port it listens on (None if no port is free)
+
+    :params:
+        `kind`: string - kind of process (see `METRICS_PORTS`)
+    '''
+
+    global _metrics_port
+    if _metrics_port is None:
+        port = METRICS_PORTS[kind]
+        for port in range(port, port + METRICS_PORT_TRIES):
+            try:
+                start_http_server(port, addr=METRICS_ADDR)
+                _metrics_port = port
+                break
+            except OSError:
+                continue
+        else:
+            logging.warning(f"Metrics: No free port for {kind} metrics")
+    return _metrics_port
@@ -1,11 +1,14 @@
 import redis
 import asyncio
+import json
 import random
 import time
 from redis.exceptions import LockError
 from common.config.constants import REDIS_HOST, REDIS_USER, REDIS_PASSWORD
-from common.helpers.datetimehelpers import microseconds_to_seconds
-from fetchers.config.constants import REST_RATE_LIMIT_REDIS_KEY
+from fetchers.config.constants import \
+    REST_BACKOFF_RESYNC_SECS, REST_RATE_LIMIT_REDIS_KEY
+from fetchers.utils.clock import get_redis_clock
+from fetchers.utils.metrics import RATE_LIMIT_WAIT_SECONDS
 
 
 LOCK_TIMEOUT_SECS = 5
@@ -48,6 +51,7 @@ class GCRARateLimiter:
         self.rate_limit = rate_limit
         self.period = period
         self.increment = self.period / self.rate_limit
+        self.clock = get_redis_clock(redis_client)
    
     def _is_limited(self):
         '''
@@ -56,8 +60,10 @@ class GCRARateLimiter:
         Source: https://dev.to/astagi/rate-limiting-using-python-and-redis-58gk
         '''
 
-        secs, mics = self.redis_client.time()
-        t = int(secs) + microseconds_to_seconds(float(mics))
+        # A tenth of the emission interval keeps the shared TAT accurate
+        #   across fetchers on different hosts; The clock floors it at
+        #   its round trip, so a slow Redis does not re-measure each check
+        t = self.clock.now(max_error=self.increment / 10)
         try:
             with self.redis_client.lock(
                 f'lock:{self.key}',
@@ -82,11 +88,14 @@ class GCRARateLimiter:
         API call to wait until the requesting function is not rate-limited
         '''
 
+        start = time.perf_counter()
         while True:
             limited, retry_after = self._is_limited()
             if not limited:
                 break
             await asyncio.sleep(retry_after)
+        RATE_LIMIT_WAIT_SECONDS.labels(self.key).observe(
+            time.perf_counter() - start)
         
     async def __aenter__(self):
         await self.wait()
@@ -122,10 +131,10 @@ class AsyncThrottler:
         self.period = period
         self.increment = period / rate_limit
         self.retry_interval = retry_interval
+        self.clock = get_redis_clock(redis_client)
 
     def flush(self):
-        secs, mics = self.redis_client.time()
-        now = int(secs) + microseconds_to_seconds(float(mics))
+        now = self.clock.now()
         try:
             with self.redis_client.lock(
                 f'lock:{self.key}',
@@ -147,8 +156,7 @@ class AsyncThrottler:
                 break
             await asyncio.sleep(self.retry_interval)
         
-        secs, mics = self.redis_client.time()
-        now = int(secs) + microseconds_to_seconds(float(mics))
+        now = self.clock.now()
         self.redis_client.rpush(self.key, now)
 
     async def __aenter__(self):
@@ -156,3 +164,149 @@ class AsyncThrottler:
 
     async def __aexit__(self, exc_type, exc, tb):
         pass
+
+class SharedBackoff:
+    '''
+    Backoff state shared by multiple instances of a requesting object
+        (e.g., fetchers in different processes)
+
+    The state is kept in one Redis hash and every change is published
+        on a Redis channel; Each instance keeps a local copy, updated
+        by a pub/sub listener thread, so checking the state does not
+        cost a Redis round trip
+
+    The local copy is also re-read from the hash every
+        `REST_BACKOFF_RESYNC_SECS` in case a message was missed
+    '''
+
+    def __init__(
+        self,
+        backoff_key: str,
+        channel: str,
+        redis_client: redis.Redis = None
+    ):
+        '''
+        :params:
+            `backoff_key`: unique Redis hash key for this backoff
+            `channel`: Redis pub/sub channel for this backoff
+            `redis_client`: Redis client
+        '''
+
+        if not redis_client:
+            redis_client = redis.Redis(
+                host=REDIS_HOST,
+                username=REDIS_USER,
+                password=REDIS_PASSWORD,
+                decode_responses=True
+            )
+        self.redis_client = redis_client
+        self.clock = get_redis_clock(redis_client)
+        self.key = backoff_key
+        self.channel = channel
+        self.state = {}
+        self.synced_at = None
+        self.pubsub = None
+        self.thread = None
+
+    def _on_message(self, message: dict) -> None:
+        '''
+        Replaces the local copy with the published state
+        '''
+
+        self.state = json.loads(message['data'])
+
+    def _sync(self) -> None:
+        '''
+        (Re)subscribes if the listener thread is not running
+            and re-reads the local copy if it is due
+        '''
+
+        now = time.monotonic()
+        if self.thread is None or not self.thread.is_alive():
+            # Subscribe before reading the hash so no change is missed
+            self.close()
+            self.pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            self.pubsub.subscribe(**{self.channel: self._on_message})
+            self.thread = self.pubsub.run_in_thread(sleep_time=1, daemon=True)
+        elif now - self.synced_at < REST_BACKOFF_RESYNC_SECS:
+            return
+        self.state = self.redis_client.hgetall(self.key)
+        self.synced_at = now
+
+    def _publish(self, state: dict) -> None:
+        '''
+        Writes `state` to the hash and publishes it in one transaction
+        '''
+
+        pipe = self.redis_client.pipeline()
+        pipe.delete(self.key)
+        if state:
+            pipe.hset(self.key, mapping=state)
+        pipe.publish(self.channel, json.dumps(state))
+        pipe.execute()
+        self.state = state
+
+    def is_blocking(self, url: str) -> bool:
+        '''
+        Checks if requests to `url` have to back off;
+            The url that triggered the backoff is never blocked,
+            so it can retry and reset the backoff
+
+        :params:
+            `url`: string - request url
+        '''
+
+        self._sync()
+        state = self.state
+        return state.get('status') in ("429", "418") and state.get('url') != url
+
+    def remaining(self) -> float:
+        '''
+        Returns seconds left of the current backoff duration;
+            None if there is no backoff duration
+        '''
+
+        state = self.state
+        if state.get('duration') and state.get('time'):
+            return float(state['duration']) \
+                - (self.clock.now() - float(state['time']))
+        return None
+
+    def set(self, status: int, url: str, duration: str) -> None:
+        '''
+        Starts a backoff and broadcasts it to all instances
+
+        :params:
+            `status`: int - response status code (e.g., 429)
+            `url`: string - url of the backed off request
+            `duration`: string - seconds to back off (e.g., Retry-After header)
+        '''
+
+        self._publish({
+            'status': str(status),
+            'url': url,
+            'duration': str(duration),
+            'time': str(self.clock.now())
+        })
+
+    def reset(self) -> None:
+        '''
+        Resets the backoff and broadcasts it to all instances;
+            Does nothing if there is no backoff in the local copy
+        '''
+
+        if self.state:
+            self._publish({})
+
+    def close(self) -> None:
+        '''
+        Stops the listener thread and closes the pub/sub connection
+        '''
+
+        # The listener thread closes the pub/sub connection when stopped
+        if self.thread is not None:
+            self.thread.stop()
+        elif self.pubsub is not None:
+            self.pubsub.close()
+        self.thread = None
+        self.pubsub = None
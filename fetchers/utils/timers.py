@@ -0,0 +1,92 @@
+# Stage timers for the REST fetch pipeline
+
+import time
+from contextlib import contextmanager
+
+from fetchers.utils.metrics import STAGE_SECONDS
+
+
+# Stages of a fetch, in pipeline order
+#   wait: rate limiters (and Binance request weight)
+#   connect: TCP connect and TLS handshake (new connections only)
+#   transfer: sending the request and receiving the response
+#   decode: JSON decoding of the response
+#   parse: parsing OHLCVs into rows
+#   insert: bulk insert of rows into PSQL
+#   commit: final PSQL commit of a params (e.g., error rows)
+STAGES = ("wait", "connect", "transfer", "decode", "parse", "insert", "commit")
+
+
+class StageTimer:
+    '''
+    Times stages of the REST fetch pipeline of an exchange
+
+    Durations are observed into the per-exchange `STAGE_SECONDS`
+        histogram and also aggregated locally so they can be dumped
+        (e.g., on signal or on task completion)
+
+    Any object with the same `time`, `observe`, `summary` and `reset`
+        methods can be plugged into a fetcher instead
+    '''
+
+    def __init__(self, exchange_name: str):
+        '''
+        :params:
+            `exchange_name`: string
+        '''
+
+        self.exchange_name = exchange_name
+        self.reset()
+
+    @contextmanager
+    def time(self, stage: str):
+        '''
+        Context manager that times the `stage` of its block
+
+        :params:
+            `stage`: string - one of `STAGES`
+        '''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, secs: float) -> None:
+        '''
+        Records `secs` seconds spent in `stage`
+
+        :params:
+            `stage`: string - one of `STAGES`
+            `secs`: float
+        '''
+
+        STAGE_SECONDS.labels(self.exchange_name, stage).observe(secs)
+        count, total, max_ = self.stages[stage]
+        self.stages[stage] = (count + 1, total + secs, max(max_, secs))
+
+    def reset(self) -> None:
+        '''
+        Resets local aggregates (not the histogram)
+        '''
+
+        self.stages = {stage: (0, 0.0, 0.0) for stage in STAGES}
+
+    def summary(self) -> str:
+        '''
+        Returns a printable summary of local aggregates;
+            Each stage has its count, total, mean and max time
+            and its share of the total time of all stages
+        '''
+
+        all_total = sum(total for _, total, _ in self.stages.values()) or 1.0
+        lines = [f"Stage timers of {self.exchange_name}:"]
+        for stage, (count, total, max_) in self.stages.items():
+            mean = total / count if count else 0.0
+            lines.append(
+                f"  {stage:<8} count={count:<8} total={total:.3f}s "
+                f"mean={mean * 1000:.2f}ms max={max_ * 1000:.2f}ms "
+                f"share={total / all_total:.1%}"
+            )
+        return "\n".join(lines)
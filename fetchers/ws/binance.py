@@ -3,31 +3,50 @@
 import random
 import asyncio
 import json
+import time
 import redis
 import websockets
-from typing import Iterable, NoReturn
+from typing import Any, Iterable, NoReturn
 from common.config.constants import (
     REDIS_HOST, REDIS_USER,
     REDIS_PASSWORD, REDIS_DELIMITER
 )
 from common.utils.logutils import create_logger
-from fetchers.config.constants import WS_SUB_LIST_REDIS_KEY
+from fetchers.config.constants import (
+    WS_DIRECT_INSERT_CONNECTIONS, WS_DIRECT_INSERT_FLUSH_SECS
+)
 from fetchers.config.queries import MUTUAL_BASE_QUOTE_QUERY
+from celery_app.celery_tasks import binance_resume_fetch_live
 from fetchers.rest.binance import BinanceOHLCVFetcher, EXCHANGE_NAME
+from fetchers.utils.metrics import \
+    WS_MESSAGES, WS_SHARD_LAG_SECONDS, WS_SHARD_RESTARTS, WS_SHARD_SYMBOLS, \
+    start_metrics_server
 from fetchers.utils.exceptions import (
     UnsuccessfulConnection, ConnectionClosed, InvalidStatusCode
 )
-from fetchers.helpers.ws import (
-    make_sub_val,
-    make_sub_redis_key,
-    make_serve_redis_key
-)
+from fetchers.helpers.ws import \
+    CandleCoalescer, SubscribePacer, WSCandleWriter, WSFrameRecorder, \
+    WSGapFiller, WSShard, WSShardManager, iter_frame_batches, \
+    run_until_first_stops
+from fetchers.helpers.sink import ParallelCopySink
 
 
-# Binance only allows up to 1024 subscriptions per ws connection
-#   However, so far only a max value of 200 works...
-URI = "wss://stream.binance.com:9443/ws"
-MAX_SUB_PER_CONN = 200
+# Combined streams: frames are wrapped as {"stream": ..., "data": ...}
+#   and the first streams of a connection are given in its URL
+#   (`?streams=a@kline_1m/b@kline_1m`)
+# Binance allows up to 1024 streams per ws connection and 5 incoming
+#   messages per second; However, a SUBSCRIBE of more than 200 streams
+#   does not work, so the rest are subscribed 200 at a time
+URI = "wss://stream.binance.com:9443/stream"
+MAX_STREAMS_PER_CONN = 1024
+MAX_STREAMS_PER_MESSAGE = 200
+MAX_MESSAGES_PER_SEC = 4
+# Connections are filled to 75% to leave room for rebalancing;
+#   Every `REBALANCE_SECS`, symbols move off connections that lag
+#   more than `MAX_LAG_SECS` or stay disconnected
+SHARD_FILL = 0.75
+MAX_LAG_SECS = 10.0
+REBALANCE_SECS = 30.0
 BACKOFF_MIN_SECS = 2.0
 BACKOFF_MAX_SECS = 60.0
 
@@ -37,23 +56,54 @@ class BinanceOHLCVWebsocket:
     '''
 
     def __init__(
-        self, log_to_stream: bool = False, log_filename: str = None
+        self,
+        log_to_stream: bool = False,
+        log_filename: str = None,
+        direct_insert: bool = False,
+        redis_client: redis.Redis = None,
+        sink: ParallelCopySink = None,
+        record_dir: str = None,
+        psql_conn = None
     ):
+        '''
+        :params:
+            `log_to_stream`: bool - whether to log to stream
+            `log_filename`: string - full path to the log filename
+            `direct_insert`: bool - whether to insert closed candles
+                into PSQL directly, instead of staging them in Redis
+                for the WS updater
+            `redis_client`: Redis client to share (optional)
+            `sink`: ParallelCopySink obj to share in direct insert mode
+                (optional)
+            `record_dir`: string - directory to record raw frames to
+                (optional; see `WSFrameRecorder`)
+            `psql_conn`: psycopg2 conn obj to share with the REST fetcher
+                (optional)
+        '''
+
         check_log_file = log_to_stream is False and log_filename is None
         if check_log_file:
             raise ValueError(
                 "log_filename must be provided if not logging to stream"
             )
 
-        self.redis_client = redis.Redis(
-            host=REDIS_HOST,
-            username=REDIS_USER,
-            password=REDIS_PASSWORD,
-            decode_responses=True
+        if not redis_client:
+            redis_client = redis.Redis(
+                host=REDIS_HOST,
+                username=REDIS_USER,
+                password=REDIS_PASSWORD,
+                decode_responses=True
+            )
+        self.redis_client = redis_client
+        self.candle_writer = WSCandleWriter(
+            self.redis_client, EXCHANGE_NAME, REDIS_DELIMITER,
+            stage=not direct_insert
         )
 
-        # Rest fetcher for convenience
-        self.rest_fetcher = BinanceOHLCVFetcher()
+        # Rest fetcher for convenience, on the same Redis client
+        self.rest_fetcher = BinanceOHLCVFetcher(
+            redis_client=self.redis_client, psql_conn=psql_conn
+        )
 
         # Logging
         self.logger = create_logger(
@@ -62,122 +112,179 @@ class BinanceOHLCVWebsocket:
             log_filename=log_filename
         )
 
+        # Latest candles, flushed to Redis every tick;
+        #   In direct insert mode, closed candles are inserted into PSQL
+        self.sink = None
+        if direct_insert:
+            self.sink = sink or ParallelCopySink(
+                WS_DIRECT_INSERT_CONNECTIONS,
+                flush_secs=WS_DIRECT_INSERT_FLUSH_SECS
+            )
+        self.coalescer = CandleCoalescer(
+            self.candle_writer, logger=self.logger, sink=self.sink)
+
+        # Minutes missed while (re)subscribing are repaired
+        #   by the REST fetcher
+        self.gap_filler = WSGapFiller(
+            BinanceOHLCVFetcher, EXCHANGE_NAME, self.redis_client,
+            resume=binance_resume_fetch_live.delay, logger=self.logger
+        )
+
+        # Optional recorder of raw frames, for replay
+        self.recorder = None
+        if record_dir:
+            self.recorder = WSFrameRecorder(
+                record_dir, EXCHANGE_NAME,
+                meta=lambda: {'symbol_data': self.rest_fetcher.symbol_data}
+            )
+
+        # Connections (shards) and their symbols
+        self.shard_manager = WSShardManager(
+            MAX_STREAMS_PER_CONN, SHARD_FILL, logger=self.logger)
+        self.message_id = 0
+
         # Backoff
         # This backoff delay will be increased
         #   when a connection is unsuccessful
         self.backoff_delay = BACKOFF_MIN_SECS
 
-    async def subscribe(self, symbols: Iterable, i: int = 0) -> NoReturn:
+    async def send_subscriptions(
+        self,
+        ws_client: Any,
+        shard: WSShard
+    ) -> NoReturn:
+        '''
+        Subscribes a connection to (or unsubscribes it from)
+            the symbols of its shard's commands, paced under
+            `MAX_MESSAGES_PER_SEC`
+
+        :params:
+            `ws_client`: websockets client obj
+            `shard`: WSShard obj of the connection
+        '''
+
+        pacer = SubscribePacer(MAX_MESSAGES_PER_SEC)
+
+        async def send(method: str, symbols: list) -> None:
+            # Binance requires WS symbols to be lowercase
+            params = [f'{symbol.lower()}@kline_1m' for symbol in symbols]
+            for j in range(0, len(params), MAX_STREAMS_PER_MESSAGE):
+                await pacer.wait()
+                self.message_id += 1
+                await ws_client.send(json.dumps(
+                    {
+                        "method": method,
+                        "params": params[j:j+MAX_STREAMS_PER_MESSAGE],
+                        "id": self.message_id
+                    })
+                )
+
+        while True:
+            command, symbols = await shard.commands.get()
+            if command == 'subscribe':
+                self.gap_filler.fill(symbols)
+            await send(command.upper(), symbols)
+
+    def handle_frame(self, resp: str) -> float:
+        '''
+        Parses a frame and records its candle in the coalescer;
+            Returns the event time of the candle in seconds, if any
+
+        Raises UnsuccessfulConnection if a (un)subscription failed
+
+        :params:
+            `resp`: string of the frame
         '''
-        Subscribes to Binance WS for `symbols`
+
+        respj = json.loads(resp)
+        if not isinstance(respj, dict):
+            return None
+        if 'result' in respj:
+            if respj['result'] is not None:
+                raise UnsuccessfulConnection
+            return None
+        event_secs = None
+        try:
+            respj = respj['data']
+            symbol = respj['s']
+            timestamp = int(respj['k']['t'])
+            open_ = respj['k']['o']
+            high_ = respj['k']['h']
+            low_ = respj['k']['l']
+            close_ = respj['k']['c']
+            volume_ = respj['k']['v']
+            closed = respj['k']['x']
+            event_secs = respj['E'] / 1000
+            self.gap_filler.seen(symbol, timestamp)
+            base_id = self.rest_fetcher.symbol_data[symbol]['base_id']
+            quote_id = self.rest_fetcher.symbol_data[symbol]['quote_id']
+
+            # Record the latest update of the candle; It is written
+            #   to the sub key hash (for the WS updater) and, if it is
+            #   the latest one, to the serve key hash (for the web service)
+            #   on the next tick of the coalescer
+            self.coalescer.add(
+                base_id, quote_id, timestamp,
+                open_, high_, low_, close_, volume_,
+                closed=closed
+            )
+        except Exception as exc:
+            self.logger.warning(
+                f"Binance WS Fetcher: EXCEPTION: {exc}")
+        return event_secs
+
+    async def subscribe(self, shard: WSShard) -> NoReturn:
+        '''
+        Subscribes to Binance WS for the symbols of `shard`,
+            over one combined-stream connection
 
         :params:
-            `symbols`: list of symbols (not tsymbol)
-                e.g., [ETHBTC]
+            `shard`: WSShard obj
         '''
 
+        i = shard.id
         while True:
             try:
-                async with websockets.connect(URI) as ws:
-                    # Binance requires WS symbols to be lowercase
-                    params = [
-                        f'{symbol.lower()}@kline_1m'
-                        for symbol in symbols
-                    ]
-                    await ws.send(json.dumps(
-                        {
-                            "method": "SUBSCRIBE",
-                            "params": params,
-                            "id": i
-                        })
-                    )
-                    self.logger.info(f"Connection {i}: Successful")
+                url_symbols = sorted(shard.symbols)[:MAX_STREAMS_PER_MESSAGE]
+                uri = URI
+                if url_symbols:
+                    uri += "?streams=" + "/".join(
+                        f'{symbol.lower()}@kline_1m' for symbol in url_symbols)
+                async with websockets.connect(uri) as ws:
+                    # Subscribe to the rest of the symbols; Symbols may
+                    #   have moved while connecting
+                    symbols = shard.connect()
+                    subscribed = set(url_symbols)
+                    # Symbols of the URL are not subscribed with commands,
+                    #   so their gaps are filled here
+                    self.gap_filler.fill(
+                        [symbol for symbol in url_symbols if symbol in symbols])
+                    shard.commands.put_nowait((
+                        'subscribe',
+                        [symbol for symbol in symbols if symbol not in subscribed]
+                    ))
+                    unsubscribed = sorted(subscribed.difference(symbols))
+                    if unsubscribed:
+                        shard.commands.put_nowait(('unsubscribe', unsubscribed))
+                    sender = asyncio.create_task(
+                        self.send_subscriptions(ws, shard))
+                    self.logger.info(
+                        f"Connection {i}: Successful ({len(symbols)} symbols)")
                     self.backoff_delay = BACKOFF_MIN_SECS
-                    while True:
-                        resp = await ws.recv()
-                        respj = json.loads(resp)
-
-                        if isinstance(respj, dict):
-                            if 'result' in respj:
-                                if respj['result'] is not None:
-                                    raise UnsuccessfulConnection
-                            else:
-                                try:
-                                    symbol = respj['s']
-                                    timestamp = int(respj['k']['t'])
-                                    open_ = respj['k']['o']
-                                    high_ = respj['k']['h']
-                                    low_ = respj['k']['l']
-                                    close_ = respj['k']['c']
-                                    volume_ = respj['k']['v']
-                                    base_id = self.rest_fetcher.symbol_data[symbol]['base_id']
-                                    quote_id = self.rest_fetcher.symbol_data[symbol]['quote_id']
-
-                                    # We make "sub'ed value" by serializing the price
-                                    #   data so it can be put into Redis
-                                    # Then, unique sub'ed and serve Redis keys
-                                    #   are created to store the above sub'ed value
-                                    # Also note here that the value put into the sub_
-                                    #   and the serve_ keys are different:
-                                    #   >> sub_ key is a hash with its [internal]
-                                    #   keys as timestamps; this is so that the updater
-                                    #   script can bulk-insert all the price data in
-                                    #   the sub_ key to PSQL later, meanwhile...
-                                    #   >> serve_ key is a hash with its [internal]
-                                    #   keys as timestamp, o, h, l, c, v; this is
-                                    #   because the web service (a.k.a. FastAPI) only
-                                    #   serves to the user [via its websocket connection]
-                                    #   the latest price data, meaning when any new data
-                                    #   comes in from the exchange's ws API,
-                                    #   the hash gets updated
-
-                                    sub_val = make_sub_val(
-                                        timestamp,
-                                        open_, high_, low_, close_, volume_,
-                                        REDIS_DELIMITER
-                                    )
-                                    ws_sub_redis_key = make_sub_redis_key(
-                                        EXCHANGE_NAME,
-                                        base_id,
-                                        quote_id,
-                                        REDIS_DELIMITER
-                                    )
-                                    ws_serve_redis_key = make_serve_redis_key(
-                                        EXCHANGE_NAME,
-                                        base_id,
-                                        quote_id,
-                                        REDIS_DELIMITER
-                                    )
-
-                                    # Add ws sub key to set of all ws sub keys
-                                    # Set hash value for ws sub key
-                                    # Replace ws serve key hash if this timestamp
-                                    #   is more up-to-date
-                                    self.redis_client.sadd(
-                                        WS_SUB_LIST_REDIS_KEY, ws_sub_redis_key)
-                                    self.redis_client.hset(
-                                        ws_sub_redis_key, timestamp, sub_val)
-                                    current_timestamp = self.redis_client.hget(
-                                        ws_serve_redis_key, 'time')
-                                    if current_timestamp is None or \
-                                        timestamp >= int(current_timestamp):
-                                        self.redis_client.hset(
-                                            ws_serve_redis_key,
-                                            mapping = {
-                                                'time': timestamp,
-                                                'open': open_,
-                                                'high': high_,
-                                                'low': low_,
-                                                'close': close_,
-                                                'volume': volume_
-                                            }
-                                        )
-                                except Exception as exc:
-                                    self.logger.warning(
-                                        f"Binance WS Fetcher: EXCEPTION: {exc}")
-
-                        # Sleep to release event loop
-                        await asyncio.sleep(0.01)
+                    try:
+                        async for frames in iter_frame_batches(
+                                ws, recorder=self.recorder, connection=i):
+                            WS_MESSAGES.labels(EXCHANGE_NAME, i).inc(len(frames))
+                            event_secs = None
+                            for resp in frames:
+                                event_secs = self.handle_frame(resp) or event_secs
+                            shard.observe(event_secs)
+
+                            # Yield the event loop once per batch
+                            await asyncio.sleep(0)
+                    finally:
+                        shard.disconnect()
+                        sender.cancel()
             except (ConnectionClosed, InvalidStatusCode) as exc:
                 self.logger.warning(
                     f"Connection {i} raised exception: {exc} - reconnecting..."
@@ -185,6 +292,37 @@ class BinanceOHLCVWebsocket:
                 await asyncio.sleep(min(self.backoff_delay, BACKOFF_MAX_SECS))
                 self.backoff_delay *= (1+random.random()) # add a random factor
 
+    async def rebalance(self) -> NoReturn:
+        '''
+        Every `REBALANCE_SECS`, restarts connection tasks that stopped,
+            moves symbols off connections that lag or stay disconnected,
+            and starts new connections if needed
+        '''
+
+        while True:
+            await asyncio.sleep(REBALANCE_SECS)
+            WS_SHARD_RESTARTS.labels(EXCHANGE_NAME).inc(
+                self.shard_manager.restart_stopped(self.subscribe))
+            self.shard_manager.start(
+                self.shard_manager.rebalance(MAX_LAG_SECS), self.subscribe)
+            now = time.time()
+            for shard in self.shard_manager.shards:
+                WS_SHARD_SYMBOLS.labels(EXCHANGE_NAME, shard.id).set(len(shard.symbols))
+                WS_SHARD_LAG_SECONDS.labels(EXCHANGE_NAME, shard.id).set(shard.lag(now))
+
+    async def subscribe_symbols(self, symbols: Iterable) -> None:
+        '''
+        Packs `symbols` into connections and subscribes to them
+        '''
+
+        self.shard_manager.start(self.shard_manager.assign(symbols), self.subscribe)
+        try:
+            await run_until_first_stops(self.rebalance(), self.coalescer.run())
+        finally:
+            self.shard_manager.stop()
+            if self.recorder is not None:
+                self.recorder.close()
+
     async def mutual_basequote(self) -> None:
         '''
         Subscribes to all base-quote's that are available
@@ -193,7 +331,7 @@ class BinanceOHLCVWebsocket:
 
         symbols_dict = self.rest_fetcher.get_symbols_from_exch(MUTUAL_BASE_QUOTE_QUERY)
         self.rest_fetcher.close_connections()
-        await asyncio.gather(self.subscribe(symbols_dict.keys()))
+        await self.subscribe_symbols(symbols_dict.keys())
 
     async def all(self) -> None:
         '''
@@ -203,19 +341,16 @@ class BinanceOHLCVWebsocket:
         self.rest_fetcher.fetch_symbol_data()
         symbols =  tuple(self.rest_fetcher.symbol_data.keys())
 
-        # Subscribe to `MAX_SUB_PER_CONN` per connection (e.g., 200)
-        await asyncio.gather(
-            *(
-                self.subscribe(symbols[i:i+MAX_SUB_PER_CONN], int(i/MAX_SUB_PER_CONN))
-                    for i in range(0, len(symbols), MAX_SUB_PER_CONN)
-            )
-        )
+        # Pack up to `MAX_STREAMS_PER_CONN * SHARD_FILL` symbols
+        #   per connection (e.g., 768)
+        await self.subscribe_symbols(symbols)
 
     def run_mutual_basequote(self) -> None:
         '''
         API to run the `mutual base-quote` method
         '''
 
+        start_metrics_server(f'{EXCHANGE_NAME}_ws')
         asyncio.run(self.mutual_basequote())
 
     def run_all(self) -> None:
@@ -223,4 +358,5 @@ class BinanceOHLCVWebsocket:
         API to run the `all` method
         '''
 
+        start_metrics_server(f'{EXCHANGE_NAME}_ws')
         asyncio.run(self.all())
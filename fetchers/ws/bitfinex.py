@@ -15,25 +15,34 @@ from common.config.constants import (
 from common.utils.logutils import create_logger
 from common.utils.asyncioutils import AsyncLoopThread
 from fetchers.config.constants import (
-    WS_SUB_REDIS_KEY, WS_SERVE_REDIS_KEY,
-    WS_SUB_LIST_REDIS_KEY, WS_RATE_LIMIT_REDIS_KEY
+    WS_DIRECT_INSERT_CONNECTIONS, WS_DIRECT_INSERT_FLUSH_SECS,
+    WS_RATE_LIMIT_REDIS_KEY
 )
 from fetchers.config.queries import MUTUAL_BASE_QUOTE_QUERY
+from celery_app.celery_tasks import bitfinex_resume_fetch_live
 from fetchers.rest.bitfinex import BitfinexOHLCVFetcher, EXCHANGE_NAME
 from fetchers.utils.ratelimit import AsyncThrottler
+from fetchers.utils.metrics import \
+    WS_MESSAGES, WS_SHARD_RESTARTS, start_metrics_server
 from fetchers.utils.exceptions import (
-    UnsuccessfulConnection, ConnectionClosed, InvalidStatusCode
-)
-from fetchers.helpers.ws import (
-    make_sub_val,
-    make_sub_redis_key,
-    make_serve_redis_key
+    ConnectionClosed, InvalidStatusCode
 )
+from fetchers.helpers.ws import \
+    CandleCoalescer, SubscribePacer, WSCandleWriter, WSFrameRecorder, \
+    WSGapFiller, WSShard, WSShardManager, iter_frame_batches, \
+    run_until_first_stops
+from fetchers.helpers.sink import ParallelCopySink
 
 
 # Bitfinex only allows up to 30 subscriptions per ws connection
+#   (25 for some endpoints), and rejects subscriptions beyond it
+#   with `CHANNEL_LIMIT_ERROR_CODE`; Subscribe requests are paced
+#   at `MAX_SUBSCRIBES_PER_SEC` per connection
 URI = "wss://api-pub.bitfinex.com/ws/2"
 MAX_SUB_PER_CONN = 25
+MAX_SUBSCRIBES_PER_SEC = 5
+CHANNEL_LIMIT_ERROR_CODE = 10305
+DUPLICATE_ERROR_CODE = 10301
 BACKOFF_MIN_SECS = 2.0
 BACKOFF_MAX_SECS = 60.0
 
@@ -43,27 +52,57 @@ class BitfinexOHLCVWebsocket:
     '''
 
     def __init__(
-        self, log_to_stream: bool = False, log_filename: str = None
+        self,
+        log_to_stream: bool = False,
+        log_filename: str = None,
+        direct_insert: bool = False,
+        redis_client: redis.Redis = None,
+        sink: ParallelCopySink = None,
+        record_dir: str = None,
+        psql_conn = None
     ):
+        '''
+        :params:
+            `log_to_stream`: bool - whether to log to stream
+            `log_filename`: string - full path to the log filename
+            `direct_insert`: bool - whether to insert closed candles
+                into PSQL directly, instead of staging them in Redis
+                for the WS updater
+            `redis_client`: Redis client to share (optional)
+            `sink`: ParallelCopySink obj to share in direct insert mode
+                (optional)
+            `record_dir`: string - directory to record raw frames to
+                (optional; see `WSFrameRecorder`)
+            `psql_conn`: psycopg2 conn obj to share with the REST fetcher
+                (optional)
+        '''
+
         check_log_file = log_to_stream is False and log_filename is None
         if check_log_file:
             raise ValueError(
                 "log_filename must be provided if not logging to stream"
             )
 
-        self.redis_client = redis.Redis(
-            host=REDIS_HOST,
-            username=REDIS_USER,
-            password=REDIS_PASSWORD,
-            decode_responses=True
+        if not redis_client:
+            redis_client = redis.Redis(
+                host=REDIS_HOST,
+                username=REDIS_USER,
+                password=REDIS_PASSWORD,
+                decode_responses=True
+            )
+        self.redis_client = redis_client
+        self.candle_writer = WSCandleWriter(
+            self.redis_client, EXCHANGE_NAME, REDIS_DELIMITER,
+            stage=not direct_insert
         )
-        # Mapping from ws_symbol to symbol
-        #   and mapping from channel ID to symbol
+        # Mapping from ws_symbol to symbol;
+        #   Channel IDs are mapped to symbols per connection
         self.wssymbol_mapping = {}
-        self.chanid_mapping = {}
 
-        # Rest fetcher for convenience
-        self.rest_fetcher = BitfinexOHLCVFetcher()
+        # Rest fetcher for convenience, on the same Redis client
+        self.rest_fetcher = BitfinexOHLCVFetcher(
+            redis_client=self.redis_client, psql_conn=psql_conn
+        )
 
         # Logging
         self.logger = create_logger(
@@ -72,6 +111,32 @@ class BitfinexOHLCVWebsocket:
             log_filename=log_filename
         )
 
+        # Latest candles, flushed to Redis every tick;
+        #   In direct insert mode, closed candles are inserted into PSQL
+        self.sink = None
+        if direct_insert:
+            self.sink = sink or ParallelCopySink(
+                WS_DIRECT_INSERT_CONNECTIONS,
+                flush_secs=WS_DIRECT_INSERT_FLUSH_SECS
+            )
+        self.coalescer = CandleCoalescer(
+            self.candle_writer, logger=self.logger, sink=self.sink)
+
+        # Minutes missed while (re)subscribing are repaired
+        #   by the REST fetcher
+        self.gap_filler = WSGapFiller(
+            BitfinexOHLCVFetcher, EXCHANGE_NAME, self.redis_client,
+            resume=bitfinex_resume_fetch_live.delay, logger=self.logger
+        )
+
+        # Optional recorder of raw frames, for replay
+        self.recorder = None
+        if record_dir:
+            self.recorder = WSFrameRecorder(
+                record_dir, EXCHANGE_NAME,
+                meta=lambda: {'symbol_data': self.rest_fetcher.symbol_data}
+            )
+
         # Rate limit manager
         # Limit to attempt to connect every 3 secs
         self.rate_limiter = AsyncThrottler(
@@ -81,6 +146,10 @@ class BitfinexOHLCVWebsocket:
             redis_client = self.redis_client
         )
 
+        # Connections (shards) and their symbols
+        self.shard_manager = WSShardManager(
+            MAX_SUB_PER_CONN, logger=self.logger)
+
         # Backoff
         self.backoff_delay = BACKOFF_MIN_SECS
 
@@ -88,6 +157,20 @@ class BitfinexOHLCVWebsocket:
         # self.loop_handler = AsyncLoopThread(daemon=None)
         # self.loop_handler.start()
 
+    def make_ws_symbol(self, symbol: str) -> str:
+        '''
+        Returns the candles channel key of `symbol` and maps it
+            back to `symbol`
+
+        :params:
+            `symbol`: string of symbol
+        '''
+
+        tsymbol = self.rest_fetcher.make_tsymbol(symbol)
+        ws_symbol = f"trade:1m:{tsymbol}"
+        self.wssymbol_mapping[ws_symbol] = symbol
+        return ws_symbol
+
     async def subscribe_one(
         self,
         symbol: str,
@@ -101,126 +184,79 @@ class BitfinexOHLCVWebsocket:
             `ws_client`: websockets client obj
         '''
 
-        tsymbol = self.rest_fetcher.make_tsymbol(symbol)
-        ws_symbol = f"trade:1m:{tsymbol}"
-        self.wssymbol_mapping[ws_symbol] = symbol
+        ws_symbol = self.make_ws_symbol(symbol)
         msg = {'event': 'subscribe',  'channel': 'candles', 'key': ws_symbol}
         await ws_client.send(json.dumps(msg))
 
-    async def subscribe(self, symbols: Iterable, i: int = 0) -> NoReturn:
+    async def send_subscriptions(
+        self,
+        ws_client: Any,
+        shard: WSShard,
+        channels: dict
+    ) -> NoReturn:
         '''
-        Subscribes to Bitfinex WS for `symbols`
+        Subscribes a connection to (or unsubscribes it from)
+            the symbols of its shard's commands, one request each,
+            paced under `MAX_SUBSCRIBES_PER_SEC`
 
         :params:
-            `symbols` list of symbols
-                e.g., ['ETHBTC', 'BTCEUR']
+            `ws_client`: websockets client obj
+            `shard`: WSShard obj of the connection
+            `channels`: dict of symbol to channel ID of the connection
+        '''
+
+        pacer = SubscribePacer(MAX_SUBSCRIBES_PER_SEC)
+        while True:
+            command, symbols = await shard.commands.get()
+            if command == 'subscribe':
+                self.gap_filler.fill(symbols)
+            for symbol in symbols:
+                if command == 'subscribe':
+                    await pacer.wait()
+                    await self.subscribe_one(symbol, ws_client)
+                elif symbol in channels:
+                    await pacer.wait()
+                    await ws_client.send(json.dumps(
+                        {'event': 'unsubscribe', 'chanId': channels[symbol]}))
+
+    async def subscribe(self, shard: WSShard) -> NoReturn:
+        '''
+        Subscribes to Bitfinex WS for the symbols of `shard`;
+            On reconnect, only the channels of `shard` are restored
+
+        :params:
+            `shard`: WSShard obj
         '''
 
+        i = shard.id
         while True:
             try:
                 # Delay before making a connection
-                # async with self.rate_limiter:
+                await self.rate_limiter.acquire()
                 async with websockets.connect(URI, ping_interval=10) as ws:
-                    await asyncio.gather(
-                        *(self.subscribe_one(symbol, ws) for symbol in symbols))
-                    self.logger.info(f"Connection {i}: Successful")
+                    symbols = shard.connect()
+                    shard.commands.put_nowait(('subscribe', symbols))
+                    # Mappings from channel ID to symbol and back
+                    chanid_mapping = {}
+                    channels = {}
+                    sender = asyncio.create_task(
+                        self.send_subscriptions(ws, shard, channels))
+                    self.logger.info(
+                        f"Connection {i}: Successful ({len(symbols)} symbols)")
                     self.backoff_delay = BACKOFF_MIN_SECS
-                    while True:
-                        resp = await ws.recv()
-                        respj = json.loads(resp)
-
-                        # If resp is dict, find the symbol using wssymbol_mapping
-                        #   and then map chanID to found symbol
-                        # If resp is list, make sure its length is 6
-                        #   and use the mappings to find symbol and push to Redis
-                        if isinstance(respj, dict):
-                            if 'event' in respj:
-                                if respj['event'] == "subscribed":
-                                    symbol = self.wssymbol_mapping[respj['key']]
-                                    self.chanid_mapping[respj['chanId']] = symbol
-                                elif respj['event'] == "error":
-                                    self.logger.error(
-                                        f"Connection {i}: Subscription failed, raising exception")
-                                    raise UnsuccessfulConnection           
-                        elif isinstance(respj, list):
-                            if len(respj) == 2 and len(respj[1]) == 6:
-                                try:
-                                    symbol = self.chanid_mapping[respj[0]]
-                                    timestamp = int(respj[1][0])
-                                    open_ = respj[1][1]
-                                    high_ = respj[1][3]
-                                    low_ = respj[1][4]
-                                    close_ = respj[1][2]
-                                    volume_ = respj[1][5]
-                                    base_id = self.rest_fetcher.symbol_data[symbol]['base_id']
-                                    quote_id = self.rest_fetcher.symbol_data[symbol]['quote_id']
-
-                                    # We make "sub'ed value" by serializing the price
-                                    #   data so it can be put into Redis
-                                    # Then, unique sub'ed and serve Redis keys
-                                    #   are created to store the above sub'ed value
-                                    # Also note here that the value put into the sub_
-                                    #   and the serve_ keys are different:
-                                    #   >> sub_ key is a hash with its [internal]
-                                    #   keys as timestamps; this is so that the updater
-                                    #   script can bulk-insert all the price data in
-                                    #   the sub_ key to PSQL later, meanwhile...
-                                    #   >> serve_ key is a hash with its [internal]
-                                    #   keys as timestamp, o, h, l, c, v; this is
-                                    #   because the web service (a.k.a. FastAPI) only
-                                    #   serves to the user [via its websocket connection]
-                                    #   the latest price data, meaning when any new data
-                                    #   comes in from the exchange's ws API,
-                                    #   the hash gets updated
-
-                                    sub_val = make_sub_val(
-                                        timestamp,
-                                        open_, high_, low_, close_, volume_,
-                                        REDIS_DELIMITER
-                                    )
-                                    ws_sub_redis_key = make_sub_redis_key(
-                                        EXCHANGE_NAME,
-                                        base_id,
-                                        quote_id,
-                                        REDIS_DELIMITER
-                                    )
-                                    ws_serve_redis_key = make_serve_redis_key(
-                                        EXCHANGE_NAME,
-                                        base_id,
-                                        quote_id,
-                                        REDIS_DELIMITER
-                                    )
-
-                                    # Add ws sub key to set of all ws sub keys
-                                    # Set hash value for ws sub key
-                                    # Replace ws serve key hash if this timestamp
-                                    #   is more up-to-date
-                                    self.redis_client.sadd(
-                                        WS_SUB_LIST_REDIS_KEY, ws_sub_redis_key)
-                                    self.redis_client.hset(
-                                        ws_sub_redis_key, timestamp, sub_val)
-                                    current_timestamp = self.redis_client.hget(
-                                        ws_serve_redis_key,
-                                        'time')
-                                    if current_timestamp is None or \
-                                        timestamp >= int(current_timestamp):
-                                        self.redis_client.hset(
-                                            ws_serve_redis_key,
-                                            mapping = {
-                                                'time': timestamp,
-                                                'open': open_,
-                                                'high': high_,
-                                                'low': low_,
-                                                'close': close_,
-                                                'volume': volume_
-                                            }
-                                        )
-                                except Exception as exc:
-                                    self.logger.warning(
-                                        f"Bitfinex WS Fetcher: EXCEPTION: {exc}")
-
-                        # Sleep to release event loop
-                        await asyncio.sleep(0.01)
+                    try:
+                        async for frames in iter_frame_batches(
+                                ws, recorder=self.recorder, connection=i):
+                            WS_MESSAGES.labels(EXCHANGE_NAME, i).inc(len(frames))
+                            for resp in frames:
+                                self.handle_frame(resp, shard, chanid_mapping, channels)
+                            shard.observe()
+
+                            # Yield the event loop once per batch
+                            await asyncio.sleep(0)
+                    finally:
+                        shard.disconnect()
+                        sender.cancel()
             except (ConnectionClosed, InvalidStatusCode) as exc:
                 self.logger.warning(
                     f"Connection {i} raised exception: {exc} - reconnecting..."
@@ -228,6 +264,111 @@ class BitfinexOHLCVWebsocket:
                 await asyncio.sleep(min(self.backoff_delay, BACKOFF_MAX_SECS))
                 self.backoff_delay *= (1+random.random()) # add a random factor
 
+    def handle_frame(
+        self,
+        resp: str,
+        shard: WSShard,
+        chanid_mapping: dict,
+        channels: dict
+    ) -> None:
+        '''
+        Parses a frame of a connection, updating its channel mappings
+            on (un)subscribe events and recording candles in the coalescer
+
+        :params:
+            `resp`: string of the frame
+            `shard`: WSShard obj of the connection
+            `chanid_mapping`: dict of channel ID to symbol of the connection
+            `channels`: dict of symbol to channel ID of the connection
+        '''
+
+        respj = json.loads(resp)
+
+        # If resp is dict, find the symbol using wssymbol_mapping
+        #   and then map chanID to found symbol
+        # If resp is list, make sure its length is 6
+        #   and use the mappings to find symbol and push to Redis
+        if isinstance(respj, dict):
+            if 'event' in respj:
+                if respj['event'] == "subscribed":
+                    symbol = self.wssymbol_mapping[respj['key']]
+                    chanid_mapping[respj['chanId']] = symbol
+                    channels[symbol] = respj['chanId']
+                elif respj['event'] == "unsubscribed":
+                    symbol = chanid_mapping.pop(respj['chanId'], None)
+                    channels.pop(symbol, None)
+                elif respj['event'] == "error":
+                    self.handle_error(shard, respj)
+        elif isinstance(respj, list):
+            if len(respj) == 2 and len(respj[1]) == 6:
+                try:
+                    symbol = chanid_mapping[respj[0]]
+                    timestamp = int(respj[1][0])
+                    open_ = respj[1][1]
+                    high_ = respj[1][3]
+                    low_ = respj[1][4]
+                    close_ = respj[1][2]
+                    volume_ = respj[1][5]
+                    self.gap_filler.seen(symbol, timestamp)
+                    base_id = self.rest_fetcher.symbol_data[symbol]['base_id']
+                    quote_id = self.rest_fetcher.symbol_data[symbol]['quote_id']
+
+                    # Record the latest update of the candle; It is written
+                    #   to the sub key hash (for the WS updater) and, if it is
+                    #   the latest one, to the serve key hash (for the web service)
+                    #   on the next tick of the coalescer
+                    self.coalescer.add(
+                        base_id, quote_id, timestamp,
+                        open_, high_, low_, close_, volume_
+                    )
+                except Exception as exc:
+                    self.logger.warning(
+                        f"Bitfinex WS Fetcher: EXCEPTION: {exc}")
+
+    def handle_error(self, shard: WSShard, respj: dict) -> None:
+        '''
+        Handles an error event of a connection without reconnecting it:
+            symbols over the channel limit move to a connection with room
+
+        :params:
+            `shard`: WSShard obj of the connection
+            `respj`: dict of the error event
+        '''
+
+        symbol = self.wssymbol_mapping.get(respj.get('key'))
+        if respj.get('code') == DUPLICATE_ERROR_CODE:
+            return
+        if respj.get('code') == CHANNEL_LIMIT_ERROR_CODE and symbol in shard.symbols:
+            self.logger.warning(
+                f"Connection {shard.id}: Channel limit reached, moving {symbol}")
+            self.shard_manager.start(
+                self.shard_manager.relocate([symbol], shard), self.subscribe)
+        else:
+            self.logger.error(
+                f"Connection {shard.id}: Subscription failed: {respj}")
+
+    async def subscribe_symbols(self, symbols: Iterable) -> None:
+        '''
+        Packs `symbols` into connections of up to `MAX_SUB_PER_CONN`
+            channels and subscribes to them; Connection tasks that stop
+            are restarted
+        '''
+
+        self.shard_manager.start(self.shard_manager.assign(symbols), self.subscribe)
+
+        async def watch_shards() -> NoReturn:
+            while True:
+                await asyncio.sleep(1)
+                WS_SHARD_RESTARTS.labels(EXCHANGE_NAME).inc(
+                    self.shard_manager.restart_stopped(self.subscribe))
+
+        try:
+            await run_until_first_stops(watch_shards(), self.coalescer.run())
+        finally:
+            self.shard_manager.stop()
+            if self.recorder is not None:
+                self.recorder.close()
+
     async def mutual_basequote(self) -> None:
         '''
         Subscribes to all base-quote's that are available
@@ -236,7 +377,7 @@ class BitfinexOHLCVWebsocket:
 
         symbols_dict = self.rest_fetcher.get_symbols_from_exch(MUTUAL_BASE_QUOTE_QUERY)
         self.rest_fetcher.close_connections()
-        await asyncio.gather(self.subscribe(symbols_dict.keys()))
+        await self.subscribe_symbols(symbols_dict.keys())
 
     async def all(self) -> None:
         '''
@@ -246,27 +387,15 @@ class BitfinexOHLCVWebsocket:
         self.rest_fetcher.fetch_symbol_data()
         symbols =  tuple(self.rest_fetcher.symbol_data.keys())
 
-        # TODO: probably running in different threads is not needed
-        # for i in range(0, len(symbols), MAX_SUB_PER_CONN):
-        #     asyncio.run_coroutine_threadsafe(
-        #         self.subscribe(symbols[i:i+MAX_SUB_PER_CONN], i),
-        #         # self.coroutine(5, i),
-        #         self.loop_handler.loop
-        #     )
-
-        # Subscribe to `MAX_SUB_PER_CONN` per connection (e.g., 30)
-        await asyncio.gather(
-            *(
-                self.subscribe(symbols[i:i+MAX_SUB_PER_CONN], int(i/MAX_SUB_PER_CONN))
-                    for i in range(0, len(symbols), MAX_SUB_PER_CONN)
-            )
-        )
+        # Subscribe to `MAX_SUB_PER_CONN` per connection (e.g., 25)
+        await self.subscribe_symbols(symbols)
 
     def run_mutual_basequote(self) -> None:
         '''
         API to run the `mutual base-quote` method
         '''
 
+        start_metrics_server(f'{EXCHANGE_NAME}_ws')
         asyncio.run(self.mutual_basequote())
 
     def run_all(self) -> None:
@@ -274,4 +403,5 @@ class BitfinexOHLCVWebsocket:
         API to run the `all` method
         '''
 
+        start_metrics_server(f'{EXCHANGE_NAME}_ws')
         asyncio.run(self.all())
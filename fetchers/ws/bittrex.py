@@ -28,20 +28,22 @@ from common.config.constants import (
     DEFAULT_DATETIME_STR_RESULT
 )
 from common.utils.logutils import create_logger
-from common.helpers.datetimehelpers import str_to_milliseconds, redis_time
+from common.helpers.datetimehelpers import str_to_milliseconds
 from fetchers.config.constants import (
-    WS_SUB_REDIS_KEY, WS_SERVE_REDIS_KEY, WS_SUB_LIST_REDIS_KEY
+    WS_DIRECT_INSERT_CONNECTIONS, WS_DIRECT_INSERT_FLUSH_SECS
 )
 from fetchers.config.queries import MUTUAL_BASE_QUOTE_QUERY
+from celery_app.celery_tasks import bittrex_resume_fetch_live
 from fetchers.rest.bittrex import BittrexOHLCVFetcher, EXCHANGE_NAME
+from fetchers.utils.clock import get_redis_clock
+from fetchers.utils.metrics import WS_MESSAGES, start_metrics_server
 from fetchers.utils.exceptions import (
     ConnectionClosed, UnsuccessfulConnection, InvalidStatusCode
 )
-from fetchers.helpers.ws import (
-    make_sub_val,
-    make_sub_redis_key,
-    make_serve_redis_key
-)
+from fetchers.helpers.ws import \
+    CandleCoalescer, WSCandleWriter, WSFrameRecorder, WSGapFiller, \
+    run_until_first_stops
+from fetchers.helpers.sink import ParallelCopySink
 
 
 URI = 'https://socket-v3.bittrex.com/signalr'
@@ -56,30 +58,63 @@ class BittrexOHLCVWebsocket:
     '''
 
     def __init__(
-        self, log_to_stream: bool = False, log_filename: str = None
+        self,
+        log_to_stream: bool = False,
+        log_filename: str = None,
+        direct_insert: bool = False,
+        redis_client: redis.Redis = None,
+        sink: ParallelCopySink = None,
+        record_dir: str = None,
+        psql_conn = None
     ):
+        '''
+        :params:
+            `log_to_stream`: bool - whether to log to stream
+            `log_filename`: string - full path to the log filename
+            `direct_insert`: bool - whether to insert closed candles
+                into PSQL directly, instead of staging them in Redis
+                for the WS updater
+            `redis_client`: Redis client to share (optional)
+            `sink`: ParallelCopySink obj to share in direct insert mode
+                (optional)
+            `record_dir`: string - directory to record raw candle
+                messages to (optional; see `WSFrameRecorder`)
+            `psql_conn`: psycopg2 conn obj to share with the REST fetcher
+                (optional)
+        '''
+
         check_log_file = log_to_stream is False and log_filename is None
         if check_log_file:
             raise ValueError(
                 "log_filename must be provided if not logging to stream"
             )
 
-        self.redis_client = redis.Redis(
-            host=REDIS_HOST,
-            username=REDIS_USER,
-            password=REDIS_PASSWORD,
-            decode_responses=True
+        if not redis_client:
+            redis_client = redis.Redis(
+                host=REDIS_HOST,
+                username=REDIS_USER,
+                password=REDIS_PASSWORD,
+                decode_responses=True
+            )
+        self.redis_client = redis_client
+        self.candle_writer = WSCandleWriter(
+            self.redis_client, EXCHANGE_NAME, REDIS_DELIMITER,
+            stage=not direct_insert
         )
+        self.clock = get_redis_clock(self.redis_client)
 
         # SignalR hub & asyncio
+        self.connection = None
         self.signalr_hub = None
         self.asyncio_lock = asyncio.Lock()
         self.invocation_event = None
         self.invocation_response = None
         self.subscription_success = False
 
-        # Rest fetcher for convenience
-        self.rest_fetcher = BittrexOHLCVFetcher()
+        # Rest fetcher for convenience, on the same Redis client
+        self.rest_fetcher = BittrexOHLCVFetcher(
+            redis_client=self.redis_client, psql_conn=psql_conn
+        )
 
         # Latest timestamp with data
         self.latest_ts = None
@@ -91,20 +126,62 @@ class BittrexOHLCVWebsocket:
             log_filename=log_filename
         )
 
+        # Latest candles, flushed to Redis every tick;
+        #   In direct insert mode, closed candles are inserted into PSQL
+        self.sink = None
+        if direct_insert:
+            self.sink = sink or ParallelCopySink(
+                WS_DIRECT_INSERT_CONNECTIONS,
+                flush_secs=WS_DIRECT_INSERT_FLUSH_SECS
+            )
+        self.coalescer = CandleCoalescer(
+            self.candle_writer, logger=self.logger, sink=self.sink)
+
+        # Minutes missed while (re)subscribing are repaired
+        #   by the REST fetcher
+        self.gap_filler = WSGapFiller(
+            BittrexOHLCVFetcher, EXCHANGE_NAME, self.redis_client,
+            resume=bittrex_resume_fetch_live.delay, logger=self.logger
+        )
+
+        # Optional recorder of raw candle messages, for replay
+        self.recorder = None
+        if record_dir:
+            self.recorder = WSFrameRecorder(
+                record_dir, EXCHANGE_NAME,
+                meta=lambda: {'symbol_data': self.rest_fetcher.symbol_data}
+            )
+
         # Backoff
         self.backoff_delay = BACKOFF_MIN_SECS
 
     async def _connect(self) -> None:
-        self.latest_ts = redis_time(self.redis_client)
-        connection = Connection(URI)
-        self.signalr_hub = connection.register_hub('c3')
-        connection.received += self.on_message
-        connection.error += self.on_error
-        connection.start()
+        self._disconnect()
+        self.latest_ts = self.clock.now()
+        self.connection = Connection(URI)
+        self.signalr_hub = self.connection.register_hub('c3')
+        self.connection.received += self.on_message
+        self.connection.error += self.on_error
+        self.connection.start()
         self.logger.info('Connected')
 
+    def _disconnect(self) -> None:
+        '''
+        Closes the SignalR connection, if any, so that it stops
+            feeding candles to this fetcher
+        '''
+
+        if self.connection is None:
+            return
+        try:
+            self.connection.close()
+        except Exception as exc:
+            self.logger.warning(f"Disconnect: EXCEPTION: {exc}")
+        self.connection = None
+        self.signalr_hub = None
+
     async def _authenticate(self) -> None:
-        timestamp = str(int(redis_time(self.redis_client)) * 1000)
+        timestamp = str(int(self.clock.now()) * 1000)
         random_content = str(uuid.uuid4())
         content = timestamp + random_content
         signed_content = hmac.new(
@@ -155,6 +232,7 @@ class BittrexOHLCVWebsocket:
                 # raise UnsuccessfulConnection // not a good idea to raise here
         if self.subscription_success:
             self.logger.info(f"Group {i}: Subscription successful")
+            self.gap_filler.fill(symbols)
 
     async def _invoke(self, method: str, *args) -> Union[Any, None]:
         '''
@@ -187,7 +265,7 @@ class BittrexOHLCVWebsocket:
         Default function from template
         '''
 
-        self.latest_ts = redis_time(self.redis_client)
+        self.latest_ts = self.clock.now()
         self.logger.warning(msg)
 
     async def on_heartbeat(self, msg) -> None:
@@ -197,7 +275,7 @@ class BittrexOHLCVWebsocket:
         Default function from template
         '''
 
-        self.latest_ts = redis_time(self.redis_client)
+        self.latest_ts = self.clock.now()
         # self.logger.info('\u2661')
 
     async def on_auth_expiring(self, msg) -> None:
@@ -217,7 +295,7 @@ class BittrexOHLCVWebsocket:
         Default function from template
         '''
 
-        self.latest_ts = redis_time(self.redis_client)
+        self.latest_ts = self.clock.now()
         await self.decode_message('Trade', msg)
 
     async def on_candle(self, msg) -> None:
@@ -227,7 +305,10 @@ class BittrexOHLCVWebsocket:
         Default function from template
         '''
 
-        self.latest_ts = redis_time(self.redis_client)
+        self.latest_ts = self.clock.now()
+        WS_MESSAGES.labels(EXCHANGE_NAME, 0).inc()
+        if self.recorder is not None:
+            self.recorder.record(0, msg)
         respj = await self.decode_message('Candle', msg)
 
         # If resp is dict, process and push to Redis
@@ -244,69 +325,18 @@ class BittrexOHLCVWebsocket:
                 low_ = ohlcv['low']
                 close_ = ohlcv['close']
                 volume_ = ohlcv['volume']
+                self.gap_filler.seen(symbol, timestamp)
                 base_id = self.rest_fetcher.symbol_data[symbol]['base_id']
                 quote_id = self.rest_fetcher.symbol_data[symbol]['quote_id']
 
-                # We make "sub'ed value" by serializing the price
-                #   data so it can be put into Redis
-                # Then, unique sub'ed and serve Redis keys
-                #   are created to store the above sub'ed value
-                # Also note here that the value put into the sub_
-                #   and the serve_ keys are different:
-                #   >> sub_ key is a hash with its [internal]
-                #   keys as timestamps; this is so that the updater
-                #   script can bulk-insert all the price data in
-                #   the sub_ key to PSQL later, meanwhile...
-                #   >> serve_ key is a hash with its [internal]
-                #   keys as timestamp, o, h, l, c, v; this is
-                #   because the web service (a.k.a. FastAPI) only
-                #   serves to the user [via its websocket connection]
-                #   the latest price data, meaning when any new data
-                #   comes in from the exchange's ws API,
-                #   the hash gets updated
-
-                sub_val = make_sub_val(
-                    timestamp,
-                    open_, high_, low_, close_, volume_,
-                    REDIS_DELIMITER
+                # Record the latest update of the candle; It is written
+                #   to the sub key hash (for the WS updater) and, if it is
+                #   the latest one, to the serve key hash (for the web service)
+                #   on the next tick of the coalescer
+                self.coalescer.add(
+                    base_id, quote_id, timestamp,
+                    open_, high_, low_, close_, volume_
                 )
-                ws_sub_redis_key = make_sub_redis_key(
-                    EXCHANGE_NAME,
-                    base_id,
-                    quote_id,
-                    REDIS_DELIMITER
-                )
-                ws_serve_redis_key = make_serve_redis_key(
-                    EXCHANGE_NAME,
-                    base_id,
-                    quote_id,
-                    REDIS_DELIMITER
-                )
-
-                # Add ws sub key to set of all ws sub keys
-                # Set hash value for ws sub key
-                # Replace ws serve key hash if this timestamp
-                #   is more up-to-date
-                self.redis_client.sadd(
-                    WS_SUB_LIST_REDIS_KEY, ws_sub_redis_key
-                )
-                self.redis_client.hset(
-                    ws_sub_redis_key, timestamp, sub_val)
-                current_timestamp = self.redis_client.hget(
-                    ws_serve_redis_key, 'time')
-                if current_timestamp is None or \
-                    timestamp >= int(current_timestamp):
-                    self.redis_client.hset(
-                        ws_serve_redis_key,
-                        mapping = {
-                            'time': timestamp,
-                            'open': open_,
-                            'high': high_,
-                            'low': low_,
-                            'close': close_,
-                            'volume': volume_
-                        }
-                    )
             except Exception as exc:
                 self.logger.warning(
                     f"Bittrex WS Fethcer: EXCEPTION: {exc}")
@@ -342,7 +372,7 @@ class BittrexOHLCVWebsocket:
 
         while True:
             try:
-                now = redis_time(self.redis_client)
+                now = self.clock.now()
                 if self.signalr_hub is None \
                     or (now - self.latest_ts) > 60 \
                     or (not self.subscription_success):
@@ -370,7 +400,12 @@ class BittrexOHLCVWebsocket:
 
         self.rest_fetcher.fetch_symbol_data()
         symbols =  tuple(self.rest_fetcher.symbol_data.keys())
-        await asyncio.gather(self.subscribe(symbols))
+        try:
+            await run_until_first_stops(self.subscribe(symbols), self.coalescer.run())
+        finally:
+            self._disconnect()
+            if self.recorder is not None:
+                self.recorder.close()
 
     async def mutual_basequote(self) -> NoReturn:
         '''
@@ -379,13 +414,20 @@ class BittrexOHLCVWebsocket:
         '''
 
         symbols_dict = self.rest_fetcher.get_symbols_from_exch(MUTUAL_BASE_QUOTE_QUERY)
-        await asyncio.gather(self.subscribe(symbols_dict.keys()))
+        try:
+            await run_until_first_stops(
+                self.subscribe(symbols_dict.keys()), self.coalescer.run())
+        finally:
+            self._disconnect()
+            if self.recorder is not None:
+                self.recorder.close()
 
     def run_mutual_basequote(self) -> None:
         '''
         API to run the `mutual base-quote` method
         '''
 
+        start_metrics_server(f'{EXCHANGE_NAME}_ws')
         # loop = asyncio.get_event_loop()
         # if loop.is_closed():
         #     asyncio.set_event_loop(asyncio.new_event_loop())
@@ -402,4 +444,5 @@ class BittrexOHLCVWebsocket:
         API to run the `all` method
         '''
 
+        start_metrics_server(f'{EXCHANGE_NAME}_ws')
         asyncio.run(self.all())
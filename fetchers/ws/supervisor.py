@@ -0,0 +1,288 @@
+### This module runs the websocket fetchers of several exchanges and the WS updater
+###   as tasks of one event loop, in one process
+
+import asyncio
+import json
+import time
+import psycopg2
+import redis
+from typing import Awaitable, Callable, Iterable, NoReturn
+from common.config.constants import (
+    DBCONNECTION, REDIS_HOST, REDIS_USER, REDIS_PASSWORD
+)
+from common.utils.logutils import create_logger
+from fetchers.config.constants import (
+    METRICS_ADDR, WS_DIRECT_INSERT_CONNECTIONS, WS_DIRECT_INSERT_FLUSH_SECS,
+    WS_SUPERVISOR_HEALTH_PORT, WS_SUPERVISOR_RESTART_MAX_SECS,
+    WS_SUPERVISOR_RESTART_MIN_SECS
+)
+from fetchers.helpers.sink import ParallelCopySink
+from fetchers.utils.metrics import WS_SUPERVISOR_RESTARTS, start_metrics_server
+from fetchers.ws.binance import BinanceOHLCVWebsocket
+from fetchers.ws.bitfinex import BitfinexOHLCVWebsocket
+from fetchers.ws.bittrex import BittrexOHLCVWebsocket
+from fetchers.ws.updater import OHLCVWebsocketUpdater
+
+
+# WS fetcher classes by exchange name
+WS_FETCHER_CLASSES = {
+    'bitfinex': BitfinexOHLCVWebsocket,
+    'binance': BinanceOHLCVWebsocket,
+    'bittrex': BittrexOHLCVWebsocket
+}
+UPDATER_TASK = "updater"
+
+class WSSupervisor:
+    '''
+    Supervisor of WS fetchers and the WS updater
+
+    Runs the `all` method of the WS fetcher of each exchange and
+        the WS updater as tasks of one event loop, sharing one Redis
+        connection pool, one PSQL connection and, in direct insert mode,
+        one PSQL sink;
+        A task that stops is restarted (with a new fetcher) after
+        a backoff delay; Connections of a fetcher are restarted
+        by its own shard manager
+
+    Health of the tasks and connections is served as JSON
+        on `health_port` (HTTP 200 if all tasks run, else 503)
+    '''
+
+    def __init__(
+        self,
+        exchanges: Iterable[str] = tuple(WS_FETCHER_CLASSES),
+        log_to_stream: bool = False,
+        log_filename: str = None,
+        direct_insert: bool = False,
+        update: bool = True,
+        health_port: int = WS_SUPERVISOR_HEALTH_PORT,
+        record_dir: str = None
+    ):
+        '''
+        :params:
+            `exchanges`: iterable of exchange names
+            `log_to_stream`: bool - whether to log to stream
+            `log_filename`: string - full path to the log filename
+            `direct_insert`: bool - whether to insert closed candles
+                into PSQL directly
+            `update`: bool - whether to run the WS updater
+            `health_port`: int - port of the health endpoint
+            `record_dir`: string - directory the fetchers record
+                raw frames to (optional)
+        '''
+
+        check_log_file = log_to_stream is False and log_filename is None
+        if check_log_file:
+            raise ValueError(
+                "log_filename must be provided if not logging to stream"
+            )
+
+        self.exchanges = list(exchanges)
+        self.log_to_stream = log_to_stream
+        self.log_filename = log_filename
+        self.direct_insert = direct_insert
+        self.update = update
+        self.health_port = health_port
+        self.record_dir = record_dir
+
+        self.redis_client = redis.Redis(
+            host=REDIS_HOST,
+            username=REDIS_USER,
+            password=REDIS_PASSWORD,
+            decode_responses=True
+        )
+        self.sink = None
+        if direct_insert:
+            self.sink = ParallelCopySink(
+                WS_DIRECT_INSERT_CONNECTIONS,
+                flush_secs=WS_DIRECT_INSERT_FLUSH_SECS
+            )
+
+        # PSQL connection of the REST fetchers and the updater,
+        #   opened when the first task starts (see `get_psql_conn`)
+        self.psql_conn = None
+
+        self.logger = create_logger(
+            'ws_supervisor',
+            stream_handler=log_to_stream,
+            log_filename=log_filename
+        )
+
+        # Running fetchers and status of each task
+        self.fetchers = {}
+        self.status = {}
+
+    def get_psql_conn(self):
+        '''
+        Returns the shared PSQL connection, (re)connecting if it is
+            not open;
+
+        The connection is in autocommit mode: the updater uses it from
+            a worker thread while fetchers use it from the loop,
+            so no transaction may span the statements of both
+        '''
+
+        if self.psql_conn is None or self.psql_conn.closed:
+            self.psql_conn = psycopg2.connect(DBCONNECTION)
+            self.psql_conn.autocommit = True
+        return self.psql_conn
+
+    def make_fetcher(self, exchange: str):
+        '''
+        Returns a new WS fetcher of `exchange` sharing the Redis client,
+            the PSQL connection and the sink of the supervisor
+        '''
+
+        return WS_FETCHER_CLASSES[exchange](
+            log_to_stream=self.log_to_stream,
+            log_filename=self.log_filename,
+            direct_insert=self.direct_insert,
+            redis_client=self.redis_client,
+            sink=self.sink,
+            record_dir=self.record_dir,
+            psql_conn=self.get_psql_conn()
+        )
+
+    async def run_exchange(self, exchange: str) -> NoReturn:
+        '''
+        Runs a new WS fetcher of `exchange` on all of its symbols
+        '''
+
+        fetcher = self.make_fetcher(exchange)
+        self.fetchers[exchange] = fetcher
+        try:
+            await fetcher.all()
+        finally:
+            fetcher.rest_fetcher.close_connections()
+
+    async def run_updater(self) -> NoReturn:
+        '''
+        Runs a new WS updater
+        '''
+
+        updater = OHLCVWebsocketUpdater(
+            log_to_stream=self.log_to_stream,
+            log_filename=self.log_filename,
+            redis_client=self.redis_client,
+            psql_conn=self.get_psql_conn()
+        )
+        await updater.update_async()
+
+    async def supervise(self, name: str, run: Callable[[], Awaitable]) -> NoReturn:
+        '''
+        Runs `run()` as task `name`, restarting it whenever it stops
+
+        :params:
+            `name`: string - name of the task
+            `run`: coroutine function to run
+        '''
+
+        status = self.status.setdefault(
+            name, {'running': False, 'restarts': 0, 'last_error': None})
+        delay = WS_SUPERVISOR_RESTART_MIN_SECS
+        while True:
+            started_at = time.monotonic()
+            status['running'] = True
+            try:
+                await run()
+                self.logger.warning(f"Supervisor: Task {name} returned")
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                status['last_error'] = repr(exc)
+                self.logger.error(f"Supervisor: Task {name} raised exception: {exc!r}")
+            status['running'] = False
+
+            # Tasks that ran for long start over from the minimum delay
+            if time.monotonic() - started_at > WS_SUPERVISOR_RESTART_MAX_SECS:
+                delay = WS_SUPERVISOR_RESTART_MIN_SECS
+            self.logger.info(f"Supervisor: Restarting task {name} in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WS_SUPERVISOR_RESTART_MAX_SECS)
+            status['restarts'] += 1
+            WS_SUPERVISOR_RESTARTS.labels(name).inc()
+
+    def health(self) -> dict:
+        '''
+        Returns the health of the tasks and of the connections
+            of each fetcher
+        '''
+
+        connections = {}
+        for exchange, fetcher in self.fetchers.items():
+            shard_manager = getattr(fetcher, 'shard_manager', None)
+            if shard_manager is not None:
+                connections[exchange] = {
+                    'connected': sum(
+                        shard.connected for shard in shard_manager.shards),
+                    'total': len(shard_manager.shards)
+                }
+        return {
+            'healthy': all(status['running'] for status in self.status.values()),
+            'tasks': self.status,
+            'connections': connections
+        }
+
+    async def handle_health(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter
+    ) -> None:
+        '''
+        Responds to an HTTP request with the health of the supervisor
+        '''
+
+        try:
+            await reader.readline()
+            health = self.health()
+            body = json.dumps(health).encode()
+            status = "200 OK" if health['healthy'] else "503 Service Unavailable"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as exc:
+            self.logger.warning(f"Supervisor: Health request failed: {exc}")
+        finally:
+            writer.close()
+
+    async def run_async(self) -> NoReturn:
+        '''
+        Starts the health endpoint and runs all tasks
+        '''
+
+        server = await asyncio.start_server(
+            self.handle_health, METRICS_ADDR, self.health_port)
+        self.logger.info(f"Supervisor: Serving health on port {self.health_port}")
+        tasks = [
+            self.supervise(exchange, lambda exchange=exchange: self.run_exchange(exchange))
+            for exchange in self.exchanges
+        ]
+        if self.update:
+            tasks.append(self.supervise(UPDATER_TASK, self.run_updater))
+        try:
+            async with server:
+                await asyncio.gather(*tasks)
+        finally:
+            if self.sink is not None:
+                self.sink.close()
+            if self.psql_conn is not None:
+                self.psql_conn.close()
+
+    def run(self, use_uvloop: bool = False) -> None:
+        '''
+        API to run the supervisor
+
+        :params:
+            `use_uvloop`: bool - whether to run on a uvloop event loop
+                (uvloop must be installed)
+        '''
+
+        if use_uvloop:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        start_metrics_server('ws_supervisor')
+        asyncio.run(self.run_async())
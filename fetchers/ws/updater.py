@@ -2,8 +2,10 @@
 #   and inserts them into PSQL database
 
 import time
+import asyncio
 import redis
 import psycopg2
+from collections import Counter
 from typing import NoReturn
 from common.config.constants import (
     REDIS_HOST, REDIS_USER,
@@ -11,18 +13,19 @@ from common.config.constants import (
     DBCONNECTION, OHLCVS_TABLE
 )
 from common.utils.logutils import create_logger
-from common.helpers.datetimehelpers import (
-    milliseconds_to_datetime, redis_time, milliseconds
-)
-from common.helpers.numbers import round_decimal
+from common.helpers.datetimehelpers import milliseconds
 from fetchers.config.constants import (
     WS_SUB_LIST_REDIS_KEY, WS_SUB_PREFIX,
-    WS_SUB_PROCESSING_REDIS_KEY, NUM_DECIMALS
+    WS_SUB_PROCESSING_REDIS_KEY
 )
 from fetchers.config.queries import PSQL_INSERT_IGNOREDUP_QUERY
 from fetchers.helpers.dbhelpers import psql_bulk_insert
 from fetchers.helpers.ws import (
-    make_sub_val, make_sub_redis_key, make_serve_redis_key
+    make_ohlcv_row, make_sub_val, make_sub_redis_key, make_serve_redis_key
+)
+from fetchers.utils.clock import get_redis_clock
+from fetchers.utils.metrics import (
+    ROWS_INSERTED, WS_SUB_KEYS, WS_UPDATE_SECONDS, start_metrics_server
 )
 
 
@@ -40,20 +43,37 @@ class OHLCVWebsocketUpdater:
     '''
 
     def __init__(
-        self, log_to_stream: bool = False, log_filename: str = None
+        self,
+        log_to_stream: bool = False,
+        log_filename: str = None,
+        redis_client: redis.Redis = None,
+        psql_conn = None
     ):
+        '''
+        :params:
+            `log_to_stream`: bool - whether to log to stream
+            `log_filename`: string - full path to the log filename
+            `redis_client`: Redis client to share (optional)
+            `psql_conn`: psycopg2 conn obj to share (optional); it must
+                be in autocommit mode if other threads use it, and
+                it is not closed by the updater
+        '''
+
         check_log_file = log_to_stream is False and log_filename is None
         if check_log_file:
             raise ValueError(
                 "log_filename must be provided if not logging to stream"
             )
 
-        self.redis_client = redis.Redis(
-            host=REDIS_HOST,
-            username=REDIS_USER,
-            password=REDIS_PASSWORD,
-            decode_responses=True
-        )
+        if not redis_client:
+            redis_client = redis.Redis(
+                host=REDIS_HOST,
+                username=REDIS_USER,
+                password=REDIS_PASSWORD,
+                decode_responses=True
+            )
+        self.redis_client = redis_client
+        self.clock = get_redis_clock(self.redis_client)
 
         # Set the log writing mode to 'w', because
         # it will be too much log data if we use 'a'
@@ -63,7 +83,10 @@ class OHLCVWebsocketUpdater:
             log_filename=log_filename,
             mode="w"
         )
-        self.psql_conn = psycopg2.connect(DBCONNECTION)
+        self.owns_psql_conn = psql_conn is None
+        if psql_conn is None:
+            psql_conn = psycopg2.connect(DBCONNECTION)
+        self.psql_conn = psql_conn
 
     @classmethod
     def make_rows_insert(
@@ -76,17 +99,7 @@ class OHLCVWebsocketUpdater:
             `ohlcv`: list of unpacked OHLCV
         '''
 
-        return (
-            milliseconds_to_datetime(int(ts)),
-            exch,
-            base,
-            quote,
-            round_decimal(ohlcv[1], NUM_DECIMALS),
-            round_decimal(ohlcv[2], NUM_DECIMALS),
-            round_decimal(ohlcv[3], NUM_DECIMALS),
-            round_decimal(ohlcv[4], NUM_DECIMALS),
-            round_decimal(ohlcv[5], NUM_DECIMALS)
-        )
+        return make_ohlcv_row(ts, exch, base, quote, *ohlcv[1:6])
 
     @classmethod
     def make_processing_val(
@@ -137,105 +150,145 @@ class OHLCVWebsocketUpdater:
             processing_val
         )
     
+    def update_once(self) -> None:
+        '''
+        Collects ohlcv data in ws sub Redis keys and inserts them
+            into PSQL db once
+        '''
+
+        cycle_start = time.perf_counter()
+        sub_list_len = self.redis_client.scard(WS_SUB_LIST_REDIS_KEY)
+        WS_SUB_KEYS.set(sub_list_len)
+        self.logger.info("Collecting subscribed OHLCV data in Redis")
+        self.logger.info(
+            f"Length of WS sub list: {sub_list_len}")
+        ohlcvs_table_insert = []
+        for key in self.redis_client.smembers(WS_SUB_LIST_REDIS_KEY):
+            exchange, base_id, quote_id = \
+                key.split(WS_SUB_PREFIX)[1].split(REDIS_DELIMITER)
+            data = self.redis_client.hgetall(key)
+            # If no data, remove the key
+            # Elif there is data and len data > 1,
+            #   sort timestamps ascending, exclude the latest one,
+            #   prepare ohlcv rows to insert
+            #   then delete data related to inserted timestamps
+            if not data:
+                self.redis_client.srem(WS_SUB_LIST_REDIS_KEY, key)
+                self.logger.info(
+                    f"WS Fetcher Updater: Removed empty key {key} from sub list")
+            elif len(data) == 1:
+                ts = list(data.keys())[0]
+                now = milliseconds(self.clock.now())
+                if now - int(ts) > DATA_HELD_MLS_THRESHOLD: # more than 1 hour
+                    self.prepare_insert(
+                        data, ohlcvs_table_insert, ts,
+                        exchange, base_id, quote_id
+                    )
+                    self.redis_client.srem(WS_SUB_LIST_REDIS_KEY, key)
+                    self.redis_client.delete(key)
+                    self.logger.info(
+                        f"WS Fetcher Updater: Key {key} has been holding data for more than 1 hour - inserting that value to PSQL db and removing key {key}")
+            elif len(data) > 1:
+                ts_to_insert = sorted(data.keys())[:-1]
+                for ts in ts_to_insert:
+                    self.prepare_insert(
+                        data, ohlcvs_table_insert, ts,
+                        exchange, base_id, quote_id
+                    )
+                self.redis_client.hdel(key, *ts_to_insert)
+        # Bulk insert
+        try:
+            success = psql_bulk_insert(
+                self.psql_conn,
+                ohlcvs_table_insert,
+                OHLCVS_TABLE,
+                insert_ignoredup_query = PSQL_INSERT_IGNOREDUP_QUERY
+            )
+            # If success, clean up
+            # If not, unpack the values and resend them back to
+            #   corresponding `ws_sub_redis_key`
+            # TODO: the unpacking work should be done by a separate worker;
+            #   maybe a cleaner? this looks messy
+            if success:
+                self.logger.info(
+                    f"WS Fetcher Updater: Successfully updated OHLCV to PSQL db - {len(ohlcvs_table_insert)} rows")
+                rows_per_exchange = Counter(row[1] for row in ohlcvs_table_insert)
+                for exch, rows in rows_per_exchange.items():
+                    ROWS_INSERTED.labels(exch, 'ws').inc(rows)
+                self.redis_client.delete(WS_SUB_PROCESSING_REDIS_KEY)
+            else:
+                self.logger.warning(
+                    "WS Fetcher Updater: Failed to update OHLCV to PSQL db - sending OHLCV values back to sub redis key")
+                for processing_val in \
+                    self.redis_client.smembers(WS_SUB_PROCESSING_REDIS_KEY):
+                    exch, base, quote, \
+                    ts, open_, high_, \
+                    low_, close_, volume_ \
+                        = processing_val.split(REDIS_DELIMITER)
+                    sub_val = make_sub_val(
+                        ts,
+                        open_, high_, low_, close_, volume_,
+                        REDIS_DELIMITER
+                    )
+                    ws_sub_redis_key = make_sub_redis_key(
+                        exch,
+                        base,
+                        quote,
+                        REDIS_DELIMITER
+                    )
+                    self.redis_client.sadd(
+                        WS_SUB_LIST_REDIS_KEY, ws_sub_redis_key)
+                    self.redis_client.hset(
+                        ws_sub_redis_key, ts, sub_val)
+                    self.redis_client.srem(
+                        WS_SUB_PROCESSING_REDIS_KEY,
+                        processing_val
+                    )
+        # Reconnects if connection is closed
+        except psycopg2.InterfaceError as exc:
+            self.logger.warning(
+                f"WS Fetcher Updater: EXCEPTION: {exc}. Reconnecting...")
+            self.psql_conn = psycopg2.connect(DBCONNECTION)
+            self.owns_psql_conn = True
+        except Exception as exc:
+            self.logger.error(
+                f"WS Fetcher Updater: EXCEPTION: {exc}")
+            raise exc
+        WS_UPDATE_SECONDS.observe(time.perf_counter() - cycle_start)
+
+    def close_connections(self) -> None:
+        '''
+        Closes the PSQL connection if it is the updater's own
+        '''
+
+        if self.owns_psql_conn:
+            self.psql_conn.close()
+
     def update(self) -> NoReturn:
         '''
         Collects ohlcv data in ws sub Redis keys and inserts them
             into PSQL db every `UPDATE_FREQUENCY_SECS` seconds
         '''
 
+        start_metrics_server('ws_updater')
         try:
             while True:
-                self.logger.info("Collecting subscribed OHLCV data in Redis")
-                self.logger.info(
-                    f"Length of WS sub list: {self.redis_client.scard(WS_SUB_LIST_REDIS_KEY)}")
-                ohlcvs_table_insert = []
-                for key in self.redis_client.smembers(WS_SUB_LIST_REDIS_KEY):
-                    exchange, base_id, quote_id = \
-                        key.split(WS_SUB_PREFIX)[1].split(REDIS_DELIMITER)
-                    data = self.redis_client.hgetall(key)
-                    # If no data, remove the key
-                    # Elif there is data and len data > 1,
-                    #   sort timestamps ascending, exclude the latest one,
-                    #   prepare ohlcv rows to insert
-                    #   then delete data related to inserted timestamps
-                    if not data:
-                        self.redis_client.srem(WS_SUB_LIST_REDIS_KEY, key)
-                        self.logger.info(
-                            f"WS Fetcher Updater: Removed empty key {key} from sub list")
-                    elif len(data) == 1:
-                        ts = list(data.keys())[0]
-                        now = milliseconds(redis_time(self.redis_client))
-                        if now - int(ts) > DATA_HELD_MLS_THRESHOLD: # more than 1 hour
-                            self.prepare_insert(
-                                data, ohlcvs_table_insert, ts,
-                                exchange, base_id, quote_id
-                            )
-                            self.redis_client.srem(WS_SUB_LIST_REDIS_KEY, key)
-                            self.redis_client.delete(key)
-                            self.logger.info(
-                                f"WS Fetcher Updater: Key {key} has been holding data for more than 1 hour - inserting that value to PSQL db and removing key {key}")
-                    elif len(data) > 1:
-                        ts_to_insert = sorted(data.keys())[:-1]
-                        for ts in ts_to_insert:
-                            self.prepare_insert(
-                                data, ohlcvs_table_insert, ts,
-                                exchange, base_id, quote_id
-                            )
-                        self.redis_client.hdel(key, *ts_to_insert)
-                # Bulk insert
-                try:
-                    success = psql_bulk_insert(
-                        self.psql_conn,
-                        ohlcvs_table_insert,
-                        OHLCVS_TABLE,
-                        insert_ignoredup_query = PSQL_INSERT_IGNOREDUP_QUERY
-                    )
-                    # If success, clean up
-                    # If not, unpack the values and resend them back to
-                    #   corresponding `ws_sub_redis_key`
-                    # TODO: the unpacking work should be done by a separate worker;
-                    #   maybe a cleaner? this looks messy
-                    if success:
-                        self.logger.info(
-                            f"WS Fetcher Updater: Successfully updated OHLCV to PSQL db - {len(ohlcvs_table_insert)} rows")
-                        self.redis_client.delete(WS_SUB_PROCESSING_REDIS_KEY)
-                    else:
-                        self.logger.warning(
-                            "WS Fetcher Updater: Failed to update OHLCV to PSQL db - sending OHLCV values back to sub redis key")
-                        for processing_val in \
-                            self.redis_client.smembers(WS_SUB_PROCESSING_REDIS_KEY):
-                            exch, base, quote, \
-                            ts, open_, high_, \
-                            low_, close_, volume_ \
-                                = processing_val.split(REDIS_DELIMITER)
-                            sub_val = make_sub_val(
-                                ts,
-                                open_, high_, low_, close_, volume_,
-                                REDIS_DELIMITER
-                            )
-                            ws_sub_redis_key = make_sub_redis_key(
-                                exch,
-                                base,
-                                quote,
-                                REDIS_DELIMITER
-                            )
-                            self.redis_client.sadd(
-                                WS_SUB_LIST_REDIS_KEY, ws_sub_redis_key)
-                            self.redis_client.hset(
-                                ws_sub_redis_key, ts, sub_val)
-                            self.redis_client.srem(
-                                WS_SUB_PROCESSING_REDIS_KEY,
-                                processing_val
-                            )
-                # Reconnects if connection is closed
-                except psycopg2.InterfaceError as exc:
-                    self.logger.warning(
-                        f"WS Fetcher Updater: EXCEPTION: {exc}. Reconnecting...")
-                    self.psql_conn = psycopg2.connect(DBCONNECTION)
-                except Exception as exc:
-                    self.logger.error(
-                        f"WS Fetcher Updater: EXCEPTION: {exc}")
-                    raise exc
+                self.update_once()
                 time.sleep(UPDATE_FREQUENCY_SECS)
         finally:
-            self.psql_conn.close()
+            self.close_connections()
+
+    async def update_async(self) -> NoReturn:
+        '''
+        Same as `update`, as a task of a running event loop;
+            Each cycle runs in a worker thread, so that the loop
+            is not blocked by Redis and PSQL calls
+        '''
+
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await loop.run_in_executor(None, self.update_once)
+                await asyncio.sleep(UPDATE_FREQUENCY_SECS)
+        finally:
+            self.close_connections()
@@ -0,0 +1,167 @@
+# This module benchmarks OHLCV insert paths into a scratch hypertable
+#
+# Needs a TimescaleDB with the ohlcvs table (its schema is copied);
+#   use a development stack, not production
+#
+# Pages of synthetic 1-minute rows are inserted in random symbol and
+#   time order, like backfill pages popped from Redis, with:
+#   - single: one connection, one COPY per page (the default REST path)
+#   - sink: the parallel COPY sink
+#   - bulk: the parallel COPY sink in bulk-load mode
+#
+# Reports rows/s of each mode
+#
+# example:
+#   python -m scripts.benchmark.insert --symbols 20 --days 30 --connections 4
+
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import time
+
+import psycopg2
+
+from common.config.constants import DBCONNECTION
+from fetchers.config.queries import PSQL_INSERT_IGNOREDUP_QUERY
+from fetchers.helpers.dbhelpers import psql_bulk_insert
+from fetchers.helpers.sink import ParallelCopySink
+
+
+BENCHMARK_TABLE = "ohlcvs_benchmark"
+CREATE_TABLE_QUERY = f'''
+create table if not exists {BENCHMARK_TABLE}
+   (like ohlcvs including defaults including constraints including indexes);
+select create_hypertable('{BENCHMARK_TABLE}', 'time', if_not_exists => true);
+'''
+TRUNCATE_TABLE_QUERY = f"truncate {BENCHMARK_TABLE};"
+DROP_TABLE_QUERY = f"drop table if exists {BENCHMARK_TABLE};"
+MODES = ("single", "sink", "bulk")
+
+
+def make_pages(symbols: int, days: int, page_rows: int, seed: int=0) -> list:
+    '''
+    Returns pages of synthetic OHLCV rows of `symbols` symbols over `days`,
+        each of `page_rows` consecutive minutes of a symbol, shuffled
+
+    :params:
+        `symbols`: int
+        `days`: int
+        `page_rows`: int
+        `seed`: int - seed of the shuffle
+    '''
+
+    rng = random.Random(seed)
+    end = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+    start = end - datetime.timedelta(days=days)
+    minutes = days * 1440
+    pages = []
+    for i in range(symbols):
+        for page_start in range(0, minutes, page_rows):
+            page = []
+            for minute in range(page_start, min(page_start + page_rows, minutes)):
+                price = round(100 + rng.random(), 2)
+                page.append((
+                    start + datetime.timedelta(minutes=minute),
+                    'benchmark', f'base{i}', 'usd',
+                    price, price, price, price, round(rng.random() * 10, 2)
+                ))
+            pages.append(page)
+    rng.shuffle(pages)
+    return pages
+
+def run_single(pages: list) -> None:
+    '''
+    Inserts `pages` one COPY each over one connection
+    '''
+
+    conn = psycopg2.connect(DBCONNECTION)
+    try:
+        for page in pages:
+            psql_bulk_insert(
+                conn, page, BENCHMARK_TABLE,
+                insert_ignoredup_query = PSQL_INSERT_IGNOREDUP_QUERY
+            )
+    finally:
+        conn.close()
+
+def run_sink(pages: list, connections: int, bulk_load: bool, batch: int) -> None:
+    '''
+    Inserts `pages` through a parallel sink, `batch` pages at a time
+        like a batch of params consumed by a REST fetcher
+    '''
+
+    sink = ParallelCopySink(connections, bulk_load=bulk_load, table=BENCHMARK_TABLE)
+
+    async def insert_all():
+        for i in range(0, len(pages), batch):
+            await asyncio.gather(
+                *(sink.insert(page) for page in pages[i:i + batch])
+            )
+
+    try:
+        asyncio.run(insert_all())
+    finally:
+        sink.close()
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    '''
+    Runs the benchmark; Returns a dict of results
+    '''
+
+    pages = make_pages(args.symbols, args.days, args.page_rows)
+    rows = sum(len(page) for page in pages)
+    conn = psycopg2.connect(DBCONNECTION)
+    conn.autocommit = True
+    results = {
+        'symbols': args.symbols,
+        'days': args.days,
+        'rows': rows,
+        'connections': args.connections,
+        'rows_per_sec': {}
+    }
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_TABLE_QUERY)
+        for mode in args.modes:
+            with conn.cursor() as cursor:
+                cursor.execute(TRUNCATE_TABLE_QUERY)
+            start = time.perf_counter()
+            if mode == "single":
+                run_single(pages)
+            else:
+                run_sink(pages, args.connections, mode == "bulk", args.batch)
+            results['rows_per_sec'][mode] = \
+                round(rows / (time.perf_counter() - start), 2)
+    finally:
+        if not args.keep_table:
+            with conn.cursor() as cursor:
+                cursor.execute(DROP_TABLE_QUERY)
+        conn.close()
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m scripts.benchmark.insert",
+        description="Benchmarks OHLCV insert paths into a scratch hypertable"
+    )
+    arg_parser.add_argument(
+        '--symbols', type=int, default=20, help='number of symbols')
+    arg_parser.add_argument(
+        '--days', type=int, default=30, help='days of 1-minute rows per symbol')
+    arg_parser.add_argument(
+        '--page_rows', type=int, default=1000, help='rows per page')
+    arg_parser.add_argument(
+        '--batch', type=int, default=100, help='pages inserted concurrently')
+    arg_parser.add_argument(
+        '--connections', type=int, default=4, help='connections of the sinks')
+    arg_parser.add_argument(
+        '--modes', type=str, nargs='+', default=list(MODES), choices=MODES)
+    arg_parser.add_argument(
+        '--keep_table', action='store_true',
+        help='keep the scratch table after running')
+    args = arg_parser.parse_args()
+
+    print(json.dumps(run_benchmark(args), indent=4))
@@ -0,0 +1,397 @@
+# This module runs a local mock exchange HTTP server
+#   that emulates the OHLCV endpoints of Binance, Bitfinex and Bittrex
+#   so fetchers can be benchmarked without hitting the live exchanges
+#
+# Endpoints are served under a prefix per exchange, e.g.,
+#   http://127.0.0.1:8800/binance/api/v3/klines?symbol=C000USDT&...
+#   http://127.0.0.1:8800/bitfinex/v2/candles/trade:1m:tC000USD/hist?...
+#   http://127.0.0.1:8800/bittrex/v3/markets/C000-USD/candles/MINUTE_1/historical/2021/6/16
+# Stats (requests, statuses, candles served) are at `/_stats`
+
+import argparse
+import datetime
+import json
+import math
+import multiprocessing
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+MOCK_HOST = "127.0.0.1"
+MOCK_PORT = 8800
+EXCHANGES = ("binance", "bitfinex", "bittrex")
+
+# Requests allowed per exchange in each `RATE_LIMIT_WINDOW_SECS`;
+#   slightly above the fetchers' own client-side limits
+DEFAULT_RATE_LIMITS = {
+    'binance': 1200,
+    'bitfinex': 90,
+    'bittrex': 60
+}
+RATE_LIMIT_WINDOW_SECS = 60
+BAN_MULTIPLIER = 2 # Binance 418 ban is this many times the window left
+
+# Max candles per request, same as the exchanges
+BINANCE_MAX_LIMIT = 1000
+BITFINEX_MAX_LIMIT = 10000
+MINUTE_MLS = 60000
+BITTREX_DATETIME_STR = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def make_symbols(count: int) -> list:
+    '''
+    Returns a list of `count` synthetic (base, quote) tuples
+
+    :params:
+        `count`: int - number of symbols
+    '''
+
+    return [(f'C{i:03d}', "USD") for i in range(count)]
+
+def make_candle(symbol: str, minute: int) -> tuple:
+    '''
+    Returns a deterministic synthetic candle (o, h, l, c, v)
+        of `symbol` at `minute` (minutes since epoch)
+
+    :params:
+        `symbol`: string
+        `minute`: int
+    '''
+
+    base = 1 + zlib.crc32(symbol.encode()) % 1000
+    open_ = base * (1 + 0.05 * math.sin(minute / 720))
+    close_ = base * (1 + 0.05 * math.sin((minute + 1) / 720))
+    high_ = max(open_, close_) * 1.001
+    low_ = min(open_, close_) * 0.999
+    volume_ = 1 + (minute * 7919 + base) % 500
+    return (
+        round(open_, 4), round(high_, 4),
+        round(low_, 4), round(close_, 4), float(volume_)
+    )
+
+
+class MockExchangeServer(ThreadingHTTPServer):
+    '''
+    Mock exchange HTTP server
+
+    Emulates:
+        - configurable latency (with jitter) for every request
+        - per-exchange fixed-window rate limits, responding 429 with
+            a `Retry-After` header; Binance responds 418 with a longer
+            `Retry-After` to requests made while backing off
+        - synthetic 1-minute history from `history_days` ago until now
+        - random server errors (500) at `error_rate`
+    '''
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple,
+        num_symbols: int = 100,
+        history_days: int = 30,
+        latency: float = 0.05,
+        jitter: float = 0.02,
+        rate_limits: dict = None,
+        error_rate: float = 0.0
+    ):
+        '''
+        :params:
+            `address`: (host, port) tuple
+            `num_symbols`: int - number of symbols per exchange
+            `history_days`: int - days of history available
+            `latency`: float - seconds added to each response
+            `jitter`: float - max random seconds added to `latency`
+            `rate_limits`: dict of exchange to requests per window
+            `error_rate`: float - ratio of requests answered with 500
+        '''
+
+        super().__init__(address, MockExchangeRequestHandler)
+        self.symbols = make_symbols(num_symbols)
+        self.history_start_mls = \
+            int(time.time() - history_days * 86400) // 60 * MINUTE_MLS
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limits = rate_limits or DEFAULT_RATE_LIMITS
+        self.error_rate = error_rate
+
+        self.lock = threading.Lock()
+        self.windows = {exchange: (0, 0) for exchange in EXCHANGES}
+        self.banned_until = {exchange: 0 for exchange in EXCHANGES}
+        self.stats = {
+            exchange: {'requests': 0, 'candles': 0, 'statuses': {}}
+            for exchange in EXCHANGES
+        }
+
+    def check_rate_limit(self, exchange: str) -> tuple:
+        '''
+        Counts a request against the rate limit of `exchange`;
+            Returns (status, retry_after), status is None if allowed
+
+        :params:
+            `exchange`: string
+        '''
+
+        now = time.time()
+        with self.lock:
+            if now < self.banned_until[exchange]:
+                retry_after = self.banned_until[exchange] - now
+                if exchange == "binance":
+                    retry_after *= BAN_MULTIPLIER
+                    self.banned_until[exchange] = now + retry_after
+                    return (418, retry_after)
+                return (429, retry_after)
+            window_start, count = self.windows[exchange]
+            if now - window_start >= RATE_LIMIT_WINDOW_SECS:
+                window_start, count = now, 0
+            count += 1
+            self.windows[exchange] = (window_start, count)
+            if count > self.rate_limits[exchange]:
+                retry_after = window_start + RATE_LIMIT_WINDOW_SECS - now
+                self.banned_until[exchange] = now + retry_after
+                return (429, retry_after)
+        return (None, None)
+
+    def record(self, exchange: str, status: int, candles: int = 0) -> None:
+        '''
+        Records a response in stats
+        '''
+
+        with self.lock:
+            stats = self.stats[exchange]
+            stats['requests'] += 1
+            stats['candles'] += candles
+            stats['statuses'][str(status)] = stats['statuses'].get(str(status), 0) + 1
+
+    def candle_range(self, start_mls: int, end_mls: int, limit: int) -> range:
+        '''
+        Returns a range of minutes (since epoch) with candles between
+            `start_mls` and `end_mls`, at most `limit` of them
+        '''
+
+        now_mls = int(time.time()) // 60 * MINUTE_MLS
+        start = max(start_mls, self.history_start_mls)
+        start = -(-start // MINUTE_MLS) # round up to the minute
+        end = min(end_mls, now_mls) // MINUTE_MLS
+        return range(start, max(start, min(end + 1, start + limit)))
+
+
+class MockExchangeRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Request handler of `MockExchangeServer`
+    '''
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, body, headers: dict = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if parts[0] == "_stats":
+            with self.server.lock:
+                return self._send_json(200, self.server.stats)
+        exchange = parts[0]
+        if exchange not in EXCHANGES:
+            return self._send_json(404, {'error': 'not found'})
+
+        time.sleep(self.server.latency + random.random() * self.server.jitter)
+        status, retry_after = self.server.check_rate_limit(exchange)
+        if status is None and random.random() < self.server.error_rate:
+            status = 500
+        if status is not None:
+            self.server.record(exchange, status)
+            headers = {}
+            if retry_after is not None:
+                headers['Retry-After'] = str(math.ceil(retry_after))
+            return self._send_json(status, {'error': status}, headers)
+
+        try:
+            body = getattr(self, f'_{exchange}')(parts[1:], query)
+        except (IndexError, KeyError, ValueError):
+            self.server.record(exchange, 400)
+            return self._send_json(400, {'error': 'bad request'})
+        if body is None:
+            self.server.record(exchange, 404)
+            return self._send_json(404, {'error': 'not found'})
+        candles = len(body) if isinstance(body, list) else 0
+        self.server.record(exchange, 200, candles)
+        self._send_json(200, body)
+
+    def _binance(self, parts: list, query: dict):
+        # api/v3/exchangeInfo, api/v3/klines
+        if parts[-1] == "exchangeInfo":
+            return {
+                'symbols': [
+                    {
+                        'symbol': f'{base}{quote}T',
+                        'status': "TRADING",
+                        'baseAsset': base,
+                        'quoteAsset': f'{quote}T'
+                    } for base, quote in self.server.symbols
+                ]
+            }
+        if parts[-1] == "klines":
+            symbol = query['symbol']
+            start_mls = int(query.get('startTime', 0))
+            end_mls = int(query.get('endTime', 2**62))
+            limit = min(int(query.get('limit', 500)), BINANCE_MAX_LIMIT)
+            rows = []
+            for minute in self.server.candle_range(start_mls, end_mls, limit):
+                o, h, l, c, v = make_candle(symbol, minute)
+                mls = minute * MINUTE_MLS
+                rows.append([
+                    mls, str(o), str(h), str(l), str(c), str(v),
+                    mls + MINUTE_MLS - 1, str(v * c), 1, "0", "0", "0"
+                ])
+            return rows
+        return None
+
+    def _bitfinex(self, parts: list, query: dict):
+        # v2/conf/pub:list:pair:exchange, v2/conf/pub:list:currency,
+        #   v2/candles/trade:1m:tSYMBOL/hist, v2/candles/trade:1m:tSYMBOL/last
+        if parts[-1] == "pub:list:pair:exchange":
+            return [[f'{base}{quote}' for base, quote in self.server.symbols]]
+        if parts[-1] == "pub:list:currency":
+            return [[base for base, _ in self.server.symbols] + ["USD"]]
+        if parts[1] == "candles":
+            symbol = parts[2].split(":")[-1][1:]
+            if parts[3] == "last":
+                now_mls = int(time.time()) // 60 * MINUTE_MLS
+                o, h, l, c, v = make_candle(symbol, now_mls // MINUTE_MLS)
+                return [now_mls, o, c, h, l, v]
+            start_mls = int(query.get('start', 0))
+            end_mls = int(query.get('end', 2**62))
+            limit = min(int(query.get('limit', 100)), BITFINEX_MAX_LIMIT)
+            rows = []
+            for minute in self.server.candle_range(start_mls, end_mls, limit):
+                o, h, l, c, v = make_candle(symbol, minute)
+                rows.append([minute * MINUTE_MLS, o, c, h, l, v])
+            if query.get('sort') != "1":
+                rows.reverse()
+            return rows
+        return None
+
+    def _bittrex(self, parts: list, query: dict):
+        # v3/markets, v3/markets/SYMBOL/candles/MINUTE_1/historical/Y/M/D,
+        #   v3/markets/SYMBOL/candles/MINUTE_1/recent
+        if parts[-1] == "markets":
+            return [
+                {
+                    'symbol': f'{base}-{quote}',
+                    'baseCurrencySymbol': base,
+                    'quoteCurrencySymbol': quote,
+                    'status': "ONLINE"
+                } for base, quote in self.server.symbols
+            ]
+        if parts[3] == "candles" and parts[4] == "MINUTE_1":
+            symbol = parts[2]
+            if parts[5] == "recent":
+                end_mls = int(time.time()) * 1000
+                start_mls = end_mls - 1440 * MINUTE_MLS
+            else:
+                day = datetime.datetime(
+                    int(parts[6]), int(parts[7]), int(parts[8]),
+                    tzinfo=datetime.timezone.utc
+                )
+                start_mls = int(day.timestamp()) * 1000
+                end_mls = start_mls + 1439 * MINUTE_MLS
+            rows = []
+            for minute in self.server.candle_range(start_mls, end_mls, 1440):
+                o, h, l, c, v = make_candle(symbol, minute)
+                starts_at = datetime.datetime.fromtimestamp(
+                    minute * 60, datetime.timezone.utc)
+                rows.append({
+                    'startsAt': starts_at.strftime(BITTREX_DATETIME_STR),
+                    'open': str(o), 'high': str(h), 'low': str(l),
+                    'close': str(c), 'volume': str(v),
+                    'quoteVolume': str(v * c)
+                })
+            return rows
+        return None
+
+
+def run_server(host: str = MOCK_HOST, port: int = MOCK_PORT, **kwargs) -> None:
+    '''
+    Runs a mock exchange server forever
+
+    :params:
+        `host`: string
+        `port`: int
+        `kwargs`: see `MockExchangeServer`
+    '''
+
+    with MockExchangeServer((host, port), **kwargs) as server:
+        server.serve_forever()
+
+def start_server_process(
+        host: str = MOCK_HOST, port: int = MOCK_PORT, **kwargs
+    ) -> multiprocessing.Process:
+    '''
+    Starts a mock exchange server in a separate (daemon) process,
+        so it does not take CPU time away from the benchmarked process
+
+    :params:
+        `host`: string
+        `port`: int
+        `kwargs`: see `MockExchangeServer`
+    '''
+
+    process = multiprocessing.Process(
+        target=run_server, args=(host, port), kwargs=kwargs, daemon=True
+    )
+    process.start()
+    return process
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m scripts.benchmark.mock_exchange",
+        description="Runs a mock exchange server for Binance, Bitfinex and Bittrex"
+    )
+    arg_parser.add_argument('--host', type=str, default=MOCK_HOST)
+    arg_parser.add_argument('--port', type=int, default=MOCK_PORT)
+    arg_parser.add_argument(
+        '--symbols', type=int, default=100, help='number of symbols per exchange')
+    arg_parser.add_argument(
+        '--history_days', type=int, default=30, help='days of history available')
+    arg_parser.add_argument(
+        '--latency', type=float, default=0.05, help='seconds added to each response')
+    arg_parser.add_argument(
+        '--jitter', type=float, default=0.02, help='max random seconds added to latency')
+    arg_parser.add_argument(
+        '--rate_limit', type=int,
+        help=f'requests per {RATE_LIMIT_WINDOW_SECS} secs for all exchanges; defaults to {DEFAULT_RATE_LIMITS}')
+    arg_parser.add_argument(
+        '--error_rate', type=float, default=0.0, help='ratio of requests answered with 500')
+    args = arg_parser.parse_args()
+
+    run_server(
+        args.host,
+        args.port,
+        num_symbols=args.symbols,
+        history_days=args.history_days,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limits={
+            exchange: args.rate_limit for exchange in EXCHANGES
+        } if args.rate_limit else None,
+        error_rate=args.error_rate
+    )
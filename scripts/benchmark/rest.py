@@ -0,0 +1,260 @@
+# This module benchmarks a REST fetcher against the local mock exchange server
+#
+# Needs the same Redis and PSQL as the fetchers;
+#   use a development stack, not production
+#
+# Reports:
+#   - requests/s and rows/s
+#   - CPU time of the fetcher process per row
+#   - queue latency: time params wait in the Redis to-fetch queue
+#       between being fed and being consumed
+#
+# example:
+#   python -m scripts.benchmark.rest --exchange binance --symbols 20 --days 3 --clear_queue
+
+import argparse
+import datetime
+import json
+import statistics
+import time
+
+import httpx
+
+from common.config.constants import OHLCVS_TABLE
+from fetchers.helpers import sink
+from fetchers.rest import base, binance, bitfinex, bittrex
+from scripts.benchmark.mock_exchange import \
+    EXCHANGES, MOCK_HOST, MOCK_PORT, start_server_process
+
+
+FETCHER_MODULES = {
+    'binance': binance,
+    'bitfinex': bitfinex,
+    'bittrex': bittrex
+}
+FETCHER_CLASSES = {
+    'binance': binance.BinanceOHLCVFetcher,
+    'bitfinex': bitfinex.BitfinexOHLCVFetcher,
+    'bittrex': bittrex.BittrexOHLCVFetcher
+}
+SERVER_READY_TIMEOUT_SECS = 10
+
+
+def patch_urls(exchange: str, url: str) -> None:
+    '''
+    Points the module-level API urls of the fetcher of `exchange`
+        to the mock exchange server at `url`
+
+    :params:
+        `exchange`: string
+        `url`: string - base url of the mock exchange server
+    '''
+
+    module = FETCHER_MODULES[exchange]
+    if exchange == "binance":
+        for name in ("BASE_URL", "BASE_URL_1", "BASE_URL_2", "BASE_URL_3"):
+            setattr(module, name, f'{url}/binance/api/v3')
+    elif exchange == "bitfinex":
+        module.BASE_CANDLE_URL = f'{url}/bitfinex/v2/candles'
+        module.PAIR_EXCHANGE_URL = f'{url}/bitfinex/v2/conf/pub:list:pair:exchange'
+        module.LIST_CURRENCY_URL = f'{url}/bitfinex/v2/conf/pub:list:currency'
+    elif exchange == "bittrex":
+        module.BASE_URL = f'{url}/bittrex/v3'
+        module.MARKET_URL = f'{url}/bittrex/v3/markets'
+
+def patch_insert(exchange: str, counter: dict, no_insert: bool) -> None:
+    '''
+    Wraps `psql_bulk_insert` of the REST fetchers to count inserted
+        OHLCV rows in `counter['rows']`
+
+    :params:
+        `exchange`: string
+        `counter`: dict
+        `no_insert`: bool - whether to skip inserting into PSQL
+    '''
+
+    psql_bulk_insert = base.psql_bulk_insert
+
+    def counted_psql_bulk_insert(conn, rows, table, *args, **kwargs):
+        if table == OHLCVS_TABLE:
+            counter['rows'] += len(rows)
+        if no_insert:
+            return True
+        return psql_bulk_insert(conn, rows, table, *args, **kwargs)
+
+    # OHLCVs are inserted by the base fetcher (or its parallel sink),
+    #   errors by the exchange module
+    base.psql_bulk_insert = counted_psql_bulk_insert
+    sink.psql_bulk_insert = counted_psql_bulk_insert
+    FETCHER_MODULES[exchange].psql_bulk_insert = counted_psql_bulk_insert
+
+def patch_queue_latency(fetcher, latencies: list) -> None:
+    '''
+    Wraps `_get_and_parse_ohlcv` of `fetcher` to record queue latencies;
+        Params fed initially are timed from the start of the run,
+        new params from when the previous params returned them
+
+    :params:
+        `fetcher`: REST fetcher
+        `latencies`: list to append latencies (secs) to
+    '''
+
+    get_and_parse_ohlcv = fetcher._get_and_parse_ohlcv
+    fed_at = {}
+    run_start = time.perf_counter()
+
+    async def timed_get_and_parse_ohlcv(params, *args, **kwargs):
+        latencies.append(time.perf_counter() - fed_at.pop(params, run_start))
+        new_params = await get_and_parse_ohlcv(params, *args, **kwargs)
+        if new_params is not None:
+            fed_at[new_params] = time.perf_counter()
+        return new_params
+
+    fetcher._get_and_parse_ohlcv = timed_get_and_parse_ohlcv
+
+def wait_server(url: str) -> dict:
+    '''
+    Waits until the mock exchange server at `url` is ready;
+        Returns its stats
+    '''
+
+    deadline = time.monotonic() + SERVER_READY_TIMEOUT_SECS
+    while True:
+        try:
+            return httpx.get(f'{url}/_stats').json()
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+def percentile(values: list, p: float) -> float:
+    '''
+    Returns the `p`-th percentile (0-100) of `values`
+    '''
+
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    '''
+    Runs the benchmark; Returns a dict of results
+    '''
+
+    url = args.url
+    if url is None:
+        start_server_process(
+            MOCK_HOST, args.port,
+            num_symbols=args.symbols,
+            history_days=args.days + 1,
+            latency=args.latency,
+            jitter=args.jitter,
+            rate_limits={
+                exchange: args.server_rate_limit for exchange in EXCHANGES
+            } if args.server_rate_limit else None,
+            error_rate=args.error_rate
+        )
+        url = f'http://{MOCK_HOST}:{args.port}'
+    stats_before = wait_server(url)[args.exchange]
+
+    counter = {'rows': 0}
+    latencies = []
+    patch_urls(args.exchange, url)
+    patch_insert(args.exchange, counter, args.no_insert)
+    fetcher = FETCHER_CLASSES[args.exchange]()
+    if args.sink_connections:
+        fetcher.use_parallel_sink(args.sink_connections)
+
+    # Make sure only params of this run are in the queue
+    queue_keys = list(fetcher.tofetch_keys.values()) + [fetcher.fetching_key]
+    if args.clear_queue:
+        fetcher.redis_client.delete(*queue_keys)
+    elif fetcher._count_tofetch_redis() > 0:
+        raise RuntimeError(
+            f"To-fetch queue of {args.exchange} is not empty; use --clear_queue")
+
+    # Client-side rate limit override
+    if args.hits_per_min:
+        fetcher.rate_limiter.period = 60 / args.hits_per_min
+        fetcher.rate_limiter.increment = 60 / args.hits_per_min
+        if hasattr(fetcher, 'rw_manager'):
+            fetcher.rw_manager.full_weight_limit = args.hits_per_min
+
+    symbols = sorted(fetcher.symbol_data)[:args.symbols]
+    end = datetime.datetime.now().replace(second=0, microsecond=0) \
+        - datetime.timedelta(minutes=1)
+    start = end - datetime.timedelta(days=args.days)
+    patch_queue_latency(fetcher, latencies)
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    fetcher.run_fetch_ohlcvs(symbols, start, end)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    fetcher.close_connections()
+
+    stats_after = wait_server(url)[args.exchange]
+    requests = stats_after['requests'] - stats_before['requests']
+    statuses = {
+        status: count - stats_before['statuses'].get(status, 0)
+        for status, count in stats_after['statuses'].items()
+    }
+    rows = counter['rows']
+    return {
+        'exchange': args.exchange,
+        'symbols': len(symbols),
+        'sink_connections': args.sink_connections,
+        'wall_secs': round(wall, 3),
+        'cpu_secs': round(cpu, 3),
+        'requests': requests,
+        'statuses': statuses,
+        'rows': rows,
+        'requests_per_sec': round(requests / wall, 2),
+        'rows_per_sec': round(rows / wall, 2),
+        'cpu_usecs_per_row': round(cpu / rows * 1e6, 2) if rows else None,
+        'queue_latency_secs': {
+            'mean': round(statistics.mean(latencies), 3) if latencies else 0.0,
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'max': round(max(latencies, default=0.0), 3)
+        }
+    }
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m scripts.benchmark.rest",
+        description="Benchmarks a REST fetcher against a local mock exchange server"
+    )
+    arg_parser.add_argument(
+        '--exchange', type=str, required=True, choices=EXCHANGES)
+    arg_parser.add_argument(
+        '--symbols', type=int, default=20, help='number of symbols to fetch')
+    arg_parser.add_argument(
+        '--days', type=int, default=3, help='days of history to fetch')
+    arg_parser.add_argument(
+        '--url', type=str,
+        help='url of a running mock exchange server; one is started if not provided')
+    arg_parser.add_argument('--port', type=int, default=MOCK_PORT)
+    arg_parser.add_argument(
+        '--latency', type=float, default=0.05, help='mock server latency (secs)')
+    arg_parser.add_argument(
+        '--jitter', type=float, default=0.02, help='mock server latency jitter (secs)')
+    arg_parser.add_argument(
+        '--server_rate_limit', type=int, help='mock server requests per minute')
+    arg_parser.add_argument(
+        '--error_rate', type=float, default=0.0, help='mock server ratio of 500 responses')
+    arg_parser.add_argument(
+        '--hits_per_min', type=int, help='override the fetcher client-side rate limit')
+    arg_parser.add_argument(
+        '--no_insert', action='store_true', help='skip inserting into PSQL')
+    arg_parser.add_argument(
+        '--sink_connections', type=int,
+        help='insert through a parallel sink of this many PSQL connections')
+    arg_parser.add_argument(
+        '--clear_queue', action='store_true',
+        help='clear the to-fetch queue of the exchange before running')
+    args = arg_parser.parse_args()
+
+    print(json.dumps(run_benchmark(args), indent=4))
@@ -0,0 +1,273 @@
+# This module replays raw WS frames recorded by a WS fetcher
+#   (`--record_dir`, see `WSFrameRecorder`) through the parse-and-store
+#   pipeline of the WS fetcher of the exchange
+#
+# Needs Redis and, with --direct_insert, a TimescaleDB with the ohlcvs table;
+#   use a development stack, not production: candles of the recording
+#   are written to its serve and sub keys (or ohlcvs table) and published
+#
+# Frames are fed at their recorded pace times `--speed` (e.g., 1 for
+#   real time, 10 for ten times faster) or, with `--speed 0`, as fast
+#   as possible; The coalescer is flushed every `WS_FLUSH_TICK_SECS`
+#   of recorded time, like in the fetcher
+#
+# Reports messages/s and latency of each stage:
+#   - parse: parsing a frame and recording its candle in the coalescer
+#   - flush: writing the coalesced candles to Redis in one pipeline
+#   - insert: inserting closed candles into PSQL (with --direct_insert)
+#   and, with --trace_allocations, the peak traced memory and the sites
+#   holding the most memory allocated during the replay (tracemalloc
+#   slows everything down; compare timings with a run without it)
+#
+# example:
+#   python -m scripts.benchmark.ws_replay binance /data/ws/binance --speed 0
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List
+
+from fetchers.config.constants import WS_BATCH_MAX_MESSAGES
+from fetchers.helpers.ws import WSShard, read_frame_segment
+from fetchers.utils.exceptions import UnsuccessfulConnection
+from fetchers.ws.bitfinex import MAX_SUB_PER_CONN
+from fetchers.ws.supervisor import WS_FETCHER_CLASSES
+
+
+STAGES = ("parse", "flush", "insert")
+
+
+def list_segments(exchange: str, paths: List[str]) -> List[str]:
+    '''
+    Returns the segment files of `exchange` in `paths`, in recording order
+
+    :params:
+        `exchange`: string - exchange name
+        `paths`: list of segment files or directories of segment files
+    '''
+
+    segments = []
+    for path in paths:
+        if os.path.isdir(path):
+            segments.extend(
+                glob.glob(os.path.join(path, f"{exchange}-*.jsonl.gz")))
+        else:
+            segments.append(path)
+    return sorted(segments)
+
+def summarize(secs: List[float]) -> dict:
+    '''
+    Returns the count and mean, p50, p99 and max (in microseconds)
+        of the durations `secs`
+    '''
+
+    if not secs:
+        return {'count': 0}
+    secs = sorted(secs)
+
+    def micros(value: float) -> float:
+        return round(value * 1e6, 2)
+
+    return {
+        'count': len(secs),
+        'mean_us': micros(sum(secs) / len(secs)),
+        'p50_us': micros(secs[(len(secs) - 1) // 2]),
+        'p99_us': micros(secs[min(len(secs) - 1, int(len(secs) * 0.99))]),
+        'max_us': micros(secs[-1])
+    }
+
+def make_handler(fetcher: Any, exchange: str) -> Callable[[int, Any], Awaitable]:
+    '''
+    Returns a coroutine function handling a recorded frame of
+        a connection with the frame handler of `fetcher`
+
+    :params:
+        `fetcher`: WS fetcher obj
+        `exchange`: string - exchange name
+    '''
+
+    if exchange == "binance":
+        async def handle(connection: int, frame: Any) -> None:
+            fetcher.handle_frame(frame)
+    elif exchange == "bitfinex":
+        # Channel mappings of each connection, as in `subscribe`
+        connections = {}
+
+        async def handle(connection: int, frame: Any) -> None:
+            if connection not in connections:
+                connections[connection] = \
+                    (WSShard(connection, MAX_SUB_PER_CONN), {}, {})
+            fetcher.handle_frame(frame, *connections[connection])
+    else:
+        async def handle(connection: int, frame: Any) -> None:
+            await fetcher.on_candle(frame)
+    return handle
+
+def load_header(fetcher: Any, header: dict) -> None:
+    '''
+    Loads the symbol data recorded in a segment header into `fetcher`
+    '''
+
+    fetcher.rest_fetcher.symbol_data.update(header.get('symbol_data') or {})
+    if hasattr(fetcher, 'make_ws_symbol'):
+        for symbol in fetcher.rest_fetcher.symbol_data:
+            fetcher.make_ws_symbol(symbol)
+
+async def replay(
+        fetcher: Any,
+        handle: Callable[[int, Any], Awaitable],
+        segments: List[str],
+        speed: float,
+        stages: Dict[str, List[float]]
+    ) -> dict:
+    '''
+    Feeds the frames of `segments` to `handle` at `speed`, flushing
+        the coalescer of `fetcher` on ticks of recorded time;
+        Durations of each stage are appended to `stages`;
+        Returns a dict of counts
+
+    :params:
+        `fetcher`: WS fetcher obj
+        `handle`: coroutine function returned by `make_handler`
+        `segments`: list of segment files
+        `speed`: float - pace relative to the recording; 0 for max speed
+        `stages`: dict of stage to list of durations in seconds
+    '''
+
+    coalescer = fetcher.coalescer
+    counts = {'messages': 0, 'errors': 0, 'candles_written': 0, 'recorded_secs': 0.0}
+
+    def flush() -> None:
+        start = time.perf_counter()
+        counts['candles_written'] += coalescer.flush()
+        stages['flush'].append(time.perf_counter() - start)
+        if coalescer.sink is not None:
+            pending = set(coalescer.insert_tasks)
+            start = time.perf_counter()
+            coalescer.flush_closed()
+            for task in coalescer.insert_tasks - pending:
+                task.add_done_callback(
+                    lambda _, start=start:
+                        stages['insert'].append(time.perf_counter() - start)
+                )
+
+    first_recv = next_flush = None
+    started = time.perf_counter()
+    for path in segments:
+        header, frames = read_frame_segment(path)
+        load_header(fetcher, header)
+        for recv_time, connection, frame in frames:
+            if first_recv is None:
+                first_recv = recv_time
+                next_flush = recv_time + coalescer.tick_secs
+            if recv_time >= next_flush:
+                flush()
+                ticks = int((recv_time - next_flush) // coalescer.tick_secs) + 1
+                next_flush += ticks * coalescer.tick_secs
+
+            if speed > 0:
+                delay = started + (recv_time - first_recv) / speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif counts['messages'] % WS_BATCH_MAX_MESSAGES == 0:
+                # Yield the event loop once per batch, like the fetcher
+                await asyncio.sleep(0)
+
+            start = time.perf_counter()
+            try:
+                await handle(connection, frame)
+            except UnsuccessfulConnection:
+                counts['errors'] += 1
+            stages['parse'].append(time.perf_counter() - start)
+            counts['messages'] += 1
+            counts['recorded_secs'] = recv_time - first_recv
+
+    flush()
+    if coalescer.insert_tasks:
+        await asyncio.gather(*coalescer.insert_tasks)
+    counts['recorded_secs'] = round(counts['recorded_secs'], 3)
+    return counts
+
+def run_replay(args: argparse.Namespace) -> dict:
+    '''
+    Runs the replay; Returns a dict of results
+    '''
+
+    segments = list_segments(args.exchange, args.paths)
+    if not segments:
+        raise ValueError(f"No {args.exchange} segments found in {args.paths}")
+    fetcher = WS_FETCHER_CLASSES[args.exchange](
+        log_to_stream=True, direct_insert=args.direct_insert)
+    handle = make_handler(fetcher, args.exchange)
+    stages = {stage: [] for stage in STAGES}
+
+    if args.trace_allocations:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    try:
+        counts = asyncio.run(
+            replay(fetcher, handle, segments, args.speed, stages))
+    finally:
+        fetcher.rest_fetcher.close_connections()
+        if fetcher.sink is not None:
+            fetcher.sink.close()
+    elapsed = time.perf_counter() - start
+
+    results = {
+        'exchange': args.exchange,
+        'segments': len(segments),
+        'speed': args.speed,
+        **counts,
+        'elapsed_secs': round(elapsed, 3),
+        'messages_per_sec': round(counts['messages'] / elapsed, 2),
+        'stages': {stage: summarize(secs) for stage, secs in stages.items()}
+    }
+    if args.trace_allocations:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results['allocations'] = {
+            'peak_kib': round(peak / 1024, 2),
+            'top': [
+                {
+                    'site': str(stat.traceback),
+                    'size_kib': round(stat.size_diff / 1024, 2),
+                    'count': stat.count_diff
+                }
+                for stat in after.compare_to(before, 'lineno')[:args.top]
+            ]
+        }
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m scripts.benchmark.ws_replay",
+        description="Replays recorded WS frames through the WS fetcher pipeline"
+    )
+    arg_parser.add_argument(
+        'exchange', type=str, choices=list(WS_FETCHER_CLASSES),
+        help='exchange of the recording')
+    arg_parser.add_argument(
+        'paths', type=str, nargs='+',
+        help='segment files or directories of segment files')
+    arg_parser.add_argument(
+        '--speed', type=float, default=0,
+        help='pace relative to the recording (e.g., 1 or 10); 0 for max speed')
+    arg_parser.add_argument(
+        '--direct_insert', action='store_true',
+        help='insert closed candles into db directly, like the fetcher option')
+    arg_parser.add_argument(
+        '--trace_allocations', action='store_true',
+        help='trace memory allocations with tracemalloc')
+    arg_parser.add_argument(
+        '--top', type=int, default=10,
+        help='allocation sites to report with --trace_allocations')
+    args = arg_parser.parse_args()
+
+    print(json.dumps(run_replay(args), indent=4))
@@ -38,7 +38,10 @@ CREATE TABLE IF NOT EXISTS ohlcvs_errors (
    ohlcv_section VARCHAR(30),
    resp_status_code SMALLINT,
    exception_class TEXT NOT NULL,
-   exception_message TEXT
+   exception_message TEXT,
+   retries SMALLINT NOT NULL DEFAULT 0,
+   last_retry_at TIMESTAMPTZ,
+   resolved BOOLEAN NOT NULL DEFAULT FALSE
 );
 
 CREATE TABLE IF NOT EXISTS test (
@@ -82,6 +85,8 @@ CREATE INDEX IF NOT EXISTS symexch_exch_idx ON symbol_exchange (exchange);
 CREATE INDEX IF NOT EXISTS symexch_base_idx ON symbol_exchange (base_id);
 CREATE INDEX IF NOT EXISTS symexch_quote_idx ON symbol_exchange (quote_id);
 
+CREATE INDEX IF NOT EXISTS ohlcvs_errors_unresolved_idx ON ohlcvs_errors (exchange, symbol, start_date) WHERE NOT resolved;
+
 
 -- Create timescaledb hypertable
 SELECT create_hypertable('ohlcvs', 'time');
@@ -0,0 +1,9 @@
+-- Adds retry columns to an existing ohlcvs_errors table
+-- Only needed for databases created before failed windows were retried
+
+ALTER TABLE ohlcvs_errors
+   ADD COLUMN IF NOT EXISTS retries SMALLINT NOT NULL DEFAULT 0,
+   ADD COLUMN IF NOT EXISTS last_retry_at TIMESTAMPTZ,
+   ADD COLUMN IF NOT EXISTS resolved BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE INDEX IF NOT EXISTS ohlcvs_errors_unresolved_idx ON ohlcvs_errors (exchange, symbol, start_date) WHERE NOT resolved;
@@ -0,0 +1,117 @@
+# This module imports OHLCV archive files (zipped CSVs of candles,
+#   e.g., monthly or daily klines from data.binance.vision) into PSQL
+#
+# Files are decompressed, parsed and copied into PSQL by a pool of
+#   worker processes, one PSQL connection each
+#
+# example:
+#   python -m scripts.fetchers.archive --exchange binance --workers 8 ./archives/binance
+
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import psycopg2
+
+from common.config.constants import DBCONNECTION
+from fetchers.config.queries import SYMBOLS_BASEQUOTE_EXCHANGE_QUERY
+from fetchers.helpers.archive import ArchiveImporter
+
+
+# Importer of each worker process
+importer = None
+
+
+def init_worker(exchange: str, symbols: dict, update: bool) -> None:
+    '''
+    Initializes the importer of a worker process
+    '''
+
+    global importer
+    importer = ArchiveImporter(exchange, symbols, update)
+
+def import_file(path: str, symbol: str=None) -> tuple:
+    '''
+    Imports an archive file in a worker process
+    '''
+
+    return importer.import_file(path, symbol)
+
+def list_archives(paths: list) -> list:
+    '''
+    Returns zip files in `paths`, looking into directories recursively
+    '''
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "**", "*.zip"), recursive=True))
+        else:
+            files.append(path)
+    return sorted(files)
+
+def get_symbols(exchange: str) -> dict:
+    '''
+    Returns a dict of symbol to (base_id, quote_id) of `exchange`
+        from the symbol_exchange table
+    '''
+
+    conn = psycopg2.connect(DBCONNECTION)
+    with conn.cursor() as cursor:
+        cursor.execute(SYMBOLS_BASEQUOTE_EXCHANGE_QUERY, (exchange,))
+        results = cursor.fetchall()
+    conn.close()
+    return {symbol: (base_id, quote_id) for symbol, base_id, quote_id in results}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m scripts.fetchers.archive",
+        description="Imports OHLCV archive files (zipped CSVs) into PSQL"
+    )
+    arg_parser.add_argument(
+        'paths', nargs='+',
+        help='archive files or directories of them; \
+            The first six CSV columns must be open time (epoch ms or us), \
+            open, high, low, close and volume')
+    arg_parser.add_argument(
+        '--exchange', type=str, required=True, help='name of the exchange')
+    arg_parser.add_argument(
+        '--symbol', type=str,
+        help='symbol of all files; by default, file names up to the first "-"')
+    arg_parser.add_argument(
+        '--workers', type=int, default=os.cpu_count(), help='worker processes')
+    arg_parser.add_argument(
+        '--update', action='store_true', help='update existing rows')
+    args = arg_parser.parse_args()
+
+    files = list_archives(args.paths)
+    symbols = get_symbols(args.exchange)
+    print(f"Importing {len(files)} files with {args.workers} workers")
+
+    start = time.perf_counter()
+    total_read = total_inserted = failed = 0
+    with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=init_worker,
+            initargs=(args.exchange, symbols, args.update)
+        ) as executor:
+        results = executor.map(
+            import_file, files, [args.symbol] * len(files))
+        for path, read, inserted, secs, error in results:
+            total_read += read
+            total_inserted += inserted
+            if error:
+                failed += 1
+                print(f"FAILED {path}: {error}")
+            else:
+                print(f"{path}: {inserted}/{read} rows inserted in {secs:.2f}s")
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Imported {len(files) - failed}/{len(files)} files: "
+        f"{total_inserted}/{total_read} rows inserted in {elapsed:.1f}s "
+        f"({total_read / elapsed if elapsed else 0:.0f} rows/s)"
+    )
@@ -3,6 +3,7 @@
 
 import argparse
 from celery_app.celery_tasks import *
+from fetchers.rest.backfill import BackfillProgress
 
 
 # Create the parser
@@ -16,16 +17,16 @@ arg_parser.add_argument(
     'action',
     metavar='action',
     type=str,
-    choices=["fetch", "resume"],
-    help='fetch or resume'
+    choices=["fetch", "resume", "retry", "backfill", "progress"],
+    help='fetch, resume, retry (failed windows in ohlcvs_errors), \
+        backfill (fanned out across workers) or progress (of a backfill)'
 )
 
 arg_parser.add_argument(
     '--exchange',
     metavar='exchange',
     type=str,
-    required=True,
-    help='name of the exchange'
+    help='name of the exchange; Must be entered unless action is progress'
 )
 
 arg_parser.add_argument(
@@ -44,6 +45,13 @@ arg_parser.add_argument(
     # required=True,
 )
 
+arg_parser.add_argument(
+    '--backfill_id',
+    metavar='backfill_id',
+    type=str,
+    help='Id of a backfill; Must be entered if action is progress',
+)
+
 # Execute the parse_args() method
 args = arg_parser.parse_args()
 action = args.action
@@ -64,3 +72,15 @@ elif action == "resume":
         binance_resume_fetch.delay()
     elif exchange == "bittrex":
         bittrex_resume_fetch.delay()
+elif action == "retry":
+    if exchange == "bitfinex":
+        bitfinex_retry_errors.delay()
+    elif exchange == "binance":
+        binance_retry_errors.delay()
+    elif exchange == "bittrex":
+        bittrex_retry_errors.delay()
+elif action == "backfill":
+    backfill_id = backfill_ohlcvs.delay(exchange, start, end).id
+    print(f"Backfill id: {backfill_id}")
+elif action == "progress":
+    print(BackfillProgress(args.backfill_id).describe())
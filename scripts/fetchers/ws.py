@@ -3,12 +3,14 @@ from fetchers.ws.bitfinex import BitfinexOHLCVWebsocket
 from fetchers.ws.binance import BinanceOHLCVWebsocket
 from fetchers.ws.bittrex import BittrexOHLCVWebsocket
 from fetchers.ws.updater import OHLCVWebsocketUpdater
+from fetchers.ws.supervisor import WS_FETCHER_CLASSES, WSSupervisor
 
 
 # Create the parser
 arg_parser = argparse.ArgumentParser(
     prog="python -m scripts.fetchers.ws",
-    description="Starts a websocket fetcher for an exchange or an updater"
+    description="Starts a websocket fetcher for an exchange, an updater \
+        or a supervisor of both"
 )
 
 # Add the arguments
@@ -16,8 +18,9 @@ arg_parser.add_argument(
     'action',
     metavar='action',
     type=str,
-    choices=["fetch", "update"],
-    help='fetch (for an exchange) or update (collect fetched data to db)'
+    choices=["fetch", "update", "supervise"],
+    help='fetch (for an exchange), update (collect fetched data to db) \
+        or supervise (fetch for several exchanges and update in one process)'
 )
 
 arg_parser.add_argument(
@@ -34,19 +37,74 @@ arg_parser.add_argument(
     help='full path to the log filename'
 )
 
+arg_parser.add_argument(
+    '--direct_insert',
+    action='store_true',
+    help='insert closed candles into db directly instead of through the updater; \
+        Not used if action is update'
+)
+
+arg_parser.add_argument(
+    '--record_dir',
+    metavar='record_dir',
+    type=str,
+    help='directory to record raw WS frames to, for replay \
+        (see scripts.benchmark.ws_replay); Not used if action is update'
+)
+
+arg_parser.add_argument(
+    '--exchanges',
+    metavar='exchanges',
+    type=str,
+    nargs='+',
+    default=list(WS_FETCHER_CLASSES),
+    choices=list(WS_FETCHER_CLASSES),
+    help='names of the exchanges; Only used if action is supervise'
+)
+
+arg_parser.add_argument(
+    '--no_update',
+    action='store_true',
+    help='do not run the updater; Only used if action is supervise'
+)
+
+arg_parser.add_argument(
+    '--uvloop',
+    action='store_true',
+    help='run on a uvloop event loop (uvloop must be installed); \
+        Only used if action is supervise'
+)
+
 # Execute the parse_args() method
 args = arg_parser.parse_args()
 action = args.action
 exchange = args.exchange
 log_filename = args.log_filename
+direct_insert = args.direct_insert
+record_dir = args.record_dir
 if action == "fetch":
     if exchange == "bitfinex":
-        ws = BitfinexOHLCVWebsocket(log_filename=log_filename)
+        ws = BitfinexOHLCVWebsocket(
+            log_filename=log_filename, direct_insert=direct_insert,
+            record_dir=record_dir)
     elif exchange == "binance":
-        ws = BinanceOHLCVWebsocket(log_filename=log_filename)
+        ws = BinanceOHLCVWebsocket(
+            log_filename=log_filename, direct_insert=direct_insert,
+            record_dir=record_dir)
     elif exchange == "bittrex":
-        ws = BittrexOHLCVWebsocket(log_filename=log_filename)
+        ws = BittrexOHLCVWebsocket(
+            log_filename=log_filename, direct_insert=direct_insert,
+            record_dir=record_dir)
     ws.run_all()
 elif action == "update":
     ws = OHLCVWebsocketUpdater(log_filename=log_filename)
     ws.update()
+elif action == "supervise":
+    supervisor = WSSupervisor(
+        args.exchanges,
+        log_filename=log_filename,
+        direct_insert=direct_insert,
+        update=not args.no_update,
+        record_dir=record_dir
+    )
+    supervisor.run(use_uvloop=args.uvloop)
@@ -0,0 +1,31 @@
+import datetime
+import pytest
+from fetchers.rest.backfill import make_backfill_chunks
+
+
+# Tests
+@pytest.mark.beforepop
+def test_make_backfill_chunks():
+    start = datetime.datetime(2021, 1, 1)
+    end = datetime.datetime(2021, 3, 5)
+    chunks = make_backfill_chunks(
+        ['c', 'a', 'e', 'b', 'd'], start, end, 2, datetime.timedelta(days=30)
+    )
+    assert len(chunks) == 9
+    # Most recent window first, symbols sorted
+    assert chunks[0] == (['a', 'b'], datetime.datetime(2021, 3, 2), end)
+    assert chunks[2] == (['e'], datetime.datetime(2021, 3, 2), end)
+    assert chunks[-1] == (['e'], start, datetime.datetime(2021, 1, 31))
+    # Each symbol covers the whole range exactly once
+    covered = {}
+    for symbols, chunk_start, chunk_end in chunks:
+        for symbol in symbols:
+            covered[symbol] = covered.get(symbol, datetime.timedelta()) \
+                + (chunk_end - chunk_start)
+    assert covered == {symbol: end - start for symbol in 'abcde'}
+
+@pytest.mark.beforepop
+def test_make_backfill_chunks_empty():
+    start = datetime.datetime(2021, 1, 1)
+    assert make_backfill_chunks(
+        ['a'], start, start, 2, datetime.timedelta(days=30)) == []
@@ -0,0 +1,49 @@
+import datetime
+import pytest
+from common.helpers.datetimehelpers import datetime_to_milliseconds
+from fetchers.rest.binance import BinanceOHLCVFetcher
+from fetchers.utils.cache import PageCache
+
+
+# Fixtures
+@pytest.fixture
+def cache(tmp_path):
+    return PageCache(str(tmp_path), 10 ** 6)
+
+# Tests
+@pytest.mark.beforepop
+def test_normalize_url():
+    assert PageCache.normalize_url(
+        "https://api1.binance.com/api/v3/klines?symbol=ETHBTC&startTime=1&limit=1000"
+    ) == PageCache.normalize_url(
+        "https://api.binance.com/api/v3/klines?limit=1000&startTime=1&symbol=ETHBTC"
+    )
+
+@pytest.mark.beforepop
+def test_get_put(cache):
+    url = "https://api.bittrex.com/v3/markets/ETH-BTC/candles/MINUTE_1/historical/2019/1/1"
+    assert cache.get(url) is None
+    cache.put(url, b'[{"open": "1.0"}]')
+    assert cache.get(url) == b'[{"open": "1.0"}]'
+
+@pytest.mark.beforepop
+def test_evict(tmp_path):
+    cache = PageCache(str(tmp_path), 2000)
+    for i in range(20):
+        cache.put(f"https://example.com/page?i={i}", bytes(range(256)) * (i + 1))
+    assert cache.size <= 2000
+    assert cache.get("https://example.com/page?i=19") is not None
+    assert cache.get("https://example.com/page?i=0") is None
+
+@pytest.mark.beforepop
+def test_binance_immutable_page():
+    fetcher = BinanceOHLCVFetcher.__new__(BinanceOHLCVFetcher)
+    now_mls = datetime_to_milliseconds(datetime.datetime.now())
+    start_mls = now_mls - 30 * 86400 * 1000
+    url = f"https://api.binance.com/api/v3/klines?symbol=ETHBTC&interval=1m&startTime={start_mls}&limit=1000"
+    assert fetcher._is_immutable_page(url)
+    assert fetcher._is_immutable_page(url, [[start_mls + 60000 * i] for i in range(1000)])
+    # A symbol listed after `startTime`: the page ends recently
+    assert not fetcher._is_immutable_page(url, [[now_mls - 60000 * i] for i in range(1000, 0, -1)])
+    assert not fetcher._is_immutable_page(url, [])
+    assert not fetcher._is_immutable_page(url.replace("interval=1m", "interval=1h"))
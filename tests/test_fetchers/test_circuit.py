@@ -0,0 +1,147 @@
+import logging
+import pytest
+from fetchers.rest.base import BaseOHLCVFetcher
+from fetchers.utils.circuit import \
+    CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, SymbolCircuitBreaker
+
+
+class FakePipeline:
+    '''
+    Redis pipeline recording the hashes to get
+    '''
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.names = []
+
+    def hgetall(self, name):
+        self.names.append(name)
+
+    def execute(self):
+        return [dict(self.redis_client.hashes.get(name, {})) for name in self.names]
+
+
+class FakeRedis:
+    '''
+    Redis client with the hash and key commands of circuit breakers
+    '''
+
+    def __init__(self):
+        self.hashes = {}
+        self.keys = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def hset(self, name, key, value):
+        self.hashes.setdefault(name, {})[key] = str(value)
+
+    def hdel(self, name, key):
+        return int(self.hashes.get(name, {}).pop(key, None) is not None)
+
+    def hincrby(self, name, key, amount):
+        value = int(self.hashes.get(name, {}).get(key, 0)) + amount
+        self.hset(name, key, value)
+        return value
+
+    def set(self, name, value, nx=False, px=None):
+        if nx and name in self.keys:
+            return None
+        self.keys[name] = value
+        return True
+
+
+def age(breaker, symbol, secs):
+    '''
+    Moves the open time of the circuit of `symbol` `secs` back
+    '''
+
+    opened = breaker.redis_client.hashes[breaker.opened_key]
+    opened[symbol] = str(float(opened[symbol]) - secs)
+
+
+# Fixtures
+@pytest.fixture
+def breaker():
+    return SymbolCircuitBreaker(FakeRedis(), 'test', threshold=3, open_secs=60)
+
+@pytest.fixture
+def fetcher(breaker):
+    fetcher = BaseOHLCVFetcher.__new__(BaseOHLCVFetcher)
+    fetcher.logger = logging.getLogger('test_circuit')
+    fetcher.circuit_breaker = breaker
+    fetcher.open_circuits = set()
+    fetcher.probing = set()
+    return fetcher
+
+# Tests
+@pytest.mark.beforepop
+def test_state(breaker):
+    assert breaker._state(0, 0, 1000) == CIRCUIT_CLOSED
+    assert breaker._state(2, 0, 1000) == CIRCUIT_CLOSED
+    assert breaker._state(3, 990, 1000) == CIRCUIT_OPEN
+    assert breaker._state(7, 990, 1000) == CIRCUIT_OPEN
+    assert breaker._state(3, 900, 1000) == CIRCUIT_HALF_OPEN
+
+@pytest.mark.beforepop
+def test_transitions(breaker):
+    assert breaker.record('ETHBTC', True) == CIRCUIT_CLOSED
+    assert breaker.record('ETHBTC', True) == CIRCUIT_CLOSED
+    assert breaker.record('ETHBTC', True) == CIRCUIT_OPEN
+    assert breaker.states() == {'ETHBTC': CIRCUIT_OPEN}
+
+    # A failed probe opens the circuit again
+    age(breaker, 'ETHBTC', 61)
+    assert breaker.states() == {'ETHBTC': CIRCUIT_HALF_OPEN}
+    assert breaker.record('ETHBTC', True) == CIRCUIT_OPEN
+    assert breaker.states() == {'ETHBTC': CIRCUIT_OPEN}
+
+    # A successful probe closes it
+    age(breaker, 'ETHBTC', 61)
+    assert breaker.states() == {'ETHBTC': CIRCUIT_HALF_OPEN}
+    assert breaker.record('ETHBTC', False) == CIRCUIT_CLOSED
+    assert breaker.states() == {}
+
+@pytest.mark.beforepop
+def test_claim_probe(breaker):
+    for _ in range(3):
+        breaker.record('ETHBTC', True)
+    age(breaker, 'ETHBTC', 61)
+    assert breaker.claim_probe('ETHBTC')
+    assert not breaker.claim_probe('ETHBTC')
+    # Open again while the probe runs
+    assert breaker.states() == {'ETHBTC': CIRCUIT_OPEN}
+
+@pytest.mark.beforepop
+def test_skip_open_circuits(fetcher, breaker):
+    for symbol in ('ETHBTC', 'LTCBTC'):
+        for _ in range(3):
+            breaker.record(symbol, True)
+    age(breaker, 'LTCBTC', 61)
+
+    symbols = ['BTCUSDT', 'ETHBTC', 'LTCBTC']
+    assert fetcher.skip_open_circuits(symbols, probe=False) == ['BTCUSDT']
+    assert fetcher.probing == set()
+    assert fetcher.skip_open_circuits(symbols) == ['BTCUSDT', 'LTCBTC']
+    assert fetcher.probing == {'LTCBTC'}
+    # Another fetcher does not probe it too
+    assert fetcher.skip_open_circuits(symbols) == ['BTCUSDT']
+
+@pytest.mark.beforepop
+def test_on_symbol_done(fetcher, breaker):
+    for _ in range(3):
+        fetcher._on_symbol_done('ETHBTC', 400)
+    assert fetcher.open_circuits == {'ETHBTC'}
+
+    # Rate limits and server errors are not counted
+    age(breaker, 'ETHBTC', 61)
+    fetcher.skip_open_circuits(['ETHBTC'])
+    fetcher._on_symbol_done('ETHBTC', 429)
+    fetcher._on_symbol_done('ETHBTC', 503)
+    assert fetcher.probing == {'ETHBTC'}
+
+    # Empty pages are successes
+    fetcher._on_symbol_done('ETHBTC', 200)
+    assert fetcher.probing == set()
+    assert fetcher.open_circuits == set()
+    assert breaker.states() == {}
@@ -0,0 +1,63 @@
+import time
+import pytest
+from fetchers.utils.clock import RedisClock
+
+
+class FakeRedis:
+    '''
+    Redis client whose TIME is the local clock plus `offset`
+    '''
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.calls = 0
+
+    def time(self):
+        self.calls += 1
+        secs, mics = divmod(int((time.monotonic() + self.offset) * 1_000_000), 1_000_000)
+        return (secs, mics)
+
+
+# Fixtures
+@pytest.fixture
+def redis_client():
+    return FakeRedis(1000.0)
+
+@pytest.fixture
+def clock(redis_client):
+    return RedisClock(redis_client, resync_secs=60, samples=3)
+
+# Tests
+@pytest.mark.beforepop
+def test_now(clock, redis_client):
+    assert clock.error() is None
+    assert abs(clock.now() - (time.monotonic() + 1000.0)) < 0.01
+    assert redis_client.calls == 3
+    assert 0 <= clock.error() < 0.01
+    clock.now()
+    assert redis_client.calls == 3
+
+@pytest.mark.beforepop
+def test_max_error(clock, redis_client):
+    clock.now()
+    clock.rtt = 0.01
+    clock.now(max_error=1.0)
+    assert redis_client.calls == 3
+    # A forced re-measurement takes a single sample
+    clock.synced_at -= 30
+    clock.drift_rate = 0.01
+    clock.now(max_error=0.1)
+    assert redis_client.calls == 4
+
+@pytest.mark.beforepop
+def test_max_error_floor(clock, redis_client):
+    clock.now()
+    # Bounds below the round trip cannot be met by measuring again
+    clock.rtt = 0.5
+    clock.now(max_error=0.005)
+    assert redis_client.calls == 3
+    # Drift beyond the round trip is re-measured
+    clock.synced_at -= 30
+    clock.drift_rate = 0.01
+    clock.now(max_error=0.005)
+    assert redis_client.calls == 4
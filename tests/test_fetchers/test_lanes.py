@@ -0,0 +1,33 @@
+import pytest
+from fetchers.utils.lanes import WeightedLaneScheduler
+
+
+# Fixtures
+@pytest.fixture
+def scheduler():
+    return WeightedLaneScheduler(
+        {'recent': 6, 'history': 3, 'retry': 1}, ('live',)
+    )
+
+# Tests
+@pytest.mark.beforepop
+def test_plan_live_first(scheduler):
+    sizes = {'live': 8, 'recent': 100, 'history': 100, 'retry': 100}
+    assert scheduler.plan(sizes, 5) == {'live': 5}
+    plan = scheduler.plan(sizes, 18)
+    assert plan == {'live': 8, 'recent': 6, 'history': 3, 'retry': 1}
+
+@pytest.mark.beforepop
+def test_plan_weights(scheduler):
+    sizes = {'recent': 1000, 'history': 1000, 'retry': 1000}
+    totals = {'recent': 0, 'history': 0, 'retry': 0}
+    for _ in range(10):
+        for lane, count in scheduler.plan(sizes, 7).items():
+            totals[lane] += count
+    assert totals == {'recent': 42, 'history': 21, 'retry': 7}
+
+@pytest.mark.beforepop
+def test_plan_lane_sizes(scheduler):
+    sizes = {'live': 1, 'recent': 2, 'history': 0, 'retry': 50}
+    assert scheduler.plan(sizes, 10) == {'live': 1, 'recent': 2, 'retry': 7}
+    assert scheduler.plan({}, 10) == {}
@@ -0,0 +1,37 @@
+import pytest
+import datetime
+from fetchers.rest.retrier import merge_windows, split_window
+
+
+# Fixtures
+@pytest.fixture
+def some_date():
+    return datetime.datetime(2021, 1, 1, 0, 0, 0)
+
+# Tests
+@pytest.mark.beforepop
+def test_merge_windows(some_date):
+    minutes = lambda m: some_date + datetime.timedelta(minutes=m)
+    windows = [
+        (minutes(10), minutes(20)),
+        (minutes(0), minutes(5)),
+        (minutes(5), minutes(8)),
+        (minutes(21), minutes(30)),
+        (minutes(40), minutes(50))
+    ]
+    assert merge_windows(windows) == [
+        (minutes(0), minutes(8)),
+        (minutes(10), minutes(30)),
+        (minutes(40), minutes(50))
+    ]
+    assert merge_windows([]) == []
+
+@pytest.mark.beforepop
+def test_split_window(some_date):
+    span = datetime.timedelta(days=1)
+    end = some_date + datetime.timedelta(days=2, hours=12)
+    windows = split_window(some_date, end, span)
+    assert len(windows) == 3
+    assert windows[0] == (some_date, some_date + span)
+    assert windows[-1] == (some_date + 2 * span, end)
+    assert split_window(some_date, some_date, span) == []
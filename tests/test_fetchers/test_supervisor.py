@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+from fetchers.ws import supervisor as supervisor_module
+from fetchers.ws.supervisor import WSSupervisor
+
+
+class FakeConnection:
+    def __init__(self):
+        self.autocommit = False
+        self.closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.mark.beforepop
+def test_supervisor_restarts_tasks(monkeypatch):
+    monkeypatch.setattr(supervisor_module, 'WS_SUPERVISOR_RESTART_MIN_SECS', 0)
+    supervisor = WSSupervisor([], log_to_stream=True, update=False)
+    runs = []
+
+    async def run():
+        runs.append(1)
+        if len(runs) < 3:
+            raise RuntimeError(f"failure {len(runs)}")
+        await asyncio.sleep(3600)
+
+    async def supervise():
+        task = asyncio.create_task(supervisor.supervise('flaky', run))
+        while len(runs) < 3:
+            await asyncio.sleep(0.01)
+        health = supervisor.health()
+        task.cancel()
+        return health
+
+    health = asyncio.run(asyncio.wait_for(supervise(), 5))
+    assert health['healthy']
+    assert health['tasks']['flaky'] == {
+        'running': True, 'restarts': 2, 'last_error': "RuntimeError('failure 2')"
+    }
+
+@pytest.mark.beforepop
+def test_supervisor_shares_psql_conn(monkeypatch):
+    connections = []
+    def connect(dsn):
+        connections.append(FakeConnection())
+        return connections[-1]
+    monkeypatch.setattr(supervisor_module.psycopg2, 'connect', connect)
+    supervisor = WSSupervisor([], log_to_stream=True, update=False)
+    assert connections == []
+
+    conn = supervisor.get_psql_conn()
+    assert conn.autocommit
+    assert supervisor.get_psql_conn() is conn
+    # A closed connection is reopened
+    conn.close()
+    assert supervisor.get_psql_conn() is not conn
+    assert len(connections) == 2
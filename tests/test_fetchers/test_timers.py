@@ -0,0 +1,35 @@
+import pytest
+from fetchers.utils.timers import STAGES, StageTimer
+
+
+# Fixtures
+@pytest.fixture
+def timer():
+    return StageTimer('test')
+
+# Tests
+@pytest.mark.beforepop
+def test_observe(timer):
+    timer.observe('wait', 0.5)
+    timer.observe('wait', 1.5)
+    timer.observe('insert', 2.0)
+    assert timer.stages['wait'] == (2, 2.0, 1.5)
+    assert timer.stages['insert'] == (1, 2.0, 2.0)
+    assert timer.stages['parse'] == (0, 0.0, 0.0)
+
+@pytest.mark.beforepop
+def test_time(timer):
+    with timer.time('parse'):
+        pass
+    count, total, _ = timer.stages['parse']
+    assert count == 1 and total >= 0.0
+
+@pytest.mark.beforepop
+def test_summary_and_reset(timer):
+    timer.observe('transfer', 3.0)
+    timer.observe('decode', 1.0)
+    summary = timer.summary()
+    assert all(stage in summary for stage in STAGES)
+    assert "share=75.0%" in summary
+    timer.reset()
+    assert all(timer.stages[stage] == (0, 0.0, 0.0) for stage in STAGES)
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+import pytest
+from fetchers.helpers.ws import WSGapFiller, WSShard
+from fetchers.rest.binance import BinanceOHLCVFetcher
+from fetchers.utils.exceptions import ConnectionClosed
+from fetchers.ws import binance as binance_module
+from fetchers.ws.binance import BinanceOHLCVWebsocket
+
+
+class FakeRedis:
+    def __init__(self):
+        self.sets = {}
+
+    def sadd(self, key, *values):
+        self.sets.setdefault(key, set()).update(values)
+
+
+class FakeWebsocket:
+    '''
+    Websocket client closed after `on_open` is called
+    '''
+
+    def __init__(self, on_open):
+        self.on_open = on_open
+
+    async def send(self, message):
+        pass
+
+    async def recv(self):
+        self.on_open()
+        raise ConnectionClosed(None, None)
+
+
+class FakeConnect:
+    '''
+    `websockets.connect` running the `on_open` of each connection
+        in turn, then failing
+    '''
+
+    def __init__(self, *on_opens):
+        self.on_opens = list(on_opens)
+        self.uris = []
+
+    def __call__(self, uri):
+        self.uris.append(uri)
+        if not self.on_opens:
+            raise RuntimeError("no more connections")
+        return self
+
+    async def __aenter__(self):
+        return FakeWebsocket(self.on_opens.pop(0))
+
+    async def __aexit__(self, *args):
+        pass
+
+
+# Tests
+@pytest.mark.beforepop
+def test_binance_fills_url_symbol_gaps(monkeypatch):
+    redis_client = FakeRedis()
+    fetcher = BinanceOHLCVWebsocket.__new__(BinanceOHLCVWebsocket)
+    fetcher.logger = logging.getLogger('test_ws_fetchers')
+    fetcher.gap_filler = WSGapFiller(BinanceOHLCVFetcher, 'binance', redis_client)
+    fetcher.recorder = None
+    fetcher.message_id = 0
+    fetcher.backoff_delay = 0
+    monkeypatch.setattr(binance_module, 'BACKOFF_MAX_SECS', 0)
+
+    # Candles last seen 10 minutes ago, then the connection drops
+    current = int(time.time() // 60) * 60000
+    def seen():
+        for symbol in ('ETHBTC', 'LTCBTC'):
+            fetcher.gap_filler.seen(symbol, current - 10 * 60000)
+    connect = FakeConnect(seen, lambda: None)
+    monkeypatch.setattr(binance_module.websockets, 'connect', connect)
+
+    shard = WSShard(0, 1024)
+    shard.symbols.update({'ETHBTC', 'LTCBTC'})
+    with pytest.raises(RuntimeError):
+        asyncio.run(asyncio.wait_for(fetcher.subscribe(shard), 5))
+
+    # Both symbols are in the URL, not in subscribe commands
+    assert all('ethbtc@kline_1m/ltcbtc@kline_1m' in uri for uri in connect.uris)
+    assert redis_client.sets == {
+        'ohlcvs_tofetch_binance_live': {
+            f'{symbol};;{current - 10 * 60000};;{current - 60000};;1m;;1000'
+            for symbol in ('ETHBTC', 'LTCBTC')
+        }
+    }
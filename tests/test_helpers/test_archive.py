@@ -0,0 +1,35 @@
+import zipfile
+import pytest
+from fetchers.helpers.archive import \
+    LinesReader, archive_symbol, parse_archive_lines, read_archive
+
+
+# Tests
+@pytest.mark.beforepop
+def test_archive_symbol():
+    assert archive_symbol("/data/BTCUSDT-1m-2021-01.zip") == "BTCUSDT"
+
+@pytest.mark.beforepop
+def test_parse_archive_lines():
+    lines = [
+        "open_time,open,high,low,close,volume,close_time\n",
+        "1609459200000,28923.63,28961.66,28913.12,28961.66,27.457,1609459259999,1,2,3,4,0\r\n",
+        "1735689600000000,93576.0,93610.93,93537.5,93610.93,8.21827,1735689659999999\n",
+        "\n"
+    ]
+    assert list(parse_archive_lines(lines)) == [
+        "1609459200000,28923.63,28961.66,28913.12,28961.66,27.457\n",
+        "1735689600000,93576.0,93610.93,93537.5,93610.93,8.21827\n"
+    ]
+
+@pytest.mark.beforepop
+def test_read_archive(tmp_path):
+    path = tmp_path / "ETHBTC-1m-2021-01-01.zip"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("ETHBTC-1m-2021-01-01.csv", "1,2,3,4,5,6\n7,8,9,10,11,12\n")
+        archive.writestr("README.txt", "not a csv\n")
+    reader = LinesReader(parse_archive_lines(read_archive(str(path))))
+    assert reader.read(5) == "1,2,3"
+    assert reader.read() == ",4,5,6\n7,8,9,10,11,12\n"
+    assert reader.read() == ""
+    assert reader.count == 2
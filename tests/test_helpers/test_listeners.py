@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from common.config.constants import REDIS_DELIMITER
+from fetchers.helpers.ws import make_candle_channel, make_candle_message
+from web.routes.api.ws.utils.listeners import CandleUpdateListener
+
+
+class FakeThread:
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+
+class FakePubSub:
+    '''
+    Pub/sub connection recording its subscriptions, read by a fake thread
+    '''
+
+    def __init__(self):
+        self.handlers = {}
+        self.thread = None
+        self.closed = False
+
+    def subscribe(self, **handlers):
+        self.handlers.update(handlers)
+
+    def run_in_thread(self, sleep_time=0, daemon=False):
+        self.thread = FakeThread()
+        return self.thread
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRedis:
+    def __init__(self):
+        self.pubsubs = []
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        self.pubsubs.append(FakePubSub())
+        return self.pubsubs[-1]
+
+
+def publish(pubsub, base_id, data=None):
+    if data is None:
+        data = make_candle_message(
+            'binance', base_id, 'usdt', 60000, 1, 2, 1, 2, 10, REDIS_DELIMITER)
+    pubsub.handlers['ws_candle_all']({'channel': 'ws_candle_all', 'data': data})
+
+# Tests
+@pytest.mark.beforepop
+def test_candle_listener():
+    redis_client = FakeRedis()
+    listener = CandleUpdateListener(redis_client)
+    channel = make_candle_channel('binance', 'btc', 'usdt', REDIS_DELIMITER)
+
+    async def listen():
+        queue = listener.subscribe(channel)
+        other = listener.subscribe(channel)
+        # Subscribed once, routed in-process by candle channel
+        assert len(redis_client.pubsubs) == 1
+        pubsub = redis_client.pubsubs[0]
+        publish(pubsub, 'btc')
+        publish(pubsub, 'eth')
+        # A malformed message does not stop the thread
+        publish(pubsub, 'btc', data='malformed')
+        await asyncio.sleep(0)
+        assert queue.qsize() == other.qsize() == 1
+        assert (await queue.get())['base_id'] == 'btc'
+
+        # A stopped thread is restarted over a new connection
+        pubsub.thread.alive = False
+        listener.unsubscribe(channel, other)
+        queue = listener.subscribe(channel)
+        assert len(redis_client.pubsubs) == 2 and pubsub.closed
+        publish(redis_client.pubsubs[1], 'btc')
+        await asyncio.sleep(0)
+        assert queue.qsize() == 1
+        listener.unsubscribe(channel, queue)
+
+    asyncio.run(listen())
+    assert len(listener.queues[channel]) == 1
@@ -0,0 +1,36 @@
+import datetime
+import pytest
+from fetchers.helpers.sink import bulk_load_sorted, sink_shard
+
+
+def make_row(minutes, base_id='btc', quote_id='usd'):
+    time = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc) \
+        + datetime.timedelta(minutes=minutes)
+    return (time, 'binance', base_id, quote_id, 1.0, 1.0, 1.0, 1.0, 1.0)
+
+# Tests
+@pytest.mark.beforepop
+def test_sink_shard():
+    # Rows of a symbol in the same time chunk share a shard
+    assert sink_shard(make_row(0), 4, 86400) == sink_shard(make_row(1439), 4, 86400)
+    # Consecutive time chunks of a symbol go to consecutive shards
+    assert sink_shard(make_row(1440), 4, 86400) == \
+        (sink_shard(make_row(0), 4, 86400) + 1) % 4
+    # Symbols are spread across shards
+    shards = {
+        sink_shard(make_row(0, base_id=f'base{i}'), 4, 86400) for i in range(20)
+    }
+    assert len(shards) > 1
+    assert all(0 <= shard < 4 for shard in shards)
+
+@pytest.mark.beforepop
+def test_bulk_load_sorted():
+    rows = [
+        make_row(1441, base_id='eth'), make_row(1, base_id='eth'),
+        make_row(1440), make_row(0, base_id='eth'), make_row(2)
+    ]
+    # Time chunks first, then primary key order within a chunk
+    assert bulk_load_sorted(rows, 86400) == [
+        make_row(2), make_row(0, base_id='eth'), make_row(1, base_id='eth'),
+        make_row(1440), make_row(1441, base_id='eth')
+    ]
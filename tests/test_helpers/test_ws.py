@@ -0,0 +1,282 @@
+import asyncio
+import os
+import pytest
+import time
+from fetchers.helpers.ws import \
+    CandleCoalescer, WSFrameRecorder, WSGapFiller, WSShardManager, \
+    iter_frame_batches, make_candle_message, parse_candle_message, \
+    read_frame_segment, run_until_first_stops
+from fetchers.rest.binance import BinanceOHLCVFetcher
+
+
+class FakeWebsocket:
+    '''
+    Websocket client with `frames` already received,
+        closed with ConnectionError after them
+    '''
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    async def recv(self):
+        if not self.frames:
+            raise ConnectionError("closed")
+        return self.frames.pop(0)
+
+
+async def collect_batches(ws, max_messages):
+    batches = []
+    with pytest.raises(ConnectionError):
+        async for frames in iter_frame_batches(ws, max_messages=max_messages):
+            batches.append(frames)
+            await asyncio.sleep(0)
+    return batches
+
+# Tests
+@pytest.mark.beforepop
+def test_iter_frame_batches():
+    frames = [str(i) for i in range(25)]
+    batches = asyncio.run(collect_batches(FakeWebsocket(frames), 10))
+    assert [frame for batch in batches for frame in batch] == frames
+    assert all(0 < len(batch) <= 10 for batch in batches)
+    assert len(batches) < len(frames)
+
+
+@pytest.mark.beforepop
+def test_run_until_first_stops():
+    cancelled = []
+
+    async def forever():
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise ConnectionError("closed")
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await run_until_first_stops(forever(), failing())
+        # No task outlives the call
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(run()) == []
+    assert cancelled == [1]
+
+
+class FakePipeline:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.executed = 0
+
+    def execute(self):
+        self.executed += 1
+        if self.fail:
+            raise ConnectionError("down")
+
+
+class FakeWriter:
+    '''
+    WSCandleWriter recording written candles instead of running its script
+    '''
+
+    exchange_name = 'test'
+
+    def __init__(self, fail=False):
+        self.pipe = FakePipeline(fail)
+        self.redis_client = self
+        self.written = []
+
+    def pipeline(self, transaction=True):
+        return self.pipe
+
+    def write(self, base_id, quote_id, timestamp, *ohlcv, client=None):
+        assert client is self.pipe
+        self.written.append((base_id, quote_id, timestamp) + ohlcv)
+
+
+@pytest.mark.beforepop
+def test_candle_coalescer():
+    writer = FakeWriter()
+    coalescer = CandleCoalescer(writer, tick_secs=0.25)
+    assert coalescer.flush() == 0
+    for close in (1, 2, 3):
+        coalescer.add('btc', 'usd', 60000, 1, 3, 1, close, 10)
+    coalescer.add('btc', 'usd', 120000, 3, 3, 3, 3, 1)
+    coalescer.add('eth', 'usd', 60000, 1, 1, 1, 1, 1)
+    assert coalescer.flush() == 3
+    assert writer.pipe.executed == 1
+    assert ('btc', 'usd', 60000, 1, 3, 1, 3, 10) in writer.written
+    assert coalescer.candles == {}
+
+@pytest.mark.beforepop
+def test_candle_coalescer_failed_flush():
+    writer = FakeWriter(fail=True)
+    coalescer = CandleCoalescer(writer)
+    coalescer.add('btc', 'usd', 60000, 1, 1, 1, 1, 1)
+    with pytest.raises(ConnectionError):
+        coalescer.flush()
+    # Kept for the next flush, unless updated since
+    coalescer.add('btc', 'usd', 60000, 1, 2, 1, 2, 2)
+    assert coalescer.candles == {('btc', 'usd', 60000): (1, 2, 1, 2, 2)}
+
+
+class FakeSink:
+    def __init__(self):
+        self.rows = []
+
+    async def insert(self, rows, update=False):
+        self.rows.extend(rows)
+        return True
+
+
+@pytest.mark.beforepop
+def test_candle_coalescer_closed_candles():
+    coalescer = CandleCoalescer(FakeWriter(), sink=FakeSink())
+    # Closed by the exchange flag
+    coalescer.add('btc', 'usd', 60000, 1, 1, 1, 1, 1)
+    coalescer.add('btc', 'usd', 60000, 1, 2, 1, 2, 2, closed=True)
+    # Closed by the next candle of the same symbol
+    coalescer.add('eth', 'usd', 60000, 1, 1, 1, 1, 1)
+    coalescer.add('eth', 'usd', 120000, 2, 2, 2, 2, 2)
+    # Late update of a closed candle
+    coalescer.add('btc', 'usd', 60000, 1, 3, 1, 3, 3)
+    assert [candle[:3] for candle in coalescer.closed_candles] == [
+        ('btc', 'usd', 60000), ('eth', 'usd', 60000)
+    ]
+    assert coalescer.open_candles == {('eth', 'usd'): (120000, (2, 2, 2, 2, 2))}
+
+    async def flush_closed():
+        coalescer.flush_closed()
+        await asyncio.gather(*coalescer.insert_tasks)
+
+    asyncio.run(flush_closed())
+    assert coalescer.closed_candles == []
+    assert [(row[2], row[7]) for row in coalescer.sink.rows] == [('btc', 2), ('eth', 1)]
+
+
+@pytest.mark.beforepop
+def test_shard_manager_rebalance():
+    manager = WSShardManager(4, fill=0.5)
+    shards = manager.assign(f's{i}' for i in range(5))
+    assert [sorted(shard.symbols) for shard in shards] == \
+        [['s0', 's1'], ['s2', 's3'], ['s4']]
+    for shard in shards:
+        shard.connect()
+
+    # A connection down for long gives all of its symbols away
+    shards[2].disconnect()
+    shards[2].disconnected_at -= 60
+    assert manager.rebalance(10) == []
+    assert not shards[2].symbols
+    assert [command for command, _ in shards[0].commands._queue] == ['subscribe']
+
+    # A lagging connection sheds half of its symbols,
+    #   to a new connection if the others are full
+    shards[0].symbols.add('s5')
+    shards[1].symbols.update({'s7', 's8'})
+    shards[1].lag_secs = 30
+    added = manager.rebalance(10)
+    assert len(added) == 1 and added[0].symbols == {'s7', 's8'}
+    assert shards[1].symbols == {'s2', 's3'}
+    assert shards[1].commands.get_nowait() == ('unsubscribe', ['s7', 's8'])
+
+
+@pytest.mark.beforepop
+def test_shard_manager_relocate():
+    manager = WSShardManager(2)
+    shards = manager.assign(['a', 'b', 'c'])
+    shards[0].connect()
+    shards[1].connect()
+
+    # Connected shards with room take symbols first
+    assert manager.relocate(['b'], shards[0]) == []
+    assert shards[1].symbols == {'b', 'c'}
+    assert manager.relocate(['a'], shards[0], add_shard=False) == []
+    assert shards[0].symbols == {'a'}
+    added = manager.relocate(['a'], shards[0])
+    assert [shard.symbols for shard in added] == [{'a'}]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.sets = {}
+
+    def sadd(self, key, *values):
+        self.sets.setdefault(key, set()).update(values)
+
+
+@pytest.mark.beforepop
+def test_gap_filler():
+    redis_client = FakeRedis()
+    gap_filler = WSGapFiller(BinanceOHLCVFetcher, 'binance', redis_client)
+    now = time.time()
+    current = int(now // 60) * 60000
+    gap_filler.seen('ETHBTC', current - 5 * 60000)
+    gap_filler.seen('ETHBTC', current - 10 * 60000)
+    gap_filler.seen('BTCUSDT', current)
+
+    # Only missed minutes closed before now, once
+    assert gap_filler.windows(['ETHBTC', 'BTCUSDT', 'LTCBTC'], now) == \
+        [('ETHBTC', current - 5 * 60000, current - 60000)]
+    assert gap_filler.windows(['ETHBTC'], now) == []
+
+    # Older gaps go to the live lane too
+    gap_filler.seen('LTCBTC', current - 2 * 60000)
+    gap_filler.seen('XRPBTC', current - 180 * 60000)
+    assert gap_filler.fill(['LTCBTC', 'XRPBTC']) == 2
+    assert redis_client.sets == {
+        'ohlcvs_tofetch_binance_live': {
+            f'LTCBTC;;{current - 2 * 60000};;{current - 60000};;1m;;1000',
+            f'XRPBTC;;{current - 180 * 60000};;{current - 60000};;1m;;1000'
+        }
+    }
+
+
+@pytest.mark.beforepop
+def test_candle_message():
+    message = make_candle_message(
+        'binance', 'eth', 'btc', 60000, 1.5, 2, 1, 1.5, 10, ';;')
+    assert message == 'binance;;eth;;btc;;60000;;1.5;;2;;1;;1.5;;10'
+    assert parse_candle_message(message, ';;') == {
+        'exchange': 'binance', 'base_id': 'eth', 'quote_id': 'btc',
+        'time': '60000', 'open': '1.5', 'high': '2', 'low': '1',
+        'close': '1.5', 'volume': '10'
+    }
+
+
+async def collect_batches_recorded(ws, recorder):
+    batches = []
+    with pytest.raises(ConnectionError):
+        async for frames in iter_frame_batches(ws, recorder=recorder, connection=3):
+            batches.append(frames)
+    return batches
+
+@pytest.mark.beforepop
+def test_frame_recorder(tmp_path):
+    recorder = WSFrameRecorder(
+        str(tmp_path), 'binance',
+        meta=lambda: {'symbol_data': {'ETHBTC': {'base_id': 'ETH', 'quote_id': 'BTC'}}},
+        segment_secs=60
+    )
+    ws = FakeWebsocket(['{"a": 1}', '{"a": 2}'])
+    batches = asyncio.run(collect_batches_recorded(ws, recorder))
+    recorder.record(1, '{"a": 3}', recv_time=time.time() + 60)
+    recorder.close()
+
+    # A new segment is started after `segment_secs`
+    paths = sorted(os.path.join(tmp_path, name) for name in os.listdir(tmp_path))
+    assert len(paths) == 2
+    frames = []
+    for path in paths:
+        header, segment = read_frame_segment(path)
+        assert header['exchange'] == 'binance'
+        assert header['symbol_data']['ETHBTC']['base_id'] == 'ETH'
+        frames.extend(segment)
+    assert [frame for batch in batches for frame in batch] == ['{"a": 1}', '{"a": 2}']
+    assert [(connection, frame) for _, connection, frame in frames] == \
+        [(3, '{"a": 1}'), (3, '{"a": 2}'), (1, '{"a": 3}')]
+    assert frames[0][0] <= frames[1][0] < frames[2][0]
@@ -1,6 +1,6 @@
 from sqlalchemy import (
-    Column, DateTime, ForeignKeyConstraint, Index, Numeric,
-    SmallInteger, String, Table, Text
+    Boolean, Column, DateTime, ForeignKeyConstraint, Index, Numeric,
+    SmallInteger, String, Table, Text, text
 )
 from sqlalchemy.orm import relationship
 from common.config.constants import (
@@ -21,3 +21,6 @@ class OhlcvsError(Base):
     resp_status_code = Column(SmallInteger)
     exception_class = Column(Text, primary_key=True, nullable=False)
     exception_message = Column(Text)
+    retries = Column(SmallInteger, nullable=False, server_default=text("0"))
+    last_retry_at = Column(DateTime(True))
+    resolved = Column(Boolean, nullable=False, server_default=text("false"))
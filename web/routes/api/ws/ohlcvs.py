@@ -9,10 +9,12 @@ from web.config.constants import WS_SEND_EVENT_TYPES
 from web.routes.api.deps import get_db, get_redis
 from web.routes.api.ws.utils.senders import WSSender
 from web.routes.api.ws.utils.connections import WSConnectionManager
+from web.routes.api.ws.utils.listeners import CandleUpdateListener
 
 
 router = APIRouter()
 ws_manager = WSConnectionManager()
+candle_listener = CandleUpdateListener()
 
 @router.websocket("/ohlcvs")
 async def ws_ohlcvs(
@@ -22,7 +24,8 @@ async def ws_ohlcvs(
     ):
 
     await ws_manager.connect(websocket)
-    ws_sender = WSSender(ws_manager, websocket, redis_client, db)
+    ws_sender = WSSender(
+        ws_manager, websocket, redis_client, db, candle_listener)
     try:
         while True:
             input = await websocket.receive_json()
@@ -0,0 +1,130 @@
+# Backend WS API listeners utils
+
+import asyncio
+import logging
+import threading
+import redis
+from typing import Dict, Set, Tuple
+from common.config.constants import \
+    REDIS_HOST, REDIS_USER, REDIS_PASSWORD, REDIS_DELIMITER
+from fetchers.config.constants import WS_CANDLE_ALL_CHANNEL
+from fetchers.helpers.ws import make_candle_channel, parse_candle_message
+
+
+class CandleUpdateListener:
+    '''
+    Listens to candle updates published by the WS fetchers
+        over one Redis pub/sub connection per process
+
+    The connection is subscribed once to `WS_CANDLE_ALL_CHANNEL`,
+        and read by a listener thread started with the first subscriber;
+        Each update is routed in-process to the queues of its candle
+        channel, so subscribing and unsubscribing never touch the
+        connection (which is not thread-safe) nor block the event loop
+
+    The thread stops if the connection drops (e.g., on a Redis restart);
+        It is started again over a new connection by `ensure_started`,
+        which subscribers call
+    '''
+
+    def __init__(self, redis_client: redis.Redis = None, max_queued: int = 16):
+        '''
+        :params:
+            `redis_client`: Redis client (optional)
+            `max_queued`: int - max updates waiting in a queue;
+                The oldest update is dropped when it is full
+        '''
+
+        if not redis_client:
+            redis_client = redis.Redis(
+                host=REDIS_HOST,
+                username=REDIS_USER,
+                password=REDIS_PASSWORD,
+                decode_responses=True
+            )
+        self.redis_client = redis_client
+        self.max_queued = max_queued
+        self.pubsub = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.queues: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def ensure_started(self) -> None:
+        '''
+        Subscribes to `WS_CANDLE_ALL_CHANNEL` and starts the listener thread
+            if it is not running, over a new connection
+        '''
+
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            if self.thread is not None:
+                logging.warning("Candle listener: Thread stopped, restarting")
+            if self.pubsub is not None:
+                try:
+                    self.pubsub.close()
+                except Exception as exc:
+                    logging.warning(f"Candle listener: EXCEPTION: {exc}")
+            self.pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            self.pubsub.subscribe(**{WS_CANDLE_ALL_CHANNEL: self._on_message})
+            self.thread = self.pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def _on_message(self, message: dict) -> None:
+        '''
+        Puts a candle update in the queues of its candle channel;
+            Runs in the listener thread, which a malformed message
+            must not stop
+        '''
+
+        try:
+            data = parse_candle_message(message['data'], REDIS_DELIMITER)
+        except Exception as exc:
+            logging.warning(f"Candle listener: EXCEPTION: {exc}")
+            return
+        channel = make_candle_channel(
+            data['exchange'], data['base_id'], data['quote_id'], REDIS_DELIMITER)
+        with self.lock:
+            queues = list(self.queues.get(channel, ()))
+        for loop, queue in queues:
+            loop.call_soon_threadsafe(self._put, queue, data)
+
+    @staticmethod
+    def _put(queue: asyncio.Queue, data: dict) -> None:
+        '''
+        Puts `data` in `queue`, dropping the oldest update if it is full
+        '''
+
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(data)
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        '''
+        Returns a new queue of the candle updates of `channel`;
+            Must be called from the event loop that reads the queue;
+            (Re)starts the listener thread if it is not running
+
+        :params:
+            `channel`: string - candle channel (see `make_candle_channel`)
+        '''
+
+        queue = asyncio.Queue(self.max_queued)
+        with self.lock:
+            self.queues.setdefault(channel, set()) \
+                .add((asyncio.get_running_loop(), queue))
+        self.ensure_started()
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue) -> None:
+        '''
+        Stops putting the candle updates of `channel` in `queue`
+        '''
+
+        with self.lock:
+            queues = self.queues.get(channel)
+            if queues is None:
+                return
+            queues.difference_update(
+                [item for item in queues if item[1] is queue])
+            if not queues:
+                del self.queues[channel]
@@ -8,11 +8,12 @@ from sqlalchemy.orm import Session
 from fastapi import WebSocket
 from common.config.constants import REDIS_DELIMITER
 from common.utils.asyncioutils import AsyncLoopThread
-from fetchers.helpers.ws import make_serve_redis_key
+from fetchers.helpers.ws import make_candle_channel, make_serve_redis_key
 from web.config.constants import OHLCV_INTERVALS
 from web.routes.api.rest.utils.readers import read_ohlcvs
 from web.routes.api.ws.utils.parsers import parse_ohlcv
 from web.routes.api.ws.utils.connections import WSConnectionManager
+from web.routes.api.ws.utils.listeners import CandleUpdateListener
 
 
 class WSSender:
@@ -25,7 +26,8 @@ class WSSender:
             ws_manager: WSConnectionManager,
             ws: WebSocket,
             redis_client: Redis,
-            db: Session
+            db: Session,
+            candle_listener: CandleUpdateListener = None
         ):
         self.loop_handler = AsyncLoopThread()
         self.loop_handler.start()
@@ -33,6 +35,7 @@ class WSSender:
         self.ws = ws
         self.redis_client = redis_client
         self.db = db
+        self.candle_listener = candle_listener
         self.serving_ids: List[str] = []
         
     async def _send_ohlcv(
@@ -63,6 +66,12 @@ class WSSender:
         # TODO: This serving_id is not unique among different users/clients
         serving_id = f'ohlcv_{exchange}_{base_id}_{quote_id}_{interval}'
         self.serving_ids.append(serving_id)
+
+        # With a candle listener, "1m" data are pushed
+        #   as the WS fetchers publish them
+        if interval == "1m" and self.candle_listener is not None:
+            await self._push_ohlcv(exchange, base_id, quote_id, serving_id, mls)
+            return
         
         while self.ws in self.ws_manager.active_connections and \
             serving_id in self.serving_ids:
@@ -119,6 +128,49 @@ class WSSender:
                 elif interval == "7D":
                     await asyncio.sleep(10080)
    
+    async def _push_ohlcv(
+            self,
+            exchange: str,
+            base_id: str,
+            quote_id: str,
+            serving_id: str,
+            mls: bool = True
+        ) -> None:
+        '''
+        Private coroutine that sends the latest OHLCV from Redis hash,
+            then every update published on its candle channel
+            until `serving_id` stops being served
+
+        Without an update for a second, the hash is read again (and sent
+            if it changed), so a stopped listener cannot stall the client
+        '''
+
+        channel = make_candle_channel(exchange, base_id, quote_id, REDIS_DELIMITER)
+        serve_key = make_serve_redis_key(exchange, base_id, quote_id, REDIS_DELIMITER)
+        queue = self.candle_listener.subscribe(channel)
+        try:
+            # Subscribed before reading the hash so no update is missed
+            data = self.redis_client.hgetall(serve_key)
+            sent = None
+            while self.ws in self.ws_manager.active_connections and \
+                serving_id in self.serving_ids:
+                if data:
+                    try:
+                        ohlcv = parse_ohlcv(data, mls)
+                        if ohlcv != sent:
+                            await self.ws.send_json(ohlcv)
+                            sent = ohlcv
+                    except Exception as exc:
+                        logging.warning(f"Send OHLCV: EXCEPTION: {exc}")
+                # Wake up every second to check if still serving
+                try:
+                    data = await asyncio.wait_for(queue.get(), timeout=1)
+                except asyncio.TimeoutError:
+                    self.candle_listener.ensure_started()
+                    data = self.redis_client.hgetall(serve_key)
+        finally:
+            self.candle_listener.unsubscribe(channel, queue)
+
     async def _stopsend_ohlcv(
             self, exchange: str, base_id: str, quote_id: str, interval: str
         ) -> None: